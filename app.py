@@ -1,6 +1,7 @@
 import streamlit as st
 
 from src.core.db import init_db
+from src.core.tokens import warm_encoders
 from src.core.config import get_settings
 from src.repos.users_repo import get_user_by_email, create_user
 from src.core.ui import sidebar_status, page_header
@@ -14,6 +15,7 @@ st.set_page_config(
 
 # --- Boot ---
 init_db()
+warm_encoders()  # tokenizer em segundo plano, fora do primeiro turno de chat
 
 
 def ensure_admin():
@@ -1,28 +1,29 @@
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 from src.auth.rbac import require_roles, ROLE_USER, ROLE_ADMIN
 from src.core.config import get_settings
-from src.repos.agents_repo import (
-    create_agent,
-    list_agents_by_user,
-    get_agent,
-    update_agent,
+from src.repos.chat_repo import record_test_turn, search_chats
+from src.repos.session_cache import RepoCache
+from src.agents.service import (
+    attach_pdf,
+    compare_agent_models,
+    estimate_agent_chat,
+    get_cached_reply,
+    response_cache_enabled,
+    response_cache_key,
+    save_cached_reply,
+    stream_agent_chat,
 )
-from src.repos.chat_repo import (
-    get_messages,
-    add_message,
-    add_chat_test_message,
-    create_chat,
-    list_chats,
-    get_chat,
-    update_previous_response_id,
-    update_conversation_topic_summary,
-    rename_chat,
-)
-from src.agents.service import run_agent_chat, upload_pdf, generate_compliance_summary
+from src.agents.summary_worker import enqueue_compliance_summary
 from src.core.db import init_db
+from src.core.tokens import warm_encoders
 
 from src.core.ui import sidebar_status, page_header
 
+# Migrações do schema (roda de fato só uma vez por processo; nos reruns é O(1))
+init_db()
+warm_encoders()
+
 sidebar_status()
 require_roles({ROLE_USER, ROLE_ADMIN})
 
@@ -45,14 +46,213 @@ if "edit_popup_chat_messages" not in st.session_state:
         {"role": "assistant", "content": "Olá! Como posso ajudar?"},
     ]
 
+
+def _repo() -> RepoCache:
+    """Cache da sessao para agentes, chats e mensagens (recriado se o usuario muda)."""
+    cache = st.session_state.get("repo_cache")
+    if cache is None or cache.user_id != user_id:
+        cache = RepoCache(user_id)
+        st.session_state["repo_cache"] = cache
+    return cache
+
+
 def _ensure_openai_key() -> bool:
-    settings = get_settings()
-    if not settings.get("OPENAI_API_KEY"):
+    if not get_settings().openai_api_key:
         st.error("OPENAI_API_KEY nao configurada.")
         return False
     return True
 
 
+def _stream_agent_reply(agent_cfg, prompt, previous_response_id=None, file_id=None, document_text=None):
+    """Mostra o prompt e escreve a resposta do agente conforme chega (st.write_stream).
+    Retorna (texto, response_id, usage) como run_agent_chat, depois do fim do stream."""
+    with st.chat_message("user"):
+        st.write(prompt)
+    with st.chat_message("assistant"):
+        stream = stream_agent_chat(
+            agent_cfg,
+            prompt,
+            previous_response_id=previous_response_id,
+            file_id=file_id,
+            document_text=document_text,
+        )
+        st.write_stream(stream)
+    return stream.text, stream.response_id, stream.usage
+
+
+def _show_cached_reply(prompt, cached):
+    """Exibe uma resposta do cache no lugar do stream; o uso entra com 0 tokens."""
+    with st.chat_message("user"):
+        st.write(prompt)
+    with st.chat_message("assistant"):
+        st.write(cached["output_text"])
+        st.caption("Resposta reaproveitada do cache (0 tokens).")
+    return cached["output_text"], cached["response_id"], {"input_tokens": 0, "output_tokens": 0}
+
+
+# Paineis de conversa rodam como fragmentos: enviar mensagem, paginar ou trocar de
+# chat reexecuta so o painel, nao a pagina inteira (nem fecha o popup).
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda f: f)
+
+
+def _rerun_pane():
+    """Reexecuta so o fragmento atual; fora de um rerun de fragmento, a pagina toda."""
+    try:
+        st.rerun(scope="fragment")
+    except (StreamlitAPIException, TypeError):
+        st.rerun()
+
+
+@_fragment
+def _render_test_chat(prefix, messages_key, config_keys, defaults, agent_id=None, greeting="Olá! Como posso ajudar?"):
+    """Chat Testes (em memoria) com a config lida das chaves de sessao do formulario ao lado."""
+    st.subheader("Chat Testes")
+    if messages_key not in st.session_state:
+        st.session_state[messages_key] = [
+            {"role": "user", "content": "Olá!"},
+            {"role": "assistant", "content": greeting},
+        ]
+    messages = st.session_state[messages_key]
+    for msg in messages:
+        with st.chat_message(msg["role"]):
+            st.write(msg["content"])
+    pdf_file = st.file_uploader("Anexar PDF (opcional)", type=["pdf"], key=f"{prefix}pdf_upload")
+    use_cache = st.checkbox(
+        "Reusar respostas para mensagens repetidas (mesma config)",
+        value=response_cache_enabled(),
+        key=f"{prefix}use_cache",
+        help="Com o cache ligado cada mensagem é respondida sem o histórico do teste.",
+    )
+    if prompt := st.chat_input("Digite sua mensagem...", key=f"{prefix}chat_input"):
+        if not _ensure_openai_key():
+            return
+        attachment = {"file_id": None, "document_text": None}
+        if pdf_file:
+            try:
+                attachment = attach_pdf(pdf_file, prompt)
+            except Exception as e:
+                st.error(f"Erro ao enviar PDF: {e}")
+                return
+        messages.append({"role": "user", "content": prompt})
+        agent_cfg = {field: st.session_state.get(key, defaults[field]) for field, key in config_keys.items()}
+        prev_key = f"{prefix}prev_response_id"
+        # Com cache, sem historico: a resposta depende so da config, da mensagem e do anexo.
+        prev_id = None if use_cache else st.session_state.get(prev_key)
+        cache_key = (
+            response_cache_key(agent_cfg, prompt, user_id=user_id, agent_id=agent_id, **attachment) if use_cache else None
+        )
+        cached = get_cached_reply(cache_key) if cache_key else None
+        try:
+            if cached:
+                reply, resp_id, _usage = _show_cached_reply(prompt, cached)
+            else:
+                reply, resp_id, _usage = _stream_agent_reply(
+                    agent_cfg,
+                    prompt,
+                    previous_response_id=prev_id,
+                    **attachment,
+                )
+                if cache_key:
+                    save_cached_reply(
+                        cache_key, reply, resp_id, agent_cfg.get("model"), agent_id=agent_id, user_id=user_id
+                    )
+            messages.append({"role": "assistant", "content": reply})
+            # O response_id do cache e de outra chamada: nunca vira o contexto da proxima.
+            st.session_state[prev_key] = None if cached else resp_id
+            input_tok = _usage.get("input_tokens") if _usage else None
+            output_tok = _usage.get("output_tokens") if _usage else None
+        except Exception as e:
+            reply = f"Erro ao consultar o modelo: {e}"
+            messages.append({"role": "assistant", "content": reply})
+            input_tok = output_tok = None
+        record_test_turn(
+            user_id,
+            prompt,
+            reply,
+            agent_id=agent_id,
+            input_tokens=input_tok,
+            output_tokens=output_tok,
+            has_attachment=bool(pdf_file),
+            attachment_filename=pdf_file.name if pdf_file else None,
+            model=agent_cfg.get("model"),
+            agent_name=agent_cfg.get("name"),
+        )
+        _rerun_pane()
+
+
+def _render_estimate(model, max_tokens, system_prompt):
+    """Tokens e custo de uma mensagem ao agente, estimados localmente (sem chamar a API)."""
+    est = estimate_agent_chat({"model": model, "max_tokens": max_tokens, "system_prompt": system_prompt})
+    st.caption(
+        f"Por mensagem: ~{est['input_tokens']} tokens de entrada fixos (system prompt) · "
+        f"teto {est['limit']:,} · até US$ {est['cost']:.4f} com a resposta no máximo"
+    )
+
+
+# Variantes (modelo x temperatura) por comparacao; as chamadas rodam em paralelo.
+COMPARE_MAX_VARIANTS = 6
+
+
+@_fragment
+def _render_model_comparison(prefix, config_keys, defaults, agent_id=None):
+    """Mesma mensagem para varios modelos/temperaturas de uma vez, respostas lado a lado."""
+    with st.expander("Comparar modelos"):
+        agent_cfg = {field: st.session_state.get(key, defaults[field]) for field, key in config_keys.items()}
+        current_temp = round(float(agent_cfg["temperature"]), 1)
+        model_options = ["gpt-4o", "gpt-4o-mini", "gpt-3.5-turbo"]
+        if agent_cfg["model"] not in model_options:
+            model_options.append(agent_cfg["model"])
+        models = st.multiselect(
+            "Modelos",
+            options=model_options,
+            default=[agent_cfg["model"]],
+            key=f"{prefix}cmp_models",
+        )
+        temperatures = st.multiselect(
+            "Temperaturas",
+            options=sorted({0.0, 0.2, 0.5, 0.7, 1.0, current_temp}),
+            default=[current_temp],
+            key=f"{prefix}cmp_temps",
+        )
+        prompt = st.text_area("Mensagem", key=f"{prefix}cmp_prompt").strip()
+        variants = [{"model": m, "temperature": t} for m in models for t in temperatures]
+        if len(variants) > COMPARE_MAX_VARIANTS:
+            st.warning(f"Escolha no máximo {COMPARE_MAX_VARIANTS} combinações de modelo e temperatura.")
+        ready = prompt and variants and len(variants) <= COMPARE_MAX_VARIANTS
+        if st.button("Comparar", key=f"{prefix}cmp_run", disabled=not ready, width="stretch"):
+            if not _ensure_openai_key():
+                return
+            with st.spinner(f"Consultando {len(variants)} variantes em paralelo..."):
+                results = compare_agent_models(agent_cfg, prompt, variants)
+            for result in results:
+                usage = result["usage"] or {}
+                record_test_turn(
+                    user_id,
+                    prompt,
+                    result["text"] if not result["error"] else f"Erro ao consultar o modelo: {result['error']}",
+                    agent_id=agent_id,
+                    input_tokens=usage.get("input_tokens"),
+                    output_tokens=usage.get("output_tokens"),
+                    model=result["model"],
+                    agent_name=agent_cfg.get("name"),
+                )
+            st.session_state[f"{prefix}cmp_results"] = results
+
+        results = st.session_state.get(f"{prefix}cmp_results")
+        if results:
+            for col, result in zip(st.columns(len(results)), results):
+                with col:
+                    usage = result["usage"] or {}
+                    st.markdown(f"**{result['model']}** · temp. {result['temperature']}")
+                    st.caption(
+                        f"{result['latency']:.1f}s · {usage.get('input_tokens') or 0} + "
+                        f"{usage.get('output_tokens') or 0} tokens · US$ {result['cost']:.4f}"
+                    )
+                    if result["error"]:
+                        st.error(result["error"])
+                    else:
+                        st.write(result["text"])
+
 
 def _render_chat_config_and_messages(prefix=""):
     """Renderiza Chat Config e Chat Messages em colunas (usado dentro do popup)."""
@@ -65,9 +265,9 @@ def _render_chat_config_and_messages(prefix=""):
         max_tokens = st.slider("Max Tokens", min_value=100, max_value=1000, value=100, step=100, key=f"{prefix}tokens")
         temperature = st.slider("Temperature", min_value=0.0, max_value=1.0, value=0.5, step=0.1, key=f"{prefix}temp")
         st.text_area("System Prompt", value="You are a helpful assistant.", key=f"{prefix}system")
+        _render_estimate(st.session_state.get(f"{prefix}model", "gpt-4o"), max_tokens, st.session_state.get(f"{prefix}system", ""))
         if st.button("Save Config", width="stretch", key=f"{prefix}save"):
-            create_agent(
-                user_id=user_id,
+            _repo().create_agent(
                 name=st.session_state.get(f"{prefix}agent_name", "Agent"),
                 description=st.session_state.get(f"{prefix}agent_desc", ""),
                 model=st.session_state.get(f"{prefix}model", "gpt-4o"),
@@ -78,109 +278,118 @@ def _render_chat_config_and_messages(prefix=""):
             st.success("Agente salvo.")
             st.rerun()
 
+    config_keys = {
+        "name": f"{prefix}agent_name",
+        "description": f"{prefix}agent_desc",
+        "model": f"{prefix}model",
+        "max_tokens": f"{prefix}tokens",
+        "temperature": f"{prefix}temp",
+        "system_prompt": f"{prefix}system",
+    }
+    defaults = {
+        "name": "Agent",
+        "description": "",
+        "model": "gpt-4o",
+        "max_tokens": 100,
+        "temperature": 0.5,
+        "system_prompt": "You are a helpful assistant.",
+    }
     with col_chat:
-        st.subheader("Chat Testes")
-        if "chat_messages" not in st.session_state:
-            st.session_state.chat_messages = [
-                {"role": "user", "content": "Olá!"},
-                {"role": "assistant", "content": "Olá! Como posso ajudar você hoje?"},
-            ]
-        for msg in st.session_state.chat_messages:
-            with st.chat_message(msg["role"]):
-                st.write(msg["content"])
-        pdf_file = st.file_uploader("Anexar PDF (opcional)", type=["pdf"], key=f"{prefix}pdf_upload")
-        if prompt := st.chat_input("Digite sua mensagem...", key=f"{prefix}chat_input"):
-            if not _ensure_openai_key():
-                if prefix == "popup_":
-                    st.session_state["reopen_popup"] = "config"
-                st.rerun()
-            st.session_state.chat_messages.append({"role": "user", "content": prompt})
-            file_id = None
-            if pdf_file:
-                try:
-                    file_id = upload_pdf(pdf_file)
-                except Exception as e:
-                    st.error(f"Erro ao enviar PDF: {e}")
-                    if prefix == "popup_":
-                        st.session_state["reopen_popup"] = "config"
-                    st.rerun()
-            agent_cfg = {
-                "name": st.session_state.get(f"{prefix}agent_name", "Agent"),
-                "description": st.session_state.get(f"{prefix}agent_desc", ""),
-                "model": st.session_state.get(f"{prefix}model", "gpt-4o"),
-                "max_tokens": st.session_state.get(f"{prefix}tokens", 100),
-                "temperature": st.session_state.get(f"{prefix}temp", 0.5),
-                "system_prompt": st.session_state.get(f"{prefix}system", "You are a helpful assistant."),
-            }
-            prev_key = f"{prefix}prev_response_id"
-            prev_id = st.session_state.get(prev_key)
-            try:
-                with st.spinner("Consultando o agente..."):
-                    reply, resp_id, _usage = run_agent_chat(
-                        agent_cfg,
-                        prompt,
-                        previous_response_id=prev_id,
-                        file_id=file_id,
-                    )
-                st.session_state.chat_messages.append({"role": "assistant", "content": reply})
-                st.session_state[prev_key] = resp_id
-                input_tok = _usage.get("input_tokens") if _usage else None
-                output_tok = _usage.get("output_tokens") if _usage else None
-                add_chat_test_message(
-                    user_id=user_id,
-                    role="user",
-                    content=prompt,
-                    agent_id=None,
-                    tokens=input_tok,
-                    has_attachment=bool(file_id),
-                    attachment_filename=pdf_file.name if pdf_file else None,
-                    model=agent_cfg.get("model"),
-                    agent_name=agent_cfg.get("name"),
-                )
-                add_chat_test_message(
-                    user_id=user_id,
-                    role="assistant",
-                    content=reply,
-                    agent_id=None,
-                    tokens=output_tok,
-                    model=agent_cfg.get("model"),
-                    agent_name=agent_cfg.get("name"),
-                )
-            except Exception as e:
-                st.session_state.chat_messages.append({
-                    "role": "assistant",
-                    "content": f"Erro ao consultar o modelo: {e}",
-                })
-                add_chat_test_message(
-                    user_id=user_id,
-                    role="user",
-                    content=prompt,
-                    agent_id=None,
-                    has_attachment=bool(file_id),
-                    attachment_filename=pdf_file.name if pdf_file else None,
-                    model=agent_cfg.get("model"),
-                    agent_name=agent_cfg.get("name"),
-                )
-                add_chat_test_message(
-                    user_id=user_id,
-                    role="assistant",
-                    content=f"Erro ao consultar o modelo: {e}",
-                    agent_id=None,
-                    model=agent_cfg.get("model"),
-                    agent_name=agent_cfg.get("name"),
-                )
-            if prefix == "popup_":
-                st.session_state["reopen_popup"] = "config"
-            st.rerun()
+        _render_test_chat(prefix, "chat_messages", config_keys, defaults, greeting="Olá! Como posso ajudar você hoje?")
+        _render_model_comparison(prefix, config_keys, defaults)
+
 
 # Tamanho do popup: "small" (500px), "medium" (750px), "large" (1280px)
 DIALOG_WIDTH = "large"
 
+# Mensagens por pagina do chat e teto de mensagens renderizadas por rerun
+MESSAGES_PAGE = 30
+MESSAGES_MAX_RENDERED = 120
+
+
+def _render_conversation(prefix: str, agent, chat_id: int):
+    """Conversa aberta: janela de mensagens, anexo e input. Roda dentro do fragmento de
+    Acessar Chat: enviar reexecuta o painel todo, com o historico de chats ja atualizado."""
+    st.caption(f"Agente: **{agent['name']}** · Modelo: {agent['model']}")
+    # Janela de mensagens: so as mais recentes sao lidas e renderizadas a cada rerun.
+    window_key = f"{prefix}msg_window"
+    window = st.session_state.get(window_key)
+    if not window or window["chat_id"] != chat_id:
+        window = {"chat_id": chat_id, "limit": MESSAGES_PAGE, "before": None}
+        st.session_state[window_key] = window
+    page = _repo().get_message_page(chat_id, before_id=window["before"], limit=window["limit"])
+    messages = page["messages"]
+    if not messages and window["before"] is None:
+        _repo().add_message(chat_id, "assistant", f"Olá! Sou o agente **{agent['name']}**. Como posso ajudar?")
+        page = _repo().get_message_page(chat_id, limit=window["limit"])
+        messages = page["messages"]
+    if page["has_older"]:
+        if st.button("↑ Carregar mensagens anteriores", key=f"{prefix}load_older"):
+            if window["limit"] < MESSAGES_MAX_RENDERED:
+                window["limit"] = min(window["limit"] + MESSAGES_PAGE, MESSAGES_MAX_RENDERED)
+            else:
+                # Janela cheia: desliza para tras, descartando as mais novas da tela.
+                window["before"] = messages[-MESSAGES_PAGE]["id"]
+            _rerun_pane()
+    for msg in messages:
+        with st.chat_message(msg["role"]):
+            st.write(msg["content"])
+    if window["before"] is not None:
+        if st.button("↓ Ir para as mensagens recentes", key=f"{prefix}load_newest"):
+            st.session_state.pop(window_key, None)
+            _rerun_pane()
+    pdf_conv = st.file_uploader("Anexar PDF (opcional)", type=["pdf"], key=f"{prefix}conv_pdf")
+    if prompt := st.chat_input("Digite sua mensagem...", key=f"{prefix}input"):
+        if not _ensure_openai_key():
+            return
+        chat = _repo().get_chat(chat_id)
+        prev_id = chat.get("previous_response_id") if chat else None
+        attachment = {"file_id": None, "document_text": None}
+        if pdf_conv:
+            try:
+                attachment = attach_pdf(pdf_conv, prompt)
+            except Exception as e:
+                st.error(f"Erro ao enviar PDF: {e}")
+                return
+        try:
+            reply, resp_id, usage = _stream_agent_reply(
+                agent,
+                prompt,
+                previous_response_id=prev_id,
+                **attachment,
+            )
+            input_tokens = usage.get("input_tokens") if usage else None
+            output_tokens = usage.get("output_tokens") if usage else None
+            attachment_name = getattr(pdf_conv, "name", None) if pdf_conv else None
+            # Um commit por turno: mensagens, uso, response id e updated_at juntos.
+            _repo().record_turn(
+                chat_id,
+                prompt,
+                reply,
+                input_tokens=input_tokens,
+                output_tokens=output_tokens,
+                has_attachment=bool(pdf_conv),
+                attachment_filename=attachment_name,
+                previous_response_id=resp_id,
+            )
+            st.session_state.pop(window_key, None)
+
+            # Persistimos apenas um resumo temático (sem PII/sem trechos verbatim) por chat para Compliance.
+            # O resumo é gerado em segundo plano para não atrasar a resposta.
+            try:
+                enqueue_compliance_summary(chat_id, user_id)
+            except Exception:
+                pass
+        except Exception as e:
+            st.error(f"Erro ao consultar o modelo: {e}")
+            return
+        _rerun_pane()
+
 
+@_fragment
 def _render_access_chat(prefix: str):
     """Acessar Chat: seleção de agente → por agente: Novo chat ou ver histórico de chats."""
-    init_db()  # garante que tabelas chats/chat_messages existem (ex.: após atualização do schema)
-    saved = list_agents_by_user(user_id)
+    saved = _repo().list_agents()
     if not saved:
         st.warning("Nenhum agente salvo. Use **Configurar Agente** e **Save Config** para criar um.")
         return
@@ -205,88 +414,18 @@ def _render_access_chat(prefix: str):
 
     if not chat_id:
         if st.button("Novo chat", key=f"{prefix}new_chat", width="stretch"):
-            new_chat_id = create_chat(user_id, agent_id)
+            new_chat_id = _repo().create_chat(agent_id)
             st.session_state[key_chat] = new_chat_id
-            if prefix == "access_popup_":
-                st.session_state["reopen_popup"] = "access_chat"
-            st.rerun()
+            _rerun_pane()
 
     if chat_id:
         # Modo conversa: mostra mensagens e input; botão Voltar para lista de chats
         if st.button("← Voltar para lista de chats", key=f"{prefix}back_chats"):
             st.session_state.pop(key_chat, None)
-            if prefix == "access_popup_":
-                st.session_state["reopen_popup"] = "access_chat"
-            st.rerun()
-        st.caption(f"Agente: **{agent['name']}** · Modelo: {agent['model']}")
-        messages = get_messages(chat_id)
-        if not messages:
-            add_message(chat_id, "assistant", f"Olá! Sou o agente **{agent['name']}**. Como posso ajudar?")
-            messages = get_messages(chat_id)
-        for msg in messages:
-            with st.chat_message(msg["role"]):
-                st.write(msg["content"])
-        pdf_conv = st.file_uploader("Anexar PDF (opcional)", type=["pdf"], key=f"{prefix}conv_pdf")
-        if prompt := st.chat_input("Digite sua mensagem...", key=f"{prefix}input"):
-            if not _ensure_openai_key():
-                if prefix == "access_popup_":
-                    st.session_state["reopen_popup"] = "access_chat"
-                st.rerun()
-            chat = get_chat(chat_id, user_id)
-            prev_id = chat.get("previous_response_id") if chat else None
-            file_id = None
-            if pdf_conv:
-                try:
-                    file_id = upload_pdf(pdf_conv)
-                except Exception as e:
-                    st.error(f"Erro ao enviar PDF: {e}")
-                    if prefix == "access_popup_":
-                        st.session_state["reopen_popup"] = "access_chat"
-                    st.rerun()
-            try:
-                with st.spinner("Consultando o agente..."):
-                    reply, resp_id, usage = run_agent_chat(
-                        agent,
-                        prompt,
-                        previous_response_id=prev_id,
-                        file_id=file_id,
-                    )
-                input_tokens = usage.get("input_tokens") if usage else None
-                output_tokens = usage.get("output_tokens") if usage else None
-                attachment_name = getattr(pdf_conv, "name", None) if file_id else None
-                add_message(
-                    chat_id,
-                    "user",
-                    prompt,
-                    tokens=input_tokens,
-                    has_attachment=bool(file_id),
-                    attachment_filename=attachment_name,
-                )
-                add_message(chat_id, "assistant", reply, tokens=output_tokens)
-                update_previous_response_id(chat_id, user_id, resp_id)
-
-                # Persistimos apenas um resumo temático (sem PII/sem trechos verbatim) por chat para Compliance.
-                try:
-                    topic_summary = generate_compliance_summary(
-                        (messages or [])
-                        + [
-                            {"role": "user", "content": prompt},
-                            {"role": "assistant", "content": reply},
-                        ]
-                    )
-                except Exception:
-                    topic_summary = "(resumo indisponível)"
-                try:
-                    update_conversation_topic_summary(chat_id, user_id, topic_summary)
-                except Exception:
-                    pass
-            except Exception as e:
-                st.error(f"Erro ao consultar o modelo: {e}")
-            if prefix == "access_popup_":
-                st.session_state["reopen_popup"] = "access_chat"
-            st.rerun()
+            _rerun_pane()
+        _render_conversation(prefix, agent, chat_id)
 
-    chats = list_chats(user_id, agent_id)
+    chats = _repo().list_chats(agent_id)
     if chats:
         st.subheader("Histórico de chats")
 
@@ -297,7 +436,7 @@ def _render_access_chat(prefix: str):
             if current:
                 current_title = current["title"]
             else:
-                chat_row = get_chat(rename_id, user_id)
+                chat_row = _repo().get_chat(rename_id)
                 current_title = chat_row["title"] if chat_row else ""
             st.markdown("**Renomear chat**")
             new_title = st.text_input(
@@ -309,20 +448,55 @@ def _render_access_chat(prefix: str):
             with col_save:
                 if st.button("Salvar", key=f"{prefix}rename_save", width="stretch"):
                     if new_title.strip():
-                        rename_chat(rename_id, user_id, new_title.strip())
+                        _repo().rename_chat(rename_id, new_title.strip())
                     st.session_state.pop(rename_key, None)
-                    if prefix == "access_popup_":
-                        st.session_state["reopen_popup"] = "access_chat"
-                    st.rerun()
+                    _rerun_pane()
             with col_cancel:
                 if st.button("Cancelar", key=f"{prefix}rename_cancel", width="stretch"):
                     st.session_state.pop(rename_key, None)
-                    if prefix == "access_popup_":
-                        st.session_state["reopen_popup"] = "access_chat"
-                    st.rerun()
+                    _rerun_pane()
+            st.divider()
+
+        search = st.text_input(
+            "Buscar nos chats",
+            key=f"{prefix}search",
+            placeholder="Palavras no título, no resumo ou nas mensagens",
+        ).strip()
+        page_key = f"{prefix}search_page"
+        if st.session_state.get(f"{prefix}search_term") != search:
+            st.session_state[f"{prefix}search_term"] = search
+            st.session_state[page_key] = 1
+        if search:
+            found = search_chats(
+                user_id,
+                search,
+                agent_id=agent_id,
+                page=st.session_state.get(page_key, 1),
+                page_size=10,
+            )
+            if not found["rows"]:
+                st.caption("Nenhum chat encontrado.")
+            for hit in found["rows"]:
+                col_info, col_open = st.columns([4, 1])
+                with col_info:
+                    st.markdown(f"**{hit['title']}**")
+                    st.markdown(hit["snippet"])
+                with col_open:
+                    if st.button("Abrir", key=f"{prefix}hit_{hit['id']}", width="stretch"):
+                        st.session_state[key_chat] = hit["id"]
+                        _rerun_pane()
+            if found["pages"] > 1:
+                st.session_state[page_key] = found["page"]
+                st.number_input(
+                    f"Página (de {found['pages']})",
+                    min_value=1,
+                    max_value=found["pages"],
+                    step=1,
+                    key=page_key,
+                )
             st.divider()
 
-        for c in chats:
+        for c in [] if search else chats:
             with st.container():
                 col_info, col_open, col_rename = st.columns([3, 1, 1])
                 with col_info:
@@ -331,15 +505,11 @@ def _render_access_chat(prefix: str):
                 with col_open:
                     if st.button("Abrir", key=f"{prefix}open_{c['id']}", width="stretch"):
                         st.session_state[key_chat] = c["id"]
-                        if prefix == "access_popup_":
-                            st.session_state["reopen_popup"] = "access_chat"
-                        st.rerun()
+                        _rerun_pane()
                 with col_rename:
                     if st.button("Renomear", key=f"{prefix}rename_{c['id']}", width="stretch"):
                         st.session_state[rename_key] = c["id"]
-                        if prefix == "access_popup_":
-                            st.session_state["reopen_popup"] = "access_chat"
-                        st.rerun()
+                        _rerun_pane()
                 st.divider()
     else:
         st.info("Nenhum chat ainda. Clique em **Novo chat** para come?ar.")
@@ -386,9 +556,8 @@ if _dialog_decorator is not None:
             col_s, col_c = st.columns(2)
             with col_s:
                 if st.button("Salvar alterações", width="stretch", key="edit_popup_save"):
-                    update_agent(
-                        agent_id=agent["id"],
-                        user_id=user_id,
+                    _repo().update_agent(
+                        agent["id"],
                         name=st.session_state.get("edit_popup_name", agent.get("name", "Agent")),
                         description=st.session_state.get("edit_popup_desc", agent.get("description", "")),
                         model=st.session_state.get("edit_popup_model", agent.get("model", "gpt-4o")),
@@ -416,105 +585,34 @@ if _dialog_decorator is not None:
             max_tokens = st.slider("Max Tokens", min_value=100, max_value=1000, value=agent.get("max_tokens", 100), step=100, key="edit_popup_tokens")
             temperature = st.slider("Temperature", min_value=0.0, max_value=1.0, value=float(agent.get("temperature", 0.5)), step=0.1, key="edit_popup_temp")
             system_prompt = st.text_area("System Prompt", value=agent.get("system_prompt", ""), key="edit_popup_system")
-
+            _render_estimate(model, max_tokens, system_prompt)
+
+        config_keys = {
+            "name": "edit_popup_name",
+            "description": "edit_popup_desc",
+            "model": "edit_popup_model",
+            "max_tokens": "edit_popup_tokens",
+            "temperature": "edit_popup_temp",
+            "system_prompt": "edit_popup_system",
+        }
+        defaults = {
+            "name": agent.get("name", "Agent"),
+            "description": agent.get("description", ""),
+            "model": agent.get("model", "gpt-4o"),
+            "max_tokens": agent.get("max_tokens", 100),
+            "temperature": agent.get("temperature", 0.5),
+            "system_prompt": agent.get("system_prompt", ""),
+        }
         with col_chat:
-            st.subheader("Chat Testes")
-            if "edit_popup_chat_messages" not in st.session_state:
-                st.session_state.edit_popup_chat_messages = [
-                    {"role": "user", "content": "Olá!"},
-                    {"role": "assistant", "content": "Olá! Como posso ajudar?"},
-                ]
-            for msg in st.session_state.edit_popup_chat_messages:
-                with st.chat_message(msg["role"]):
-                    st.write(msg["content"])
-            pdf_edit = st.file_uploader("Anexar PDF (opcional)", type=["pdf"], key="edit_popup_pdf")
-            if prompt := st.chat_input("Digite sua mensagem...", key="edit_popup_chat_input"):
-                if not _ensure_openai_key():
-                    st.session_state["reopen_popup"] = "edit_agent"
-                    st.rerun()
-                st.session_state.edit_popup_chat_messages.append({"role": "user", "content": prompt})
-                file_id = None
-                if pdf_edit:
-                    try:
-                        file_id = upload_pdf(pdf_edit)
-                    except Exception as e:
-                        st.error(f"Erro ao enviar PDF: {e}")
-                        st.session_state["reopen_popup"] = "edit_agent"
-                        st.rerun()
-                agent_cfg = {
-                    "name": st.session_state.get("edit_popup_name", agent.get("name", "Agent")),
-                    "description": st.session_state.get("edit_popup_desc", agent.get("description", "")),
-                    "model": st.session_state.get("edit_popup_model", agent.get("model", "gpt-4o")),
-                    "max_tokens": st.session_state.get("edit_popup_tokens", agent.get("max_tokens", 100)),
-                    "temperature": st.session_state.get("edit_popup_temp", agent.get("temperature", 0.5)),
-                    "system_prompt": st.session_state.get("edit_popup_system", agent.get("system_prompt", "")),
-                }
-                prev_key = "edit_popup_prev_response_id"
-                prev_id = st.session_state.get(prev_key)
-                try:
-                    with st.spinner("Consultando o agente..."):
-                        reply, resp_id, _usage = run_agent_chat(
-                            agent_cfg,
-                            prompt,
-                            previous_response_id=prev_id,
-                            file_id=file_id,
-                        )
-                    st.session_state.edit_popup_chat_messages.append({"role": "assistant", "content": reply})
-                    st.session_state[prev_key] = resp_id
-                    input_tok = _usage.get("input_tokens") if _usage else None
-                    output_tok = _usage.get("output_tokens") if _usage else None
-                    add_chat_test_message(
-                        user_id=user_id,
-                        role="user",
-                        content=prompt,
-                        agent_id=agent["id"],
-                        tokens=input_tok,
-                        has_attachment=bool(pdf_edit),
-                        attachment_filename=pdf_edit.name if pdf_edit else None,
-                        model=agent_cfg.get("model"),
-                        agent_name=agent_cfg.get("name"),
-                    )
-                    add_chat_test_message(
-                        user_id=user_id,
-                        role="assistant",
-                        content=reply,
-                        agent_id=agent["id"],
-                        tokens=output_tok,
-                        model=agent_cfg.get("model"),
-                        agent_name=agent_cfg.get("name"),
-                    )
-                except Exception as e:
-                    st.session_state.edit_popup_chat_messages.append({
-                        "role": "assistant",
-                        "content": f"Erro ao consultar o modelo: {e}",
-                    })
-                    add_chat_test_message(
-                        user_id=user_id,
-                        role="user",
-                        content=prompt,
-                        agent_id=agent["id"],
-                        has_attachment=bool(pdf_edit),
-                        attachment_filename=pdf_edit.name if pdf_edit else None,
-                        model=agent_cfg.get("model"),
-                        agent_name=agent_cfg.get("name"),
-                    )
-                    add_chat_test_message(
-                        user_id=user_id,
-                        role="assistant",
-                        content=f"Erro ao consultar o modelo: {e}",
-                        agent_id=agent["id"],
-                        model=agent_cfg.get("model"),
-                        agent_name=agent_cfg.get("name"),
-                    )
-                st.session_state["reopen_popup"] = "edit_agent"
-                st.rerun()
+            _render_test_chat("edit_popup_", "edit_popup_chat_messages", config_keys, defaults, agent_id=agent["id"])
+            _render_model_comparison("edit_popup_", config_keys, defaults, agent_id=agent["id"])
 
     @_dialog_decorator("Editar agente", width=DIALOG_WIDTH)
     def edit_agent_popup():
         edit_id = st.session_state.get("edit_agent_id")
         if not edit_id:
             return
-        agent = get_agent(int(edit_id), user_id)
+        agent = _repo().get_agent(int(edit_id))
         if not agent:
             st.session_state.pop("edit_agent_id", None)
             return
@@ -528,7 +626,7 @@ if _dialog_decorator is not None:
         """Lista de agentes com Editar (dentro do popup Ver agentes ou inline).
         Nunca chamar outro @st.dialog daqui (Streamlit não permite diálogos aninhados).
         """
-        saved = list_agents_by_user(user_id)
+        saved = _repo().list_agents()
         edit_id = st.session_state.get("edit_agent_id")
         if edit_id and _dialog_decorator is not None:
             # Estamos dentro do popup "Ver agentes"; abrir "Editar" no próximo run, não aqui
@@ -536,7 +634,7 @@ if _dialog_decorator is not None:
             st.rerun()
             return
         if edit_id and _dialog_decorator is None:
-            agent = get_agent(int(edit_id), user_id)
+            agent = _repo().get_agent(int(edit_id))
             if agent is not None:
                 st.subheader(f"Editar agente: {agent['name']}")
                 with st.form("form_edit_agent", clear_on_submit=False):
@@ -552,7 +650,7 @@ if _dialog_decorator is not None:
                     with col_c:
                         cancel = st.form_submit_button("Cancelar")
                 if submitted:
-                    update_agent(agent["id"], user_id, name=name, description=description, model=model, max_tokens=max_tokens, temperature=temperature, system_prompt=system_prompt)
+                    _repo().update_agent(agent["id"], name=name, description=description, model=model, max_tokens=max_tokens, temperature=temperature, system_prompt=system_prompt)
                     st.session_state.pop("edit_agent_id", None)
                     st.success("Agente atualizado.")
                     st.rerun()
@@ -635,14 +733,11 @@ with tabs[0]:
 with tabs[1]:
     st.subheader("Chat")
 
-    # Reabrir popup após enviar mensagem (st.rerun() fecha o diálogo)
+    # Trocar de popup (Ver agentes <-> Editar) exige rerun da pagina, que fecha o diálogo aberto.
+    # Acoes de chat nao passam por aqui: reexecutam so o fragmento do painel.
     if _dialog_decorator is not None:
         reopen = st.session_state.pop("reopen_popup", None)
-        if reopen == "config":
-            chat_popup()
-        elif reopen == "access_chat":
-            access_chat_popup()
-        elif reopen == "edit_agent":
+        if reopen == "edit_agent":
             edit_agent_popup()
         elif reopen == "agents_list":
             agents_popup()
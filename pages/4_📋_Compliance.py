@@ -5,7 +5,15 @@ from datetime import datetime
 # --- IMPORTS DO PROJETO ---
 try:
     from src.core.ui import sidebar_status
-    from src.repos.compliance_repo import get_compliance_data
+    from src.repos.compliance_repo import (
+        ORIGINS,
+        SORT_COLUMNS,
+        get_compliance_filter_options,
+        query_compliance,
+        search_summaries,
+    )
+    from src.repos.summary_jobs_repo import get_summary_token_stats
+    from src.repos.usage_repo import get_daily_usage, get_usage_kpis
 
     # NOVOS IMPORTS DE SEGURANÇA
     from src.auth.rbac import require_roles, ROLE_COMPLIANCE, ROLE_ADMIN
@@ -29,37 +37,63 @@ st.markdown("Monitoramento de auditoria baseada em tópicos (Privacy-First).")
 
 
 # --- LOAD DATA ---
+# Filtros, paginação e KPIs rodam no SQL (compliance_repo); aqui só chega a página atual.
 @st.cache_data(ttl=15)
-def carregar_dados():
-    df = get_compliance_data()
-    if df.empty:
-        return df
+def carregar_opcoes(users: tuple = ()):
+    return get_compliance_filter_options(list(users))
 
-    def estimar_custo(row):
-        modelo = str(row["Modelo"]).lower()
-        tokens = row["Tokens"]
 
-        # Preços médios por 1k tokens (considerando mix de input/output)
-        if "gpt-4" in modelo:
-            custo_por_1k = 0.03
-        elif "gpt-3.5" in modelo:
-            custo_por_1k = 0.0015
-        elif "claude-3" in modelo:
-            custo_por_1k = 0.015
-        else:
-            custo_por_1k = 0.001
+@st.cache_data(ttl=15)
+def carregar_pagina(
+    users: tuple,
+    agents: tuple,
+    date_from,
+    date_to,
+    has_attachment,
+    origin,
+    page: int,
+    page_size: int,
+    sort: str,
+    descending: bool,
+    with_daily: bool,
+):
+    return query_compliance(
+        users=list(users),
+        agents=list(agents),
+        date_from=date_from,
+        date_to=date_to,
+        has_attachment=has_attachment,
+        origin=origin,
+        page=page,
+        page_size=page_size,
+        sort=sort,
+        descending=descending,
+        with_daily=with_daily,
+    )
 
-        return (tokens / 1000) * custo_por_1k
 
-    df["Custo ($)"] = df.apply(estimar_custo, axis=1)
+@st.cache_data(ttl=15)
+def carregar_uso(users: tuple, agents: tuple, date_from, date_to, origin):
+    # Rollup diario (usage_daily): KPIs e grafico sem reagrupar o historico.
+    filtros = dict(users=list(users), agents=list(agents), date_from=date_from, date_to=date_to, origin=origin)
+    return get_usage_kpis(**filtros), get_daily_usage(**filtros)
 
-    df["Custo ($)"] = df.apply(estimar_custo, axis=1)
-    return df
+
+@st.cache_data(ttl=15)
+def carregar_resumos_stats():
+    # Totais do worker de resumos (todos os chats, sem os filtros acima).
+    return get_summary_token_stats()
 
 
-df_full = carregar_dados()
+@st.cache_data(ttl=15)
+def buscar_resumos(termo: str, page: int):
+    # Busca full-text so nos resumos de topico (sem conteudo das mensagens).
+    return search_summaries(termo, page=page, page_size=20)
 
-if df_full.empty:
+
+opcoes = carregar_opcoes()
+
+if not opcoes["users"]:
     st.warning("Sem dados de auditoria no momento.")
     st.stop()
 
@@ -71,47 +105,61 @@ with st.container(border=True):
     c1, c2, c3, c4, c5 = st.columns(5)
 
     with c1:
-        sel_users = st.multiselect("Usuário", options=df_full["Usuário"].unique())
+        sel_users = st.multiselect("Usuário", options=opcoes["users"])
 
     with c2:
-        if sel_users:
-            avail_agents = df_full[df_full["Usuário"].isin(sel_users)][
-                "Agente"
-            ].unique()
-        else:
-            avail_agents = df_full["Agente"].unique()
+        avail_agents = carregar_opcoes(tuple(sel_users))["agents"] if sel_users else opcoes["agents"]
         sel_agents = st.multiselect("Agente", options=avail_agents)
     with c3:
-        min_date = df_full["Data/Hora"].min().date()
+        min_date = opcoes["min_date"] or datetime.now().date()
         date_range = st.date_input(
             "Período", value=(min_date, datetime.now()), format="DD/MM/YYYY"
         )
     with c4:
         only_att = st.checkbox("Com Anexos", value=False)
     with c5:
-        origens = (
-            df_full["Origem"].unique().tolist() if "Origem" in df_full.columns else []
-        )
-        options_origem = ["Todos"] + origens
+        options_origem = ["Todos"] + list(ORIGINS)
         sel_origem = st.selectbox("Origem", options=options_origem, index=0)
 
-# --- APLICAR FILTROS ---
-df_filtered = df_full.copy()
+    c6, c7, c8 = st.columns([2, 1, 1])
+    with c6:
+        sel_sort = st.selectbox("Ordenar por", options=list(SORT_COLUMNS), index=0)
+    with c7:
+        sel_desc = st.selectbox("Ordem", options=["Decrescente", "Crescente"], index=0) == "Decrescente"
+    with c8:
+        page_size = st.selectbox("Linhas por página", options=[25, 50, 100, 200], index=1)
 
-if sel_users:
-    df_filtered = df_filtered[df_filtered["Usuário"].isin(sel_users)]
-if sel_agents:
-    df_filtered = df_filtered[df_filtered["Agente"].isin(sel_agents)]
+date_from = date_to = None
 if isinstance(date_range, tuple) and len(date_range) == 2:
-    s, e = date_range
-    df_filtered = df_filtered[
-        (df_filtered["Data/Hora"].dt.date >= s)
-        & (df_filtered["Data/Hora"].dt.date <= e)
-    ]
+    date_from, date_to = date_range
+
+# Filtro novo volta para a primeira página.
+filtros = (tuple(sel_users), tuple(sel_agents), date_from, date_to, only_att, sel_origem, sel_sort, sel_desc, page_size)
+if st.session_state.get("compliance_filtros") != filtros:
+    st.session_state["compliance_filtros"] = filtros
+    st.session_state["compliance_page"] = 1
+
+origem = None if sel_origem == "Todos" else sel_origem
+resultado = carregar_pagina(
+    tuple(sel_users),
+    tuple(sel_agents),
+    date_from,
+    date_to,
+    True if only_att else None,
+    origem,
+    st.session_state.get("compliance_page", 1),
+    page_size,
+    sel_sort,
+    sel_desc,
+    only_att,  # o rollup nao distingue conversas com anexo: nesse caso agrega no SQL
+)
+df_filtered = resultado["rows"]
+
+# Todos os KPIs e o grafico saem da mesma fonte para o filtro atual.
 if only_att:
-    df_filtered = df_filtered[df_filtered["Tem Anexo?"] == True]
-if "Origem" in df_filtered.columns and sel_origem and sel_origem != "Todos":
-    df_filtered = df_filtered[df_filtered["Origem"] == sel_origem]
+    kpis_uso, daily_usage = resultado, resultado["daily"]
+else:
+    kpis_uso, daily_usage = carregar_uso(tuple(sel_users), tuple(sel_agents), date_from, date_to, origem)
 
 # ==============================================================================
 # 2. GRÁFICOS E KPI (CORRIGIDO: GRÁFICO AGORA APARECE SEMPRE)
@@ -132,23 +180,18 @@ st.subheader(titulo_secao)
 col_kpi, col_chart = st.columns([1, 2])
 
 with col_kpi:
-    total_tok = df_filtered["Tokens"].sum()
-    total_money = df_filtered["Custo ($)"].sum()
-    count_msg = len(df_filtered)
-
-    st.metric("Total Tokens", f"{total_tok:,.0f}")
-    st.metric("Custo Estimado", f"$ {total_money:.4f}")
-    st.metric("Total Interações", count_msg)
+    st.metric("Total Tokens", f"{kpis_uso['tokens']:,.0f}")
+    st.metric("Custo Estimado", f"$ {kpis_uso['cost']:.4f}")
+    st.metric("Total Interações", f"{kpis_uso['messages']:,.0f}", help="Mensagens das conversas e perguntas do Chat Testes.")
+    resumos = carregar_resumos_stats()
+    st.caption(
+        f"Resumos de tópico: {resumos['summaries']:,} gerados · {resumos['skipped']:,} adiados · "
+        f"~{resumos['tokens_sent']:,} tokens enviados · ~{resumos['tokens_saved']:,} economizados pelo modo incremental"
+    )
 
 with col_chart:
-    # Lógica do Gráfico: Agrupa por dia e soma tokens
-    if not df_filtered.empty:
-        chart_data = df_filtered.copy()
-        chart_data["Dia"] = chart_data["Data/Hora"].dt.date
-
-        # Agrupa e reseta index para o Streamlit entender
-        daily_usage = chart_data.groupby("Dia")["Tokens"].sum().reset_index()
-
+    # Uso diário já agregado (rollup ou SQL)
+    if not daily_usage.empty:
         st.caption("Evolução de uso de Tokens (Diário)")
         st.bar_chart(daily_usage, x="Dia", y="Tokens", color="#FF4B4B")
     else:
@@ -185,6 +228,56 @@ event = st.dataframe(
     hide_index=True,
 )
 
+if resultado["pages"] > 1:
+    st.session_state["compliance_page"] = min(st.session_state.get("compliance_page", 1), resultado["pages"])
+    st.number_input(
+        f"Página (de {resultado['pages']})",
+        min_value=1,
+        max_value=resultado["pages"],
+        step=1,
+        key="compliance_page",
+    )
+st.caption(f"{resultado['total']} registros no filtro atual.")
+
+# ==============================================================================
+# 3.1 BUSCA NOS RESUMOS
+# ==============================================================================
+st.divider()
+st.subheader("🔎 Busca nos Resumos")
+termo = st.text_input(
+    "Buscar tópicos", placeholder="Palavras do resumo temático (o conteúdo das conversas não é pesquisado)"
+).strip()
+if st.session_state.get("compliance_busca") != termo:
+    st.session_state["compliance_busca"] = termo
+    st.session_state["compliance_busca_page"] = 1
+if termo:
+    achados = buscar_resumos(termo, st.session_state.get("compliance_busca_page", 1))
+    if achados["total"]:
+        st.dataframe(
+            achados["rows"],
+            width="stretch",
+            hide_index=True,
+            column_config={
+                "Resumo": st.column_config.TextColumn(width="large", label="Tópico (Teor)"),
+                "id": None,
+                "score": None,
+            },
+        )
+        if achados["pages"] > 1:
+            st.session_state["compliance_busca_page"] = min(
+                st.session_state.get("compliance_busca_page", 1), achados["pages"]
+            )
+            st.number_input(
+                f"Página (de {achados['pages']})",
+                min_value=1,
+                max_value=achados["pages"],
+                step=1,
+                key="compliance_busca_page",
+            )
+        st.caption(f"{achados['total']} chats com o termo no resumo.")
+    else:
+        st.info("Nenhum resumo encontrado para o termo.")
+
 
 # ==============================================================================
 # 4. POPUP
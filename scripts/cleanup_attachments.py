@@ -0,0 +1,30 @@
+﻿"""
+Limpeza do cache de anexos: apaga da Files API os PDFs cujo cache expirou
+(ATTACHMENT_CACHE_TTL_HOURS sem uso) e remove as entradas. Pensado para cron:
+
+    python scripts/cleanup_attachments.py --limit 500
+"""
+import argparse
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from src.agents.service import cleanup_attachment_cache
+from src.core.db import init_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Remove anexos expirados da Files API.')
+    parser.add_argument('--limit', type=int, default=100, help='Maximo de arquivos por execucao.')
+    args = parser.parse_args()
+
+    init_db()
+    removed = cleanup_attachment_cache(args.limit)
+    print(f'arquivos removidos: {removed}')
+
+
+if __name__ == '__main__':
+    main()
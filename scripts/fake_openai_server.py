@@ -0,0 +1,223 @@
+﻿"""
+Servidor local que imita os endpoints da OpenAI usados pelo app (Responses, Embeddings
+e Files: upload e remocao),
+para testes de carga sem gastar credito.
+
+    python scripts/fake_openai_server.py --port 8089 --latency 0.3 --output-tokens 120
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=sk-fake streamlit run app.py
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+
+_WORDS = ('politica', 'acesso', 'dados', 'revisao', 'compliance', 'agente', 'resposta', 'simulada')
+_ids = itertools.count(1)
+
+
+@dataclass
+class FakeServerConfig:
+    latency: float = 0.2  # segundos ate o primeiro byte
+    jitter: float = 0.0  # acrescimo aleatorio (0..jitter) na latencia
+    output_tokens: int = 60  # ~1 token por palavra do texto gerado
+    chunk_words: int = 3  # palavras por delta no streaming
+    chunk_delay: float = 0.02  # intervalo entre deltas
+    error_rate: float = 0.0  # fracao de pedidos respondidos com 429
+
+
+def _estimate_tokens(value) -> int:
+    return (len(json.dumps(value, ensure_ascii=False)) + 3) // 4 if value else 0
+
+
+def _fake_embedding(text: str, dim: int = 16) -> list:
+    # Deterministico: mesmo texto, mesmo vetor.
+    digest = hashlib.sha256(str(text).encode('utf-8')).digest()
+    return [(digest[i % len(digest)] - 127.5) / 127.5 for i in range(dim)]
+
+
+def _response_body(request: dict, text: str, response_id: str) -> dict:
+    input_tokens = _estimate_tokens(request.get('input')) + _estimate_tokens(request.get('instructions'))
+    output_tokens = len(text.split())
+    return {
+        'id': response_id,
+        'object': 'response',
+        'created_at': int(time.time()),
+        'status': 'completed',
+        'model': request.get('model') or 'fake-model',
+        'output': [{
+            'id': f'msg_{response_id}',
+            'type': 'message',
+            'role': 'assistant',
+            'status': 'completed',
+            'content': [{'type': 'output_text', 'text': text, 'annotations': []}],
+        }],
+        'parallel_tool_calls': True,
+        'tool_choice': 'auto',
+        'tools': [],
+        'usage': {
+            'input_tokens': input_tokens,
+            'input_tokens_details': {'cached_tokens': 0},
+            'output_tokens': output_tokens,
+            'output_tokens_details': {'reasoning_tokens': 0},
+            'total_tokens': input_tokens + output_tokens,
+        },
+    }
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = FakeServerConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send_json(self, status: int, body: dict, headers: Optional[dict] = None) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_event(self, body: dict) -> None:
+        self.wfile.write(f"event: {body['type']}\ndata: {json.dumps(body)}\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+    def do_DELETE(self):
+        file_id = self.path.rstrip('/').rsplit('/', 1)[-1]
+        if '/files/' not in self.path or not file_id.startswith('file-fake'):
+            self._send_json(404, {'error': {'message': f'Arquivo nao encontrado: {file_id}', 'type': 'invalid_request_error'}})
+            return
+        self._send_json(200, {'id': file_id, 'object': 'file', 'deleted': True})
+
+    def do_POST(self):
+        raw = self._read_body()
+        cfg = self.config
+        time.sleep(cfg.latency + random.uniform(0, cfg.jitter))
+
+        if cfg.error_rate and random.random() < cfg.error_rate:
+            self._send_json(
+                429,
+                {'error': {'message': 'Rate limit simulado.', 'type': 'rate_limit_error', 'code': 'rate_limit_exceeded'}},
+                {'Retry-After': '0'},
+            )
+            return
+
+        if self.path.endswith('/files'):
+            self._send_json(200, {
+                'id': f'file-fake{next(_ids)}',
+                'object': 'file',
+                'bytes': len(raw),
+                'created_at': int(time.time()),
+                'filename': 'upload.pdf',
+                'purpose': 'user_data',
+                'status': 'processed',
+            })
+            return
+
+        if self.path.endswith('/embeddings'):
+            request = json.loads(raw or b'{}')
+            texts = request.get('input')
+            texts = [texts] if isinstance(texts, str) else list(texts or [])
+            self._send_json(200, {
+                'object': 'list',
+                'model': request.get('model') or 'fake-embedding',
+                'data': [
+                    {'object': 'embedding', 'index': i, 'embedding': _fake_embedding(text)}
+                    for i, text in enumerate(texts)
+                ],
+                'usage': {'prompt_tokens': _estimate_tokens(texts), 'total_tokens': _estimate_tokens(texts)},
+            })
+            return
+
+        if not self.path.endswith('/responses'):
+            self._send_json(404, {'error': {'message': f'Rota nao simulada: {self.path}'}})
+            return
+
+        request = json.loads(raw or b'{}')
+        words = [_WORDS[i % len(_WORDS)] for i in range(max(1, cfg.output_tokens))]
+        text = ' '.join(words)
+        body = _response_body(request, text, f'resp_fake{next(_ids)}')
+        if not request.get('stream'):
+            self._send_json(200, body)
+            return
+
+        # SSE sem Content-Length: a conexao fecha ao fim do stream.
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        created = dict(body, status='in_progress', output=[], usage=None)
+        seq = itertools.count()
+        self._send_event({'type': 'response.created', 'sequence_number': next(seq), 'response': created})
+        step = max(1, cfg.chunk_words)
+        for i in range(0, len(words), step):
+            delta = ' '.join(words[i:i + step]) + (' ' if i + step < len(words) else '')
+            self._send_event({
+                'type': 'response.output_text.delta',
+                'sequence_number': next(seq),
+                'item_id': body['output'][0]['id'],
+                'output_index': 0,
+                'content_index': 0,
+                'delta': delta,
+                'logprobs': [],
+            })
+            if cfg.chunk_delay:
+                time.sleep(cfg.chunk_delay)
+        self._send_event({'type': 'response.completed', 'sequence_number': next(seq), 'response': body})
+
+
+def start_fake_server(host: str = '127.0.0.1', port: int = 0, config: Optional[FakeServerConfig] = None):
+    """Sobe o servidor numa thread daemon. Retorna (server, base_url); pare com server.shutdown()."""
+    handler = type('ConfiguredFakeOpenAIHandler', (FakeOpenAIHandler,), {'config': config or FakeServerConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}/v1'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor falso das APIs Responses/Files da OpenAI.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--output-tokens', type=int, default=60)
+    parser.add_argument('--chunk-words', type=int, default=3)
+    parser.add_argument('--chunk-delay', type=float, default=0.02)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    config = FakeServerConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        output_tokens=args.output_tokens,
+        chunk_words=args.chunk_words,
+        chunk_delay=args.chunk_delay,
+        error_rate=args.error_rate,
+    )
+    server, base_url = start_fake_server(args.host, args.port, config)
+    print('OPENAI_BASE_URL=' + base_url)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+﻿"""
+Teste de carga do fluxo de chat: N usuarios concorrentes rodando
+create_chat -> add_message -> run_agent_chat -> generate_compliance_summary.
+
+Por padrao sobe o servidor falso (scripts/fake_openai_server.py) e usa um banco
+temporario, entao nao gasta credito nem toca em data/app.db.
+
+    python scripts/load_test.py --users 20 --turns 5 --latency 0.3
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+for path in (ROOT, ROOT / 'scripts'):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+from fake_openai_server import FakeServerConfig, start_fake_server
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+class Timings:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def measure(self, name: str, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.errors[name] += 1
+            raise
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.samples[name].append(seconds)
+
+
+def _user_session(index: int, turns: int, timings: Timings) -> None:
+    from src.agents.service import generate_compliance_summary, run_agent_chat
+    from src.repos.agents_repo import create_agent, get_agent
+    from src.repos.chat_repo import add_message, create_chat, get_messages, update_conversation_topic_summary
+    from src.repos.users_repo import create_user
+
+    user_id = create_user(f'load{index}@test.local', 'Load@12345', 'USER', True)
+    agent_id = create_agent(user_id, f'Agente {index}', 'Carga', 'gpt-4o-mini', 256, 0.7, 'Seja breve.')
+    agent = get_agent(agent_id, user_id)
+
+    chat_id = timings.measure('create_chat', create_chat, user_id, agent_id, 'Carga')
+    previous_response_id = None
+    for turn in range(turns):
+        turn_started = time.perf_counter()
+        prompt = f'Pergunta {turn} do usuario {index} sobre politica de acesso'
+        timings.measure('add_message', add_message, chat_id, 'user', prompt)
+        text, previous_response_id, usage = timings.measure(
+            'run_agent_chat', run_agent_chat, agent, prompt, previous_response_id
+        )
+        timings.measure('add_message', add_message, chat_id, 'assistant', text, usage.get('total_tokens'))
+        summary = timings.measure('compliance_summary', generate_compliance_summary, get_messages(chat_id))
+        timings.measure('update_summary', update_conversation_topic_summary, chat_id, user_id, summary)
+        timings.record('turn', time.perf_counter() - turn_started)
+
+
+def run_load_test(users: int, turns: int) -> dict:
+    """Roda a simulacao contra o OPENAI_BASE_URL/APP_DB_PATH ja configurados e devolve o relatorio."""
+    from src.core.db import get_db_wait_stats, init_db, reset_db_wait_stats
+
+    init_db()
+    reset_db_wait_stats()
+    timings = Timings()
+    errors: list[BaseException] = []
+
+    def worker(i):
+        try:
+            _user_session(i, turns, timings)
+        except BaseException as exc:
+            errors.append(exc)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    report = {
+        'users': users,
+        'turns': turns,
+        'elapsed_s': elapsed,
+        'failed_sessions': len(errors),
+        'first_error': repr(errors[0]) if errors else None,
+        'operations': {},
+        'db_waits': get_db_wait_stats(),
+    }
+    for name, values in timings.samples.items():
+        report['operations'][name] = {
+            'count': len(values),
+            'errors': timings.errors.get(name, 0),
+            'mean': statistics.fmean(values),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+        }
+    return report
+
+
+def print_report(report: dict) -> None:
+    print(f"{report['users']} usuarios x {report['turns']} turnos em {report['elapsed_s']:.2f}s "
+          f"({report['failed_sessions']} sessoes com erro)")
+    if report['first_error']:
+        print('Primeiro erro:', report['first_error'])
+    print(f"{'operacao':<20}{'n':>6}{'erros':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, op in sorted(report['operations'].items()):
+        print(f"{name:<20}{op['count']:>6}{op['errors']:>7}"
+              f"{op['p50'] * 1000:>10.1f}{op['p95'] * 1000:>10.1f}{op['p99'] * 1000:>10.1f}")
+    waits = report['db_waits']
+    print(f"DB: {waits['pool_waits']} esperas por conexao ({waits['pool_wait_s']:.3f}s), "
+          f"{waits['busy_retries']} retries por lock ({waits['busy_wait_s']:.3f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga do fluxo de chat.')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--turns', type=int, default=3)
+    parser.add_argument('--base-url', default='', help='API externa; vazio sobe o servidor falso local.')
+    parser.add_argument('--db', default='', help='Banco SQLite; vazio usa um arquivo temporario.')
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--jitter', type=float, default=0.1)
+    parser.add_argument('--output-tokens', type=int, default=60)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        server, base_url = start_fake_server(config=FakeServerConfig(
+            latency=args.latency,
+            jitter=args.jitter,
+            output_tokens=args.output_tokens,
+            error_rate=args.error_rate,
+        ))
+        os.environ.setdefault('OPENAI_API_KEY', 'sk-fake')
+    os.environ['OPENAI_BASE_URL'] = base_url
+    os.environ['APP_DB_PATH'] = args.db or os.path.join(tempfile.mkdtemp(), 'load.db')
+
+    try:
+        print_report(run_load_test(args.users, args.turns))
+    finally:
+        if server is not None:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
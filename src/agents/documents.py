@@ -0,0 +1,130 @@
+import hashlib
+import io
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from src.agents import vector_store
+from src.agents.embeddings import get_embedder
+from src.core.config import get_settings
+from src.repos.documents_repo import get_chunks, get_document, save_document, search_chunks
+
+
+def pdf_text_available() -> bool:
+    """True se a extracao local esta ligada e o pypdf (opcional) esta instalado."""
+    if not get_settings().get_bool("PDF_LOCAL_EXTRACTION", True):
+        return False
+    try:
+        import pypdf  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+_PAGE_OBJECT_RE = re.compile(rb"/Type\s*/Page(?![a-zA-Z])")
+
+
+def count_pdf_pages(data: bytes) -> Optional[int]:
+    """Numero de paginas: pelo pypdf quando disponivel, senao contando objetos /Page."""
+    try:
+        from pypdf import PdfReader
+
+        return len(PdfReader(io.BytesIO(data)).pages)
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    return len(_PAGE_OBJECT_RE.findall(data)) or None
+
+
+def iter_pdf_pages(data: bytes) -> Iterator[Tuple[int, str]]:
+    """(numero da pagina, texto) uma pagina por vez; o pypdf le as paginas sob demanda."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(io.BytesIO(data))
+    for number, page in enumerate(reader.pages, start=1):
+        yield number, page.extract_text() or ""
+
+
+def chunk_pages(
+    pages: Iterable[Tuple[int, str]],
+    size: int = 1200,
+    overlap: int = 150,
+) -> Iterator[Tuple[int, str]]:
+    """
+    Quebra o texto das paginas em chunks de ~size caracteres (corte em espaco),
+    com overlap caracteres repetidos entre chunks vizinhos. Cada chunk leva a
+    pagina onde comeca. Consome as paginas em streaming.
+    """
+    size = max(100, int(size))
+    overlap = min(max(0, int(overlap)), size // 4)
+    buf, buf_page = "", 0
+    for number, text in pages:
+        text = " ".join((text or "").split())
+        if not text:
+            continue
+        if not buf:
+            buf_page = number
+        buf = f"{buf} {text}" if buf else text
+        while len(buf) >= size:
+            cut = buf.rfind(" ", size // 2, size)
+            if cut <= 0:
+                cut = size
+            yield buf_page, buf[:cut].strip()
+            start = max(cut - overlap, 0)
+            space = buf.find(" ", start, cut)
+            buf = buf[space + 1 if space >= 0 else start:].strip()
+            buf_page = number
+    if buf:
+        yield buf_page, buf
+
+
+def ingest_pdf(uploaded_file) -> Optional[Dict[str, Any]]:
+    """
+    Extrai e fatia o PDF localmente, gravando os chunks por SHA-256 dos bytes
+    (o mesmo arquivo nao e processado duas vezes). Retorna o registro do
+    documento, ou None se nao ha extracao local ou o PDF nao tem texto (ex.: escaneado).
+    """
+    if uploaded_file is None or not pdf_text_available():
+        return None
+    data = uploaded_file.getvalue() if hasattr(uploaded_file, "getvalue") else uploaded_file.read()
+    if not data:
+        raise ValueError("Arquivo vazio.")
+
+    doc_hash = hashlib.sha256(data).hexdigest()
+    doc = get_document(doc_hash)
+    if doc is None:
+        settings = get_settings()
+        chunks = chunk_pages(
+            iter_pdf_pages(data),
+            size=settings.get_int("DOC_CHUNK_CHARS", 1200) or 1200,
+            overlap=settings.get_int("DOC_CHUNK_OVERLAP", 150) or 0,
+        )
+        doc = save_document(doc_hash, getattr(uploaded_file, "name", None), len(data), chunks)
+    return doc if doc and doc["chunks"] else None
+
+
+def relevant_chunks(doc: Dict[str, Any], question: str, limit: int) -> List[Dict[str, Any]]:
+    """
+    Top-k chunks para a pergunta: por similaridade de embeddings quando ha
+    embedder (RAG_EMBEDDER), senao, ou se o embedder falhar, por bm25 (FTS5).
+    """
+    embedder = get_embedder()
+    if embedder is not None:
+        try:
+            indexes = vector_store.top_k(doc, question, limit, embedder)
+        except Exception:
+            indexes = []  # rede/cota do embedder: a busca lexical ainda responde
+        if indexes:
+            return get_chunks(doc["hash"], indexes)
+    return search_chunks(doc["hash"], question, limit)
+
+
+def document_context(doc: Dict[str, Any], question: str, limit: Optional[int] = None) -> str:
+    """Texto (input_text) com os trechos do documento relevantes para a pergunta."""
+    if limit is None:
+        limit = get_settings().get_int("DOC_CONTEXT_CHUNKS", 4) or 4
+    chunks = relevant_chunks(doc, question, limit)
+    name = doc.get("filename") or "documento.pdf"
+    parts = [f"Trechos relevantes do documento anexado \"{name}\" ({doc['pages']} páginas):"]
+    parts.extend(f"[p. {c['page']}] {c['content']}" for c in chunks)
+    return "\n\n".join(parts)
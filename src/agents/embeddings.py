@@ -0,0 +1,94 @@
+"""
+Funcoes de embedding para o indice vetorial dos documentos.
+
+Um embedder e qualquer objeto com `name` (identifica o espaco vetorial: trocar
+de embedder reconstroi os indices) e `embed(texts) -> ndarray float32 (n, dim)`.
+O padrao vem de RAG_EMBEDDER; set_embedder() troca em tempo de execucao
+(ex.: HashingEmbedder nos testes, sem rede).
+"""
+import hashlib
+import re
+import threading
+import unicodedata
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from src.core.config import get_settings
+from src.openai.client import get_openai_client
+
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbedder:
+    """
+    Embedder local e deterministico (feature hashing de palavras e bigramas,
+    sem acento). Bom para testes e como alternativa offline; nao entende sinonimos.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = int(dim)
+        self.name = f"hashing-{self.dim}"
+
+    def _features(self, text: str) -> List[str]:
+        plain = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii")
+        words = [w for w in _WORD_RE.findall(plain.lower()) if len(w) > 2]
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                out[row, value % self.dim] += 1.0 if (value >> 63) else -1.0
+        return out
+
+
+class OpenAIEmbedder:
+    """Embeddings da API da OpenAI (passa pelo limitador de taxa do cliente)."""
+
+    def __init__(self, model: str = "text-embedding-3-small", batch_size: int = 64):
+        self.model = model
+        self.batch_size = max(1, int(batch_size))
+        self.name = f"openai-{model}"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        client = get_openai_client()
+        parts = []
+        for start in range(0, len(texts), self.batch_size):
+            response = client.embeddings.create(model=self.model, input=list(texts[start:start + self.batch_size]))
+            parts.append(np.asarray([item.embedding for item in response.data], dtype=np.float32))
+        return np.concatenate(parts) if parts else np.zeros((0, 0), dtype=np.float32)
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def _default_embedder():
+    settings = get_settings()
+    kind = (settings.get("RAG_EMBEDDER") or "openai").strip().lower()
+    if kind in ("off", "none", ""):
+        return None
+    if kind == "hashing":
+        return HashingEmbedder(settings.get_int("RAG_HASHING_DIM", 256) or 256)
+    return OpenAIEmbedder(settings.get("EMBEDDING_MODEL") or "text-embedding-3-small")
+
+
+def get_embedder():
+    """Embedder do processo, ou None quando RAG_EMBEDDER=off (busca cai no FTS)."""
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                _embedder = _default_embedder() or False
+    return _embedder or None
+
+
+def set_embedder(embedder: Optional[object]) -> None:
+    """Troca o embedder do processo; None volta ao padrao das configuracoes."""
+    global _embedder
+    with _embedder_lock:
+        _embedder = embedder
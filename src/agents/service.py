@@ -1,17 +1,46 @@
-﻿from typing import Optional, Dict, Any, Tuple
+﻿from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Iterator, List, Tuple
 
+import hashlib
+import json
 import re
+import sqlite3
+import threading
+import time
 
+from openai import NotFoundError
+
+from src.agents.documents import count_pdf_pages, document_context, ingest_pdf
 from src.core.config import get_settings
-from src.openai.client import get_openai_client
+from src.core.pricing import usage_cost
+from src.core.tokens import (
+    check_request,
+    count_tokens,
+    estimate_request,
+    input_token_cap,
+    payload_input_tokens,
+    truncate_tokens,
+)
+from src.openai.client import get_async_openai_client, get_openai_client
+from src.repos import response_cache_repo
+from src.repos.attachments_repo import (
+    delete_cached_file,
+    get_cached_file,
+    get_file_hash,
+    list_expired_files,
+    save_cached_file,
+    touch_cached_file,
+)
 
 
 _COMPLIANCE_SUMMARY_FALLBACK = "(resumo indisponível)"
+_COMPLIANCE_SUMMARY_DEFAULT = "Novo chat iniciado."
 _COMPLIANCE_SUMMARY_MAX_CHARS = 300
 
 
 _EMAIL_RE = re.compile(r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b")
 _LONG_NUMBER_RE = re.compile(r"\b\d{7,}\b")  # ex.: telefone/conta/IDs longos
+_KEYWORD_RE = re.compile(r"\w{5,}")  # palavras com 5+ letras ~ ignora stopwords
 
 
 def _to_float(value, default: float) -> float:
@@ -32,7 +61,7 @@ def _to_int(value, default: Optional[int]) -> Optional[int]:
         return default
 
 
-def upload_pdf(uploaded_file) -> str:
+def _read_upload(uploaded_file) -> Tuple[str, bytes, str]:
     if uploaded_file is None:
         raise ValueError('Nenhum arquivo enviado.')
 
@@ -46,15 +75,129 @@ def upload_pdf(uploaded_file) -> str:
 
     filename = getattr(uploaded_file, 'name', None) or 'documento.pdf'
     content_type = getattr(uploaded_file, 'type', None) or 'application/pdf'
+    return filename, file_bytes, content_type
+
+
+def _attachment_ttl() -> float:
+    return get_settings().get_float('ATTACHMENT_CACHE_TTL_HOURS', 72.0) * 3600
+
+
+def _cached_file_id(data: bytes) -> Tuple[str, Optional[str]]:
+    """(sha256, file_id ja enviado para esse conteudo ou None)."""
+    content_hash = hashlib.sha256(data).hexdigest()
+    try:
+        entry = get_cached_file(content_hash)
+        if entry is not None:
+            touch_cached_file(content_hash, _attachment_ttl())
+            return content_hash, entry['file_id']
+    except sqlite3.Error:
+        # Cache e so otimizacao: sem banco, o upload segue normal.
+        pass
+    return content_hash, None
+
+
+def _remember_upload(content_hash: str, file_id: str, data: bytes) -> None:
+    try:
+        save_cached_file(content_hash, file_id, len(data), count_pdf_pages(data), _attachment_ttl())
+    except sqlite3.Error:
+        return
+    maybe_cleanup_attachments()
+
 
+def upload_pdf(uploaded_file) -> str:
+    """Envia o PDF a Files API; o mesmo conteudo (SHA-256) reusa o file_id do cache."""
+    file_tuple = _read_upload(uploaded_file)
+    content_hash, file_id = _cached_file_id(file_tuple[1])
+    if file_id:
+        return file_id
     client = get_openai_client()
     response = client.files.create(
-        file=(filename, file_bytes, content_type),
+        file=file_tuple,
+        purpose='user_data',
+    )
+    _remember_upload(content_hash, response.id, file_tuple[1])
+    return response.id
+
+
+async def aupload_pdf(uploaded_file) -> str:
+    """Versao async de upload_pdf: varios anexos podem subir em paralelo no mesmo loop."""
+    file_tuple = _read_upload(uploaded_file)
+    content_hash, file_id = _cached_file_id(file_tuple[1])
+    if file_id:
+        return file_id
+    client = get_async_openai_client()
+    response = await client.files.create(
+        file=file_tuple,
         purpose='user_data',
     )
+    _remember_upload(content_hash, response.id, file_tuple[1])
     return response.id
 
 
+def cleanup_attachment_cache(limit: int = 100) -> int:
+    """
+    Apaga da Files API os anexos cujo cache expirou e remove as entradas.
+    Retorna quantos arquivos foram removidos. Arquivo que ja nao existe no
+    servidor conta como removido; outra falha devolve a entrada para a proxima rodada.
+    """
+    client = None
+    removed = 0
+    for entry in list_expired_files(limit):
+        if not delete_cached_file(entry['hash'], entry['file_id']):
+            continue  # reusado ou regravado enquanto a limpeza rodava
+        client = client or get_openai_client()
+        try:
+            client.files.delete(entry['file_id'])
+        except NotFoundError:
+            pass
+        except Exception:
+            save_cached_file(entry['hash'], entry['file_id'], entry['size_bytes'], entry['pages'], 0)
+            continue
+        removed += 1
+    return removed
+
+
+_next_cleanup = 0.0
+_cleanup_lock = threading.Lock()
+
+
+def _cleanup_quietly() -> None:
+    try:
+        cleanup_attachment_cache()
+    except Exception:
+        pass
+
+
+def maybe_cleanup_attachments() -> bool:
+    """Dispara a limpeza numa thread de fundo, no maximo uma vez por ATTACHMENT_CLEANUP_INTERVAL segundos."""
+    global _next_cleanup
+    interval = get_settings().get_float('ATTACHMENT_CLEANUP_INTERVAL', 3600.0)
+    now = time.monotonic()
+    with _cleanup_lock:
+        if interval <= 0 or now < _next_cleanup:
+            return False
+        _next_cleanup = now + interval
+    threading.Thread(target=_cleanup_quietly, name='attachment-cleanup', daemon=True).start()
+    return True
+
+
+def attach_pdf(uploaded_file, question: str) -> Dict[str, Optional[str]]:
+    """
+    Prepara o PDF anexado para o turno. Com extracao local, so os trechos
+    relevantes para a pergunta vao como input_text (nada e enviado a Files API);
+    sem texto extraivel (ou sem pypdf), ou se a extracao falhar (PDF corrompido
+    ou cifrado, banco ocupado), cai no upload do arquivo inteiro.
+    Retorna {"file_id", "document_text"} para repassar a run/stream_agent_chat.
+    """
+    try:
+        doc = ingest_pdf(uploaded_file)
+        if doc is not None:
+            return {'file_id': None, 'document_text': document_context(doc, question)}
+    except Exception:
+        pass  # a Files API ainda le o arquivo; o turno nao falha pela extracao local
+    return {'file_id': upload_pdf(uploaded_file), 'document_text': None}
+
+
 def _compact_ws(text: str) -> str:
     return " ".join((text or "").split())
 
@@ -111,18 +254,72 @@ def _render_messages_for_compliance_summary(
     return "\n".join(rendered).strip()
 
 
-def generate_compliance_summary(messages: list[Dict[str, Any]]) -> str:
-    """
-    Gera um resumo temático (1–3 frases) para fins de Compliance.
+def has_topic_summary(summary: Optional[str]) -> bool:
+    """True se o chat ja tem um resumo de verdade (nao o texto padrao nem o fallback)."""
+    txt = (summary or "").strip()
+    return bool(txt) and txt not in (_COMPLIANCE_SUMMARY_DEFAULT, _COMPLIANCE_SUMMARY_FALLBACK)
 
-    Importante: este resumo não deve conter PII nem citar trechos verbatim.
-    """
-    if not messages:
-        return "Novo chat iniciado."
 
+def estimate_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    # Contagem local (tiktoken quando instalado, senao ~4 caracteres por token).
+    return count_tokens(text, model)
+
+
+def build_compliance_summary_input(
+    messages: list[Dict[str, Any]],
+    previous_summary: Optional[str] = None,
+) -> str:
+    """
+    Texto enviado ao modelo para o resumo. Com um resumo anterior valido o modo e
+    incremental: vai apenas o resumo anterior + as mensagens novas.
+    """
     transcript = _render_messages_for_compliance_summary(messages)
     if not transcript:
-        return "Novo chat iniciado."
+        return ""
+    if has_topic_summary(previous_summary):
+        return (
+            "Atualize o resumo anterior desta conversa para Compliance considerando o novo trecho.\n\n"
+            f"Resumo anterior: {_compact_ws(previous_summary)}\n\n"
+            f"Novo trecho:\n{transcript}\n"
+        )
+    return (
+        "Resuma o assunto principal desta conversa para Compliance.\n\n"
+        f"{transcript}\n"
+    )
+
+
+def summary_topic_drift(
+    previous_summary: Optional[str],
+    new_messages: list[Dict[str, Any]],
+    threshold: float = 0.2,
+) -> bool:
+    """
+    Heuristica local de mudanca de assunto: fracao das palavras-chave das novas
+    mensagens do usuario que aparecem no resumo anterior abaixo de `threshold`.
+    """
+    if not has_topic_summary(previous_summary):
+        return True
+    # Compara radicais grosseiros (5 primeiras letras): "agente" ~ "agentes".
+    summary_words = {w.lower()[:5] for w in _KEYWORD_RE.findall(previous_summary or "")}
+    new_words = {
+        w.lower()[:5]
+        for msg in new_messages
+        if msg.get("role") == "user"
+        for w in _KEYWORD_RE.findall(str(msg.get("content") or ""))
+    }
+    if len(new_words) < 3:
+        return False
+    return len(new_words & summary_words) / len(new_words) < threshold
+
+
+def _compliance_summary_payload(
+    messages: list[Dict[str, Any]],
+    previous_summary: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """Payload do resumo de Compliance, ou None quando nao ha o que enviar ao modelo."""
+    prompt = build_compliance_summary_input(messages, previous_summary) if messages else ""
+    if not prompt:
+        return None
 
     # Modelo barato/estável (evita depender do modelo configurado no agente).
     model = "gpt-4o-mini"
@@ -137,37 +334,97 @@ def generate_compliance_summary(messages: list[Dict[str, Any]]) -> str:
         "- Retorne somente o texto do resumo, sem markdown e sem prefixos."
     )
 
+    payload = {
+        "model": model,
+        "instructions": instructions,
+        "input": prompt,
+        "temperature": 0.2,
+        "max_output_tokens": 120,
+    }
+    # O transcript ja vem limitado em caracteres; o teto de tokens e a ultima barreira.
+    excess = payload_input_tokens(payload) - input_token_cap(model, 120)
+    if excess > 0:
+        payload["input"] = truncate_tokens(prompt, count_tokens(prompt, model) - excess, model)
+    return payload
+
+
+def _summary_without_call(previous_summary: Optional[str]) -> str:
+    return _clamp_summary(previous_summary) if has_topic_summary(previous_summary) else _COMPLIANCE_SUMMARY_DEFAULT
+
+
+def _strict_summary(summary: str) -> str:
+    if summary == _COMPLIANCE_SUMMARY_FALLBACK:
+        raise ValueError("Resposta vazia do modelo no resumo de Compliance.")
+    return summary
+
+
+def generate_compliance_summary(
+    messages: list[Dict[str, Any]],
+    previous_summary: Optional[str] = None,
+    strict: bool = False,
+) -> str:
+    """
+    Gera um resumo temático (1–3 frases) para fins de Compliance.
+
+    Com `previous_summary`, `messages` deve conter só o trecho novo da conversa
+    (modo incremental). Importante: este resumo não deve conter PII nem citar
+    trechos verbatim.
+
+    strict=True (worker de fundo): erro da API ou resposta vazia sobe como
+    exceção em vez de virar o texto de fallback, para o pedido ser tentado de novo.
+    """
+    payload = _compliance_summary_payload(messages, previous_summary)
+    if payload is None:
+        return _summary_without_call(previous_summary)
+
     try:
         client = get_openai_client()
-        response = client.responses.create(
-            model=model,
-            instructions=instructions,
-            input=(
-                "Resuma o assunto principal desta conversa para Compliance.\n\n"
-                f"{transcript}\n"
-            ),
-            temperature=0.2,
-            max_output_tokens=120,
-        )
+        response = client.responses.create(**payload)
+        summary = _clamp_summary(getattr(response, "output_text", "") or "")
+    except Exception:
+        if strict:
+            raise
+        return _COMPLIANCE_SUMMARY_FALLBACK
+    return _strict_summary(summary) if strict else summary
+
+
+async def agenerate_compliance_summary(
+    messages: list[Dict[str, Any]],
+    previous_summary: Optional[str] = None,
+) -> str:
+    """Versao async de generate_compliance_summary (mesmas regras e fallback)."""
+    payload = _compliance_summary_payload(messages, previous_summary)
+    if payload is None:
+        return _summary_without_call(previous_summary)
+
+    try:
+        client = get_async_openai_client()
+        response = await client.responses.create(**payload)
         return _clamp_summary(getattr(response, "output_text", "") or "")
     except Exception:
         return _COMPLIANCE_SUMMARY_FALLBACK
 
 
-def run_agent_chat(
+def _build_agent_payload(
     agent: Dict[str, Any],
     user_text: str,
     previous_response_id: Optional[str] = None,
     file_id: Optional[str] = None,
-) -> Tuple[str, str, Dict[str, Optional[int]]]:
+    document_text: Optional[str] = None,
+    enforce: bool = True,
+) -> Dict[str, Any]:
+    """Payload da Responses API; com enforce, aplica o teto de tokens de entrada (TokenLimitError)."""
     if not user_text:
         raise ValueError('Mensagem vazia.')
 
     settings = get_settings()
-    default_temperature = _to_float(settings.get('OPENAI_TEMPERATURE'), 1.0)
-    default_max_tokens = _to_int(settings.get('OPENAI_MAX_OUTPUT_TOKENS'), None)
+    default_temperature = settings.openai_temperature
+    default_max_tokens = settings.openai_max_output_tokens
 
-    user_content = [{'type': 'input_text', 'text': user_text}]
+    user_content = []
+    if document_text:
+        user_content.append({'type': 'input_text', 'text': document_text})
+    user_content.append({'type': 'input_text', 'text': user_text})
     if file_id:
         user_content.append({'type': 'input_file', 'file_id': file_id})
 
@@ -197,14 +454,207 @@ def run_agent_chat(
     if max_tokens is not None and max_tokens > 0:
         payload['max_output_tokens'] = max_tokens
 
+    if enforce:
+        excess = payload_input_tokens(payload) - input_token_cap(payload['model'], payload.get('max_output_tokens'))
+        if excess > 0 and document_text:
+            # Corta os trechos do PDF antes de recusar a mensagem inteira.
+            keep = count_tokens(document_text, payload['model']) - excess
+            user_content[0]['text'] = truncate_tokens(document_text, keep, payload['model'])
+        check_request(payload)
+    return payload
+
+
+def estimate_agent_chat(agent: Dict[str, Any], user_text: str = '', document_text: Optional[str] = None) -> Dict[str, Any]:
+    """Estimativa de uma mensagem ao agente (ex.: tela de configuracao), sem chamar a API."""
+    payload = _build_agent_payload(agent, user_text or ' ', document_text=document_text, enforce=False)
+    return estimate_request(payload)
+
+
+def response_cache_enabled() -> bool:
+    """Padrao do cache de respostas do Chat Testes (RESPONSE_CACHE; o usuario pode ligar/desligar)."""
+    return get_settings().get_bool('RESPONSE_CACHE', False)
+
+
+def response_cache_key(
+    agent: Dict[str, Any],
+    user_text: str,
+    file_id: Optional[str] = None,
+    document_text: Optional[str] = None,
+    user_id: Optional[int] = None,
+    agent_id: Optional[int] = None,
+) -> str:
+    """
+    Chave deterministica da chamada: usuario e agente donos da resposta, modelo,
+    hash do system prompt, temperatura, max tokens, hash do input (pergunta +
+    trechos do PDF) e hash do conteudo do arquivo. Sem historico: com o cache
+    ligado o Chat Testes responde cada mensagem sem previous_response_id.
+    """
+    payload = _build_agent_payload(agent, user_text, document_text=document_text, enforce=False)
+    parts = {
+        # Cada usuario so reaproveita as proprias respostas.
+        'user_id': user_id,
+        'agent_id': agent_id,
+        'model': payload['model'],
+        'system_prompt': hashlib.sha256((payload.get('instructions') or '').encode('utf-8')).hexdigest(),
+        'temperature': payload.get('temperature'),
+        'max_tokens': payload.get('max_output_tokens'),
+        'reasoning': payload.get('reasoning'),
+        'input': hashlib.sha256(json.dumps(payload['input'], sort_keys=True).encode('utf-8')).hexdigest(),
+        # O file_id vem do cache de uploads por conteudo; a chave usa o hash do proprio arquivo.
+        'file': (get_file_hash(file_id) or file_id) if file_id else None,
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_cached_reply(key: str) -> Optional[Dict[str, Any]]:
+    """{output_text, response_id, model} guardado para a chave, ou None."""
+    try:
+        return response_cache_repo.get_response(key)
+    except sqlite3.Error:
+        return None
+
+
+def save_cached_reply(
+    key: str,
+    text: str,
+    response_id: Optional[str],
+    model: Optional[str],
+    agent_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+) -> None:
+    ttl = get_settings().get_float('RESPONSE_CACHE_TTL_HOURS', 24.0) * 3600
+    if ttl <= 0 or not text:
+        return
+    try:
+        response_cache_repo.save_response(key, text, response_id, model, ttl, agent_id=agent_id, user_id=user_id)
+    except sqlite3.Error:
+        pass
+
+
+def _usage_from_response(response) -> Dict[str, Optional[int]]:
+    usage_obj = getattr(response, 'usage', None)
+    if not usage_obj:
+        return {}
+    return {
+        'input_tokens': getattr(usage_obj, 'input_tokens', None),
+        'output_tokens': getattr(usage_obj, 'output_tokens', None),
+        'total_tokens': getattr(usage_obj, 'total_tokens', None),
+    }
+
+
+def run_agent_chat(
+    agent: Dict[str, Any],
+    user_text: str,
+    previous_response_id: Optional[str] = None,
+    file_id: Optional[str] = None,
+    document_text: Optional[str] = None,
+) -> Tuple[str, str, Dict[str, Optional[int]]]:
+    payload = _build_agent_payload(agent, user_text, previous_response_id, file_id, document_text)
+
     client = get_openai_client()
     response = client.responses.create(**payload)
-    usage = {}
-    usage_obj = getattr(response, 'usage', None)
-    if usage_obj:
-        usage = {
-            'input_tokens': getattr(usage_obj, 'input_tokens', None),
-            'output_tokens': getattr(usage_obj, 'output_tokens', None),
-            'total_tokens': getattr(usage_obj, 'total_tokens', None),
+    return response.output_text, response.id, _usage_from_response(response)
+
+
+async def arun_agent_chat(
+    agent: Dict[str, Any],
+    user_text: str,
+    previous_response_id: Optional[str] = None,
+    file_id: Optional[str] = None,
+    document_text: Optional[str] = None,
+) -> Tuple[str, str, Dict[str, Optional[int]]]:
+    """Versao async de run_agent_chat."""
+    payload = _build_agent_payload(agent, user_text, previous_response_id, file_id, document_text)
+
+    client = get_async_openai_client()
+    response = await client.responses.create(**payload)
+    return response.output_text, response.id, _usage_from_response(response)
+
+
+def compare_agent_models(
+    agent: Dict[str, Any],
+    user_text: str,
+    variants: List[Dict[str, Any]],
+    max_workers: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Envia a mesma mensagem ao agente em cada variante (ex.: {'model', 'temperature'})
+    ao mesmo tempo, num pool limitado (COMPARE_MAX_WORKERS). Retorna um resultado
+    por variante, na ordem pedida: texto, response_id, usage, latencia (s), custo
+    estimado (USD) e erro (a falha de uma variante nao derruba as outras).
+    """
+    if not variants:
+        return []
+    workers = max_workers or get_settings().get_int('COMPARE_MAX_WORKERS', 4) or 4
+
+    def call(variant: Dict[str, Any]) -> Dict[str, Any]:
+        cfg = {**agent, **variant}
+        started = time.perf_counter()
+        text, response_id, usage, error = '', None, {}, None
+        try:
+            text, response_id, usage = run_agent_chat(cfg, user_text)
+        except Exception as e:
+            error = str(e)
+        return {
+            **variant,
+            'text': text,
+            'response_id': response_id,
+            'usage': usage,
+            'latency': time.perf_counter() - started,
+            'cost': usage_cost(cfg.get('model'), usage.get('input_tokens'), usage.get('output_tokens')),
+            'error': error,
         }
-    return response.output_text, response.id, usage
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(variants))), thread_name_prefix='compare') as pool:
+        return list(pool.map(call, variants))
+
+
+class AgentChatStream:
+    """
+    Resposta do agente em streaming. Iterar devolve os deltas de texto (pronto
+    para st.write_stream); ao fim da iteracao `text`, `response_id` e `usage`
+    ficam preenchidos com o resultado final, como em run_agent_chat.
+    """
+
+    def __init__(self, events):
+        self._events = events
+        self.text = ''
+        self.response_id: Optional[str] = None
+        self.usage: Dict[str, Optional[int]] = {}
+
+    def __iter__(self) -> Iterator[str]:
+        parts: list[str] = []
+        for event in self._events:
+            event_type = getattr(event, 'type', '')
+            if event_type == 'response.output_text.delta':
+                delta = getattr(event, 'delta', '') or ''
+                if delta:
+                    parts.append(delta)
+                    yield delta
+            elif event_type in ('response.completed', 'response.incomplete'):
+                # "incomplete" = cortado por max_output_tokens: ainda tem id e usage
+                response = event.response
+                self.response_id = response.id
+                self.usage = _usage_from_response(response)
+            elif event_type == 'response.failed':
+                error = getattr(getattr(event, 'response', None), 'error', None)
+                raise RuntimeError(getattr(error, 'message', None) or 'Falha ao gerar a resposta.')
+            elif event_type == 'error':
+                raise RuntimeError(getattr(event, 'message', None) or 'Falha ao gerar a resposta.')
+        self.text = ''.join(parts)
+        if self.response_id is None:
+            raise RuntimeError('Stream encerrado antes da resposta completa.')
+
+
+def stream_agent_chat(
+    agent: Dict[str, Any],
+    user_text: str,
+    previous_response_id: Optional[str] = None,
+    file_id: Optional[str] = None,
+    document_text: Optional[str] = None,
+) -> AgentChatStream:
+    """Variante de run_agent_chat que entrega o texto conforme o modelo gera."""
+    payload = _build_agent_payload(agent, user_text, previous_response_id, file_id, document_text)
+
+    client = get_openai_client()
+    return AgentChatStream(client.responses.create(**payload, stream=True))
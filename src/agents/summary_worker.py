@@ -0,0 +1,229 @@
+"""
+Resumo de Compliance fora do caminho da resposta do chat.
+
+O chat so enfileira o pedido (enqueue_compliance_summary). Threads de fundo
+consomem a fila persistente `summary_jobs`, chamam generate_compliance_summary
+(em modo estrito: falha da API vira nova tentativa, nunca o texto de fallback)
+e gravam conversation_topic_summary. Como a fila guarda um pedido por chat,
+varios envios seguidos geram um unico resumo, sempre da versao mais recente.
+
+Depois do primeiro resumo o modo e incremental: o modelo recebe o resumo
+anterior + as mensagens novas, e so a cada SUMMARY_EVERY_N_TURNS turnos (ou
+quando o assunto muda) ha nova chamada.
+"""
+import functools
+import threading
+from typing import Callable, Optional
+
+from src.core.config import get_settings
+from src.agents.service import (
+    build_compliance_summary_input,
+    estimate_tokens,
+    generate_compliance_summary,
+    has_topic_summary,
+    summary_topic_drift,
+)
+from src.repos.summary_jobs_repo import (
+    claim_summary_job,
+    complete_summary_job,
+    count_open_summary_jobs,
+    enqueue_summary_job,
+    fail_summary_job,
+    get_summary_context,
+    requeue_running_summary_jobs,
+)
+
+
+def _to_int(value, default: int) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _to_float(value, default: float) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _to_bool(value, default: bool) -> bool:
+    txt = str(value or "").strip().lower()
+    if not txt:
+        return default
+    return txt in ("1", "true", "yes", "on", "sim")
+
+
+class SummaryWorker:
+    def __init__(
+        self,
+        summarize: Callable[..., str] = functools.partial(generate_compliance_summary, strict=True),
+        threads: int = 2,
+        max_attempts: int = 3,
+        poll_interval: float = 5.0,
+        incremental: bool = True,
+        every_n_turns: int = 3,
+        drift_threshold: float = 0.2,
+    ):
+        self.summarize = summarize
+        self.threads = max(1, threads)
+        self.max_attempts = max(1, max_attempts)
+        self.poll_interval = poll_interval
+        self.incremental = incremental
+        self.every_n_turns = max(1, every_n_turns)
+        self.drift_threshold = drift_threshold
+        self._wakeup = threading.Condition()
+        self._pending_signal = False
+        self._stopping = False
+        self._busy = 0
+        self._threads: list[threading.Thread] = []
+        # Sessoes do Streamlit chamam start() em paralelo: so uma sobe as threads.
+        self._lifecycle = threading.Lock()
+
+    # --- ciclo de vida ---
+    def start(self) -> None:
+        with self._lifecycle:
+            if self._threads:
+                return
+            self._stopping = False
+            requeue_running_summary_jobs()
+            for i in range(self.threads):
+                t = threading.Thread(target=self._run, name=f"summary-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        with self._lifecycle:
+            with self._wakeup:
+                self._stopping = True
+                self._wakeup.notify_all()
+            for t in self._threads:
+                t.join(timeout)
+            self._threads = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads)
+
+    def notify(self) -> None:
+        with self._wakeup:
+            self._pending_signal = True
+            self._wakeup.notify_all()
+
+    # --- processamento ---
+    def process_one(self) -> bool:
+        """Processa um pedido da fila na thread atual. False se a fila estava vazia."""
+        job = claim_summary_job()
+        if job is None:
+            return False
+        chat_id, user_id, version = job["chat_id"], job["user_id"], job["version"]
+        try:
+            result = self._summarize(get_summary_context(chat_id))
+        except Exception as e:
+            fail_summary_job(chat_id, version, str(e), max_attempts=self.max_attempts)
+            return True
+        complete_summary_job(chat_id, user_id, version, **result)
+        return True
+
+    def _summarize(self, ctx: dict) -> dict:
+        previous = ctx["summary"]
+        recent = ctx["recent_messages"]
+        new = ctx["new_messages"]
+        # Custo do modo antigo: re-resumir a transcricao recente inteira a cada turno.
+        full_cost = estimate_tokens(build_compliance_summary_input(recent))
+
+        if not (self.incremental and has_topic_summary(previous)):
+            summary = self.summarize(recent)
+            return {
+                "summary": summary,
+                "summarized_message_id": recent[-1]["id"] if recent else None,
+                "tokens_sent": full_cost,
+            }
+
+        new_turns = sum(1 for m in new if m.get("role") == "user")
+        if not new or (
+            new_turns < self.every_n_turns
+            and not summary_topic_drift(previous, new, self.drift_threshold)
+        ):
+            # Resumo adiado: as mensagens continuam "novas" para a proxima rodada.
+            return {"summary": None, "tokens_saved": full_cost}
+
+        sent = estimate_tokens(build_compliance_summary_input(new, previous))
+        summary = self.summarize(new, previous_summary=previous)
+        return {
+            "summary": summary,
+            "summarized_message_id": new[-1]["id"],
+            "tokens_sent": sent,
+            "tokens_saved": max(0, full_cost - sent),
+        }
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Esvazia a fila. Sem threads em execucao processa tudo na thread atual
+        (deterministico para testes); com threads, espera elas terminarem.
+        Retorna True se nao sobrou pedido aberto.
+        """
+        if not self.running:
+            while self.process_one():
+                pass
+            return count_open_summary_jobs() == 0
+
+        self.notify()
+        with self._wakeup:
+            return self._wakeup.wait_for(
+                lambda: self._busy == 0 and not self._pending_signal and count_open_summary_jobs() == 0,
+                timeout=timeout,
+            )
+
+    def _run(self) -> None:
+        while True:
+            with self._wakeup:
+                self._wakeup.wait_for(lambda: self._stopping or self._pending_signal, timeout=self.poll_interval)
+                if self._stopping:
+                    return
+                self._pending_signal = False
+                self._busy += 1
+            try:
+                while not self._stopping and self.process_one():
+                    pass
+            except Exception:
+                # erro de banco: tenta de novo no proximo ciclo
+                pass
+            finally:
+                with self._wakeup:
+                    self._busy -= 1
+                    self._wakeup.notify_all()
+
+
+_worker: Optional[SummaryWorker] = None
+_worker_lock = threading.Lock()
+
+
+def get_summary_worker() -> SummaryWorker:
+    """Worker unico do processo (todas as sessoes do Streamlit compartilham)."""
+    global _worker
+    if _worker is None:
+        with _worker_lock:
+            if _worker is None:
+                settings = get_settings()
+                _worker = SummaryWorker(
+                    threads=_to_int(settings.get("SUMMARY_WORKERS"), 2),
+                    max_attempts=_to_int(settings.get("SUMMARY_MAX_ATTEMPTS"), 3),
+                    incremental=_to_bool(settings.get("SUMMARY_INCREMENTAL"), True),
+                    every_n_turns=_to_int(settings.get("SUMMARY_EVERY_N_TURNS"), 3),
+                    drift_threshold=_to_float(settings.get("SUMMARY_DRIFT_THRESHOLD"), 0.2),
+                )
+    return _worker
+
+
+def enqueue_compliance_summary(chat_id: int, user_id: int) -> None:
+    """Agenda o resumo de Compliance do chat sem bloquear quem chamou."""
+    worker = get_summary_worker()
+    enqueue_summary_job(chat_id, user_id)
+    worker.start()
+    worker.notify()
+
+
+def drain_summaries(timeout: Optional[float] = None) -> bool:
+    return get_summary_worker().drain(timeout)
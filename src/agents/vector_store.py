@@ -0,0 +1,92 @@
+"""
+Indice vetorial dos documentos: uma matriz float32 (chunks x dim) por documento
+e embedder, gravada em arquivo e lida com np.memmap (o SO pagina sob demanda;
+nada fica residente entre buscas). Busca top-k por cosseno vetorizada.
+"""
+import os
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from src.core.config import get_settings
+from src.core.db import get_db_path
+from src.repos.documents_repo import get_vector_index, iter_chunk_texts, save_vector_index
+
+
+_EMBED_BATCH = 64
+_UNSAFE_RE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def index_dir() -> Path:
+    """RAG_INDEX_DIR, ou uma pasta ao lado do banco (cada banco tem seus vetores)."""
+    configured = (get_settings().get("RAG_INDEX_DIR") or "").strip()
+    return Path(configured) if configured else Path(f"{get_db_path()}.vectors")
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def build_index(doc: Dict[str, Any], embedder) -> Optional[Dict[str, Any]]:
+    """
+    Gera os embeddings dos chunks em lotes, escrevendo direto no memmap (memoria
+    limitada a um lote). O arquivo so passa a valer depois de completo.
+    """
+    rows = int(doc.get("chunks") or 0)
+    if rows <= 0:
+        return None
+    directory = index_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{doc['hash']}.{_UNSAFE_RE.sub('_', embedder.name)}.f32"
+    tmp_path = path.with_suffix(".tmp")
+
+    matrix = None
+    written = 0
+    try:
+        for texts in iter_chunk_texts(doc["hash"], _EMBED_BATCH):
+            vectors = np.asarray(embedder.embed(texts), dtype=np.float32)
+            if matrix is None:
+                matrix = np.memmap(tmp_path, dtype=np.float32, mode="w+", shape=(rows, vectors.shape[1]))
+            matrix[written:written + len(vectors)] = _normalize(vectors)
+            written += len(vectors)
+        if matrix is None or written != rows:
+            raise RuntimeError(f"Indice incompleto: {written} de {rows} chunks.")
+        dim = matrix.shape[1]
+        matrix.flush()
+        del matrix
+        os.replace(tmp_path, path)
+    except BaseException:
+        matrix = None
+        tmp_path.unlink(missing_ok=True)
+        raise
+    save_vector_index(doc["hash"], embedder.name, dim, rows, str(path))
+    return get_vector_index(doc["hash"], embedder.name)
+
+
+def _open(index: Dict[str, Any]) -> Optional[np.memmap]:
+    path = Path(index["path"])
+    if not path.exists():
+        return None
+    return np.memmap(path, dtype=np.float32, mode="r", shape=(index["rows"], index["dim"]))
+
+
+def top_k(doc: Dict[str, Any], question: str, k: int, embedder) -> List[int]:
+    """idx dos k chunks mais proximos da pergunta (cosseno), do mais ao menos similar."""
+    index = get_vector_index(doc["hash"], embedder.name)
+    matrix = _open(index) if index else None
+    if matrix is None:
+        index = build_index(doc, embedder)
+        matrix = _open(index) if index else None
+    if matrix is None:
+        return []
+
+    query = _normalize(np.asarray(embedder.embed([question]), dtype=np.float32)[0])
+    if query.shape[0] != matrix.shape[1] or not query.any():
+        return []
+    scores = matrix @ query  # linhas ja normalizadas: produto escalar = cosseno
+    k = max(1, min(int(k), len(scores)))
+    best = np.argpartition(-scores, k - 1)[:k]
+    return [int(i) for i in best[np.argsort(-scores[best], kind="stable")]]
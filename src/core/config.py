@@ -1,16 +1,44 @@
 ﻿import os
+import threading
+import time
+from collections.abc import Mapping
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Optional
 
-try:
-    from dotenv import load_dotenv
+ROOT = Path(__file__).resolve().parents[2]
+DOTENV_PATH = ROOT / '.env'
 
-    ROOT = Path(__file__).resolve().parents[2]
-    load_dotenv(ROOT / '.env')
+try:
+    from dotenv import dotenv_values
 except Exception:
-    pass
+    dotenv_values = None
 
 # src/core/config.py
 
+# Valores que vieram do .env na ultima leitura: ao recarregar o arquivo, so essas
+# variaveis sao atualizadas (variaveis exportadas de verdade continuam valendo).
+_dotenv_loaded: dict = {}
+
+
+def _load_dotenv_file() -> None:
+    global _dotenv_loaded
+    if dotenv_values is None:
+        return
+    try:
+        values = {k: v for k, v in dotenv_values(DOTENV_PATH).items() if v is not None}
+    except Exception:
+        return
+    for key, value in values.items():
+        current = os.environ.get(key)
+        if current is None or current == _dotenv_loaded.get(key):
+            os.environ[key] = value
+    _dotenv_loaded = values
+
+
+_load_dotenv_file()
+
+
 def _secrets_dict() -> dict:
     '''
     Retorna st.secrets como dict, mas NUNCA quebra quando nao existe secrets.toml
@@ -23,9 +51,79 @@ def _secrets_dict() -> dict:
         return {}
 
 
-def get_settings() -> dict:
-    secrets = _secrets_dict()
+def _reset_streamlit_secrets() -> None:
+    # st.secrets guarda o arquivo parseado; sem o file watcher do servidor ele nao recarrega.
+    try:
+        import streamlit as st
+        reset = getattr(st.secrets, '_reset', None)
+        if reset is not None:
+            reset()
+    except Exception:
+        pass
+
+
+def _parse_float(value, default: float) -> float:
+    try:
+        if value is None or value == '':
+            return default
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _parse_int(value, default: Optional[int]) -> Optional[int]:
+    try:
+        if value is None or value == '':
+            return default
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class Settings(Mapping):
+    """
+    Configuracao resolvida uma vez (secrets -> env -> default). Continua acessivel
+    como o dict antigo (settings.get('CHAVE'), settings['CHAVE']) e expoe os campos
+    usados a cada turno do chat ja convertidos.
+    """
+
+    def __init__(self, values: dict):
+        self._values = dict(values)
+        self.openai_api_key: str = self._values.get('OPENAI_API_KEY', '')
+        self.openai_model: str = self._values.get('OPENAI_MODEL', '')
+        self.openai_temperature: float = _parse_float(self._values.get('OPENAI_TEMPERATURE'), 0.7)
+        max_tokens = _parse_int(self._values.get('OPENAI_MAX_OUTPUT_TOKENS'), None)
+        self.openai_max_output_tokens: Optional[int] = max_tokens if max_tokens and max_tokens > 0 else None
+
+    def __getitem__(self, key: str) -> str:
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self) -> int:
+        return len(self._values)
 
+    def __repr__(self) -> str:
+        return f'Settings({sorted(self._values)})'
+
+    def get_int(self, key: str, default: Optional[int] = None) -> Optional[int]:
+        return _parse_int(self._values.get(key), default)
+
+    def get_float(self, key: str, default: float = 0.0) -> float:
+        return _parse_float(self._values.get(key), default)
+
+    def get_bool(self, key: str, default: bool = False) -> bool:
+        value = str(self._values.get(key) or '').strip().lower()
+        if not value:
+            return default
+        return value in ('1', 'true', 'yes', 'on', 'sim')
+
+    def replace(self, **values) -> 'Settings':
+        return Settings({**self._values, **{k: str(v) for k, v in values.items()}})
+
+
+def _build_values(secrets: dict) -> dict:
     def pick(key: str, default: str = '') -> str:
         # Prioridade: secrets (cloud) -> env var (local/CI) -> default
         return str(secrets.get(key) or os.getenv(key) or default)
@@ -42,4 +140,137 @@ def get_settings() -> dict:
         'OPENAI_MODEL': pick('OPENAI_MODEL', 'gpt-4o-mini').strip(),
         'OPENAI_TEMPERATURE': pick('OPENAI_TEMPERATURE', '0.7').strip(),
         'OPENAI_MAX_OUTPUT_TOKENS': max_tokens.strip(),
-    }
+        'OPENAI_BASE_URL': pick('OPENAI_BASE_URL', '').strip(),
+        'OPENAI_TIMEOUT': pick('OPENAI_TIMEOUT', '60').strip(),
+        'OPENAI_CONNECT_TIMEOUT': pick('OPENAI_CONNECT_TIMEOUT', '10').strip(),
+        'OPENAI_MAX_CONNECTIONS': pick('OPENAI_MAX_CONNECTIONS', '20').strip(),
+        'OPENAI_MAX_KEEPALIVE': pick('OPENAI_MAX_KEEPALIVE', '10').strip(),
+        'OPENAI_KEEPALIVE_EXPIRY': pick('OPENAI_KEEPALIVE_EXPIRY', '30').strip(),
+        'OPENAI_RPM': pick('OPENAI_RPM', '500').strip(),
+        'OPENAI_TPM': pick('OPENAI_TPM', '200000').strip(),
+        'OPENAI_MODEL_LIMITS': pick('OPENAI_MODEL_LIMITS', '').strip(),
+        'OPENAI_MAX_RETRIES': pick('OPENAI_MAX_RETRIES', '4').strip(),
+        'OPENAI_RETRY_BASE_DELAY': pick('OPENAI_RETRY_BASE_DELAY', '0.5').strip(),
+        'OPENAI_RETRY_MAX_DELAY': pick('OPENAI_RETRY_MAX_DELAY', '20').strip(),
+        'DB_POOL_SIZE': pick('DB_POOL_SIZE', '5').strip(),
+        'DB_POOL_TIMEOUT': pick('DB_POOL_TIMEOUT', '30').strip(),
+        'DB_PROFILE': pick('DB_PROFILE', 'performance').strip().lower(),
+        'DB_JOURNAL_MODE': pick('DB_JOURNAL_MODE', '').strip(),
+        'DB_SYNCHRONOUS': pick('DB_SYNCHRONOUS', '').strip(),
+        'DB_MMAP_SIZE': pick('DB_MMAP_SIZE', '').strip(),
+        'DB_CACHE_SIZE': pick('DB_CACHE_SIZE', '').strip(),
+        'DB_TEMP_STORE': pick('DB_TEMP_STORE', '').strip(),
+        'DB_BUSY_TIMEOUT_MS': pick('DB_BUSY_TIMEOUT_MS', '').strip(),
+        'DB_BUSY_RETRIES': pick('DB_BUSY_RETRIES', '5').strip(),
+        'SUMMARY_WORKERS': pick('SUMMARY_WORKERS', '2').strip(),
+        'SUMMARY_MAX_ATTEMPTS': pick('SUMMARY_MAX_ATTEMPTS', '3').strip(),
+        'SUMMARY_INCREMENTAL': pick('SUMMARY_INCREMENTAL', 'true').strip().lower(),
+        'SUMMARY_EVERY_N_TURNS': pick('SUMMARY_EVERY_N_TURNS', '3').strip(),
+        'SUMMARY_DRIFT_THRESHOLD': pick('SUMMARY_DRIFT_THRESHOLD', '0.2').strip(),
+        'COMPLIANCE_PRICING_VERSION': pick('COMPLIANCE_PRICING_VERSION', 'v1').strip(),
+        'SESSION_CACHE_TTL': pick('SESSION_CACHE_TTL', '30').strip(),
+        'SESSION_CACHE_MAX_ENTRIES': pick('SESSION_CACHE_MAX_ENTRIES', '256').strip(),
+        'PDF_LOCAL_EXTRACTION': pick('PDF_LOCAL_EXTRACTION', 'true').strip().lower(),
+        'DOC_CHUNK_CHARS': pick('DOC_CHUNK_CHARS', '1200').strip(),
+        'DOC_CHUNK_OVERLAP': pick('DOC_CHUNK_OVERLAP', '150').strip(),
+        'DOC_CONTEXT_CHUNKS': pick('DOC_CONTEXT_CHUNKS', '4').strip(),
+        'ATTACHMENT_CACHE_TTL_HOURS': pick('ATTACHMENT_CACHE_TTL_HOURS', '72').strip(),
+        'ATTACHMENT_CLEANUP_INTERVAL': pick('ATTACHMENT_CLEANUP_INTERVAL', '3600').strip(),
+        'RAG_EMBEDDER': pick('RAG_EMBEDDER', 'openai').strip().lower(),
+        'EMBEDDING_MODEL': pick('EMBEDDING_MODEL', 'text-embedding-3-small').strip(),
+        'RAG_HASHING_DIM': pick('RAG_HASHING_DIM', '256').strip(),
+        'RAG_INDEX_DIR': pick('RAG_INDEX_DIR', '').strip(),
+        'MAX_INPUT_TOKENS': pick('MAX_INPUT_TOKENS', '0').strip(),
+        'TIKTOKEN_CACHE_DIR': pick('TIKTOKEN_CACHE_DIR', '').strip(),
+        'RESPONSE_CACHE': pick('RESPONSE_CACHE', 'false').strip().lower(),
+        'RESPONSE_CACHE_TTL_HOURS': pick('RESPONSE_CACHE_TTL_HOURS', '24').strip(),
+        'RESPONSE_CACHE_MAX_ENTRIES': pick('RESPONSE_CACHE_MAX_ENTRIES', '256').strip(),
+        'COMPARE_MAX_WORKERS': pick('COMPARE_MAX_WORKERS', '4').strip(),
+    }
+
+
+# Arquivos que, ao mudar, invalidam o cache.
+_WATCHED_FILES = (
+    DOTENV_PATH,
+    ROOT / '.streamlit' / 'secrets.toml',
+    Path.cwd() / '.streamlit' / 'secrets.toml',
+    Path.home() / '.streamlit' / 'secrets.toml',
+)
+_FILE_CHECK_INTERVAL = 1.0
+
+_cache_lock = threading.Lock()
+# (settings, fingerprint do env, mtimes dos arquivos) trocado de uma vez so.
+_cache: Optional[tuple] = None
+_next_file_check = 0.0
+_override: Optional[dict] = None
+
+
+def _file_mtimes() -> tuple:
+    mtimes = []
+    for path in _WATCHED_FILES:
+        try:
+            mtimes.append(path.stat().st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+
+def _env_fingerprint(settings: Settings) -> tuple:
+    # Chaves do settings + o alias legado OPENAI_MAX_TOKENS.
+    return tuple(os.environ.get(key) for key in settings) + (os.environ.get('OPENAI_MAX_TOKENS'),)
+
+
+def get_settings() -> Settings:
+    """
+    Settings memoizados por processo. Reconstroi so quando .env/secrets.toml mudam
+    no disco ou quando alguma das variaveis conhecidas muda no ambiente; a
+    conferencia acontece no maximo uma vez por _FILE_CHECK_INTERVAL (use
+    clear_settings_cache() apos mudar o ambiente e precisar do valor na hora).
+    """
+    global _cache, _next_file_check
+    cache = _cache
+    if cache is not None and time.monotonic() < _next_file_check:
+        return cache[0]
+
+    with _cache_lock:
+        mtimes = _file_mtimes()
+        _next_file_check = time.monotonic() + _FILE_CHECK_INTERVAL
+        cache = _cache
+        if cache is not None and mtimes == cache[2] and _env_fingerprint(cache[0]) == cache[1]:
+            return cache[0]
+        if cache is not None and mtimes != cache[2]:
+            _load_dotenv_file()
+            _reset_streamlit_secrets()
+
+        values = _build_values(_secrets_dict())
+        if _override:
+            values.update(_override)
+        settings = Settings(values)
+        _cache = (settings, _env_fingerprint(settings), mtimes)
+        return settings
+
+
+def clear_settings_cache() -> None:
+    """Forca a releitura completa na proxima chamada de get_settings()."""
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+@contextmanager
+def override_settings(**values):
+    """
+    Gancho para testes: sobrescreve chaves de get_settings() dentro do bloco.
+
+        with override_settings(OPENAI_TEMPERATURE='0.1'):
+            ...
+    """
+    global _override
+    previous = _override
+    _override = {**(previous or {}), **{k: str(v) for k, v in values.items()}}
+    clear_settings_cache()
+    try:
+        yield get_settings()
+    finally:
+        _override = previous
+        clear_settings_cache()
@@ -1,151 +1,328 @@
+import functools
 import os
+import random
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
+from .config import get_settings
+from .migrations import migrate
+
 
 def get_db_path() -> str:
     return os.getenv("APP_DB_PATH", "data/app.db")
 
 
-def connect():
-    db_path = get_db_path()
+def _to_int(value, default: int) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _to_float(value, default: float) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+# Perfis de PRAGMA aplicados a toda conexao aberta (pool ou avulsa).
+# "performance": WAL deixa leitores (Compliance) rodarem em paralelo ao escritor
+# (add_message) e busy_timeout faz o SQLite esperar o lock em vez de falhar na hora.
+DB_PROFILES = {
+    "default": {
+        "busy_timeout": 5000,
+    },
+    "performance": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 268435456,  # 256 MiB
+        "cache_size": -65536,  # negativo = KiB (64 MiB)
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+}
+
+# PRAGMA -> chave de settings que sobrescreve o valor do perfil.
+_PRAGMA_SETTINGS = {
+    "journal_mode": "DB_JOURNAL_MODE",
+    "synchronous": "DB_SYNCHRONOUS",
+    "mmap_size": "DB_MMAP_SIZE",
+    "cache_size": "DB_CACHE_SIZE",
+    "temp_store": "DB_TEMP_STORE",
+    "busy_timeout": "DB_BUSY_TIMEOUT_MS",
+}
+
+
+def get_db_profile(settings: dict | None = None) -> dict:
+    """PRAGMAs do perfil DB_PROFILE com os overrides individuais de settings."""
+    settings = settings if settings is not None else get_settings()
+    name = (settings.get("DB_PROFILE") or "performance").strip().lower()
+    if name not in DB_PROFILES:
+        raise ValueError(f"DB_PROFILE invalido: {name!r}. Opcoes: {', '.join(DB_PROFILES)}.")
+    pragmas = dict(DB_PROFILES[name])
+    for pragma, key in _PRAGMA_SETTINGS.items():
+        value = str(settings.get(key) or "").strip()
+        if value:
+            pragmas[pragma] = value
+    return pragmas
+
+
+def _apply_pragmas(conn: sqlite3.Connection, pragmas: dict) -> None:
+    for pragma, value in pragmas.items():
+        if pragma not in _PRAGMA_SETTINGS:
+            raise ValueError(f"PRAGMA nao suportado: {pragma!r}")
+        value = str(value).strip()
+        if not value.lstrip("-").isalnum():
+            raise ValueError(f"Valor invalido para PRAGMA {pragma}: {value!r}")
+        conn.execute(f"PRAGMA {pragma} = {value}")
+
+
+def _open_connection(db_path: str, pragmas: dict | None = None) -> sqlite3.Connection:
     Path(db_path).parent.mkdir(parents=True, exist_ok=True)
     conn = sqlite3.connect(db_path, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    if pragmas:
+        _apply_pragmas(conn, pragmas)
     return conn
 
 
-def init_db():
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        email TEXT NOT NULL UNIQUE,
-        password_hash TEXT NOT NULL,
-        role TEXT NOT NULL,
-        active INTEGER NOT NULL DEFAULT 1,
-        created_at TEXT NOT NULL DEFAULT (datetime('now')),
-        updated_at TEXT NOT NULL DEFAULT (datetime('now'))
-    );
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS agents (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL REFERENCES users(id),
-        name TEXT NOT NULL,
-        description TEXT,
-        model TEXT NOT NULL,
-        max_tokens INTEGER NOT NULL,
-        temperature REAL NOT NULL,
-        system_prompt TEXT,
-        created_at TEXT NOT NULL DEFAULT (datetime('now'))
-    );
-    """)
-
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS chats (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL REFERENCES users(id),
-        agent_id INTEGER NOT NULL REFERENCES agents(id),
-        title TEXT NOT NULL,
-        conversation_topic_summary TEXT,
-        previous_response_id TEXT NULL,
-        created_at TEXT NOT NULL DEFAULT (datetime('now')),
-        updated_at TEXT NOT NULL DEFAULT (datetime('now'))
-    );
-    """)
-
-    # Migracao: se chat_messages antiga (user_id, agent_id) existir, substituir pela nova (chat_id)
-    cur.execute(
-        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='chat_messages'"
-    )
-    if cur.fetchone():
-        cur.execute("PRAGMA table_info(chat_messages)")
-        cols = [row[1] for row in cur.fetchall()]
-        if "agent_id" in cols or "user_id" in cols:
-            cur.execute("DROP TABLE chat_messages")
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS chat_messages (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        chat_id INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
-        role TEXT NOT NULL,
-        content TEXT NOT NULL,
-        tokens INTEGER NOT NULL DEFAULT 0,
-        has_attachment INTEGER NOT NULL DEFAULT 0,
-        attachment_filename TEXT,
-        created_at TEXT NOT NULL DEFAULT (datetime('now'))
-    );
-    """)
-
-    # Migracao em chat_messages (tokens)
-    cur.execute('PRAGMA table_info(chat_messages)')
-    msg_cols = [row['name'] if isinstance(row, sqlite3.Row) else row[1] for row in cur.fetchall()]
-    if 'tokens' not in msg_cols:
-        cur.execute('ALTER TABLE chat_messages ADD COLUMN tokens INTEGER NOT NULL DEFAULT 0')
-    if 'has_attachment' not in msg_cols:
-        cur.execute('ALTER TABLE chat_messages ADD COLUMN has_attachment INTEGER NOT NULL DEFAULT 0')
-    if 'attachment_filename' not in msg_cols:
-        cur.execute('ALTER TABLE chat_messages ADD COLUMN attachment_filename TEXT')
-
-    # Migracoes em agents
-    cur.execute("PRAGMA table_info(agents)")
-    agent_cols = [
-        row["name"] if isinstance(row, sqlite3.Row) else row[1]
-        for row in cur.fetchall()
-    ]
-    if "description" not in agent_cols:
-        cur.execute("ALTER TABLE agents ADD COLUMN description TEXT")
-    if "max_tokens" not in agent_cols:
-        cur.execute(
-            "ALTER TABLE agents ADD COLUMN max_tokens INTEGER NOT NULL DEFAULT 1024"
-        )
-    if "temperature" not in agent_cols:
-        cur.execute(
-            "ALTER TABLE agents ADD COLUMN temperature REAL NOT NULL DEFAULT 0.7"
-        )
-    if "system_prompt" not in agent_cols:
-        cur.execute("ALTER TABLE agents ADD COLUMN system_prompt TEXT")
-        if "instructions" in agent_cols:
-            cur.execute(
-                'UPDATE agents SET system_prompt = instructions WHERE system_prompt IS NULL OR system_prompt = ""'
+def connect():
+    """Abre uma conexao avulsa (fora do pool). Quem chama deve fechar."""
+    return _open_connection(get_db_path(), get_db_profile())
+
+
+# Esperas por lock/conexao acumuladas no processo (expostas ao teste de carga).
+_wait_stats = {"pool_waits": 0, "pool_wait_s": 0.0, "busy_retries": 0, "busy_wait_s": 0.0}
+_wait_stats_lock = threading.Lock()
+
+
+def _record_wait(prefix: str, count_key: str, seconds: float) -> None:
+    with _wait_stats_lock:
+        _wait_stats[count_key] += 1
+        _wait_stats[f"{prefix}_wait_s"] += seconds
+
+
+def get_db_wait_stats() -> dict:
+    """Contadores de espera: conexao livre no pool e retries de "database is locked"."""
+    with _wait_stats_lock:
+        return dict(_wait_stats)
+
+
+def reset_db_wait_stats() -> None:
+    with _wait_stats_lock:
+        for key in _wait_stats:
+            _wait_stats[key] = 0 if isinstance(_wait_stats[key], int) else 0.0
+
+
+class PoolTimeoutError(RuntimeError):
+    """Nenhuma conexao do pool ficou livre dentro do timeout configurado."""
+
+
+class ConnectionPool:
+    """
+    Pool de conexoes SQLite de longa duracao para um arquivo de banco.
+
+    A thread que adquire uma conexao a mantem ate o ultimo release; chamadas
+    aninhadas na mesma thread reaproveitam a mesma conexao. No maximo `size`
+    conexoes ficam abertas; as demais threads esperam ate `timeout` segundos.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        size: int = 5,
+        timeout: float = 30.0,
+        pragmas: dict | None = None,
+        busy_retries: int = 5,
+    ):
+        self.db_path = db_path
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.pragmas = dict(pragmas or {})
+        self.busy_retries = max(0, busy_retries)
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+
+    def acquire(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.depth += 1
+            return conn
+
+        if not self._slots.acquire(blocking=False):
+            started = time.perf_counter()
+            acquired = self._slots.acquire(timeout=self.timeout)
+            _record_wait("pool", "pool_waits", time.perf_counter() - started)
+            if not acquired:
+                raise PoolTimeoutError(
+                    f"Timeout ({self.timeout}s) aguardando conexao livre em {self.db_path}."
+                )
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            try:
+                conn = _open_connection(self.db_path, self.pragmas)
+            except Exception:
+                self._slots.release()
+                raise
+
+        self._local.conn = conn
+        self._local.depth = 1
+        self._local.tx_depth = 0
+        return conn
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        if getattr(self._local, "conn", None) is not conn:
+            raise RuntimeError("Conexao liberada por uma thread que nao a possui.")
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+
+        self._local.conn = None
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if self._closed:
+                conn.close()
+            else:
+                self._idle.append(conn)
+        self._slots.release()
+
+    def in_transaction(self) -> bool:
+        """True se a thread atual esta dentro de um bloco transaction() deste pool."""
+        return getattr(self._local, "conn", None) is not None and self._local.tx_depth > 0
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Commit ao sair sem erro, rollback em excecao. Aninhado: so o mais externo faz commit."""
+        with self.connection() as conn:
+            outermost = self._local.tx_depth == 0
+            self._local.tx_depth += 1
+            try:
+                yield conn
+                if outermost:
+                    conn.commit()
+            except BaseException:
+                if outermost:
+                    conn.rollback()
+                raise
+            finally:
+                self._local.tx_depth -= 1
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    db_path = get_db_path()
+    pool = _pools.get(db_path)
+    if pool is not None:
+        return pool
+    with _pools_lock:
+        pool = _pools.get(db_path)
+        if pool is None:
+            settings = get_settings()
+            pool = ConnectionPool(
+                db_path,
+                size=_to_int(settings.get("DB_POOL_SIZE"), 5),
+                timeout=_to_float(settings.get("DB_POOL_TIMEOUT"), 30.0),
+                pragmas=get_db_profile(settings),
+                busy_retries=_to_int(settings.get("DB_BUSY_RETRIES"), 5),
             )
-    if "created_at" not in agent_cols:
-        cur.execute("ALTER TABLE agents ADD COLUMN created_at TEXT DEFAULT ''")
-        cur.execute("UPDATE agents SET created_at = datetime('now') WHERE created_at = '' OR created_at IS NULL")
-
-    # Migracao em chats
-    cur.execute('PRAGMA table_info(chats)')
-    chat_cols = [row['name'] if isinstance(row, sqlite3.Row) else row[1] for row in cur.fetchall()]
-    if 'conversation_topic_summary' not in chat_cols:
-        cur.execute('ALTER TABLE chats ADD COLUMN conversation_topic_summary TEXT')
-    if 'previous_response_id' not in chat_cols:
-        cur.execute('ALTER TABLE chats ADD COLUMN previous_response_id TEXT')
-    if 'updated_at' not in chat_cols:
-        cur.execute("ALTER TABLE chats ADD COLUMN updated_at TEXT DEFAULT ''")
-        cur.execute("UPDATE chats SET updated_at = datetime('now') WHERE updated_at = '' OR updated_at IS NULL")
-
-    # Tabela de mensagens do Chat Testes (Configurar Agente / Editar agente) para auditoria
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS chat_test_messages (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL REFERENCES users(id),
-        agent_id INTEGER REFERENCES agents(id),
-        role TEXT NOT NULL,
-        content TEXT NOT NULL,
-        tokens INTEGER NOT NULL DEFAULT 0,
-        has_attachment INTEGER NOT NULL DEFAULT 0,
-        attachment_filename TEXT,
-        created_at TEXT NOT NULL DEFAULT (datetime('now'))
-    );
-    """)
-    cur.execute("PRAGMA table_info(chat_test_messages)")
-    test_cols = [row["name"] if isinstance(row, sqlite3.Row) else row[1] for row in cur.fetchall()]
-    if "model" not in test_cols:
-        cur.execute("ALTER TABLE chat_test_messages ADD COLUMN model TEXT")
-    if "agent_name" not in test_cols:
-        cur.execute("ALTER TABLE chat_test_messages ADD COLUMN agent_name TEXT")
-
-    conn.commit()
-    conn.close()
+            _pools[db_path] = pool
+    return pool
+
+
+def close_pools() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def _is_busy_error(exc: Exception) -> bool:
+    msg = str(exc).lower()
+    return "database is locked" in msg or "database is busy" in msg or "database table is locked" in msg
+
+
+def retry_on_busy(fn):
+    """
+    Reexecuta a operacao de repositorio quando o SQLite devolve "database is locked"
+    mesmo apos o busy_timeout. Backoff exponencial com jitter; tentativas em
+    DB_BUSY_RETRIES. Dentro de uma transaction() externa nao ha retry: so quem
+    abriu a transacao pode refaze-la por inteiro.
+    """
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        pool = get_pool()
+        delay = 0.05
+        attempt = 0
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except sqlite3.OperationalError as exc:
+                if attempt >= pool.busy_retries or not _is_busy_error(exc) or pool.in_transaction():
+                    raise
+                attempt += 1
+                pause = delay + random.uniform(0, delay)
+                _record_wait("busy", "busy_retries", pause)
+                time.sleep(pause)
+                delay = min(delay * 2, 2.0)
+
+    return wrapper
+
+
+def get_connection():
+    """Context manager com uma conexao do pool do banco atual (somente leitura ou escrita manual)."""
+    return get_pool().connection()
+
+
+def transaction():
+    """Context manager transacional sobre uma conexao do pool do banco atual."""
+    return get_pool().transaction()
+
+
+_migrated_paths: set[str] = set()
+_migrate_lock = threading.Lock()
+
+
+@retry_on_busy
+def init_db():
+    """
+    Garante o schema em dia. As migracoes rodam uma vez por processo e por banco;
+    depois disso a chamada e O(1) (nao abre conexao nem consulta o SQLite).
+    """
+    db_path = get_db_path()
+    if db_path in _migrated_paths:
+        return
+    with _migrate_lock:
+        if db_path in _migrated_paths:
+            return
+        with get_connection() as conn:
+            migrate(conn)
+        _migrated_paths.add(db_path)
@@ -0,0 +1,435 @@
+"""
+Migracoes versionadas do schema SQLite.
+
+A versao aplicada fica em PRAGMA user_version. Cada migracao roda uma unica vez,
+em ordem, dentro de uma transacao que tambem grava a nova versao. Os passos sao
+idempotentes para aceitar bancos antigos (user_version = 0) que ja tinham parte
+do schema criado pelo init_db anterior.
+"""
+import sqlite3
+
+
+def _column_names(cur, table: str) -> list[str]:
+    cur.execute(f"PRAGMA table_info({table})")
+    return [row["name"] if isinstance(row, sqlite3.Row) else row[1] for row in cur.fetchall()]
+
+
+def _m001_base_schema(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT NOT NULL UNIQUE,
+        password_hash TEXT NOT NULL,
+        role TEXT NOT NULL,
+        active INTEGER NOT NULL DEFAULT 1,
+        created_at TEXT NOT NULL DEFAULT (datetime('now')),
+        updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+    );
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS agents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        name TEXT NOT NULL,
+        description TEXT,
+        model TEXT NOT NULL,
+        max_tokens INTEGER NOT NULL,
+        temperature REAL NOT NULL,
+        system_prompt TEXT,
+        created_at TEXT NOT NULL DEFAULT (datetime('now'))
+    );
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS chats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        agent_id INTEGER NOT NULL REFERENCES agents(id),
+        title TEXT NOT NULL,
+        conversation_topic_summary TEXT,
+        previous_response_id TEXT NULL,
+        created_at TEXT NOT NULL DEFAULT (datetime('now')),
+        updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+    );
+    """)
+
+    # Migracao: se chat_messages antiga (user_id, agent_id) existir, substituir pela nova (chat_id)
+    cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='chat_messages'"
+    )
+    if cur.fetchone():
+        cur.execute("PRAGMA table_info(chat_messages)")
+        cols = [row[1] for row in cur.fetchall()]
+        if "agent_id" in cols or "user_id" in cols:
+            cur.execute("DROP TABLE chat_messages")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS chat_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        tokens INTEGER NOT NULL DEFAULT 0,
+        has_attachment INTEGER NOT NULL DEFAULT 0,
+        attachment_filename TEXT,
+        created_at TEXT NOT NULL DEFAULT (datetime('now'))
+    );
+    """)
+
+    # Migracao em chat_messages (tokens)
+    msg_cols = _column_names(cur, 'chat_messages')
+    if 'tokens' not in msg_cols:
+        cur.execute('ALTER TABLE chat_messages ADD COLUMN tokens INTEGER NOT NULL DEFAULT 0')
+    if 'has_attachment' not in msg_cols:
+        cur.execute('ALTER TABLE chat_messages ADD COLUMN has_attachment INTEGER NOT NULL DEFAULT 0')
+    if 'attachment_filename' not in msg_cols:
+        cur.execute('ALTER TABLE chat_messages ADD COLUMN attachment_filename TEXT')
+
+    # Migracoes em agents
+    agent_cols = _column_names(cur, "agents")
+    if "description" not in agent_cols:
+        cur.execute("ALTER TABLE agents ADD COLUMN description TEXT")
+    if "max_tokens" not in agent_cols:
+        cur.execute(
+            "ALTER TABLE agents ADD COLUMN max_tokens INTEGER NOT NULL DEFAULT 1024"
+        )
+    if "temperature" not in agent_cols:
+        cur.execute(
+            "ALTER TABLE agents ADD COLUMN temperature REAL NOT NULL DEFAULT 0.7"
+        )
+    if "system_prompt" not in agent_cols:
+        cur.execute("ALTER TABLE agents ADD COLUMN system_prompt TEXT")
+        if "instructions" in agent_cols:
+            cur.execute(
+                'UPDATE agents SET system_prompt = instructions WHERE system_prompt IS NULL OR system_prompt = ""'
+            )
+    if "created_at" not in agent_cols:
+        cur.execute("ALTER TABLE agents ADD COLUMN created_at TEXT DEFAULT ''")
+        cur.execute("UPDATE agents SET created_at = datetime('now') WHERE created_at = '' OR created_at IS NULL")
+
+    # Migracao em chats
+    chat_cols = _column_names(cur, 'chats')
+    if 'conversation_topic_summary' not in chat_cols:
+        cur.execute('ALTER TABLE chats ADD COLUMN conversation_topic_summary TEXT')
+    if 'previous_response_id' not in chat_cols:
+        cur.execute('ALTER TABLE chats ADD COLUMN previous_response_id TEXT')
+    if 'updated_at' not in chat_cols:
+        cur.execute("ALTER TABLE chats ADD COLUMN updated_at TEXT DEFAULT ''")
+        cur.execute("UPDATE chats SET updated_at = datetime('now') WHERE updated_at = '' OR updated_at IS NULL")
+
+    # Tabela de mensagens do Chat Testes (Configurar Agente / Editar agente) para auditoria
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS chat_test_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        agent_id INTEGER REFERENCES agents(id),
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        tokens INTEGER NOT NULL DEFAULT 0,
+        has_attachment INTEGER NOT NULL DEFAULT 0,
+        attachment_filename TEXT,
+        created_at TEXT NOT NULL DEFAULT (datetime('now'))
+    );
+    """)
+    test_cols = _column_names(cur, "chat_test_messages")
+    if "model" not in test_cols:
+        cur.execute("ALTER TABLE chat_test_messages ADD COLUMN model TEXT")
+    if "agent_name" not in test_cols:
+        cur.execute("ALTER TABLE chat_test_messages ADD COLUMN agent_name TEXT")
+
+
+# Indices das consultas quentes dos repositorios. Mantenha esta lista junto com as
+# queries: tests/test_query_plans.py falha se alguma delas voltar a fazer SCAN.
+INDEXES = {
+    # chat_repo.get_messages / delete_chat e o JOIN do Compliance (WHERE chat_id ORDER BY id)
+    "idx_chat_messages_chat_id": "chat_messages(chat_id, id)",
+    # chat_repo.list_chats (WHERE user_id AND agent_id ORDER BY updated_at, created_at)
+    "idx_chats_user_agent_updated": "chats(user_id, agent_id, updated_at, created_at)",
+    # agents_repo.list_agents_by_user (WHERE user_id ORDER BY id)
+    "idx_agents_user_id": "agents(user_id)",
+    # compliance_repo: mensagens de teste do usuario (WHERE role ORDER BY created_at)
+    "idx_chat_test_messages_role_created": "chat_test_messages(role, created_at)",
+}
+
+
+def _m002_hot_query_indexes(cur):
+    for name, target in INDEXES.items():
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+
+
+def _m003_summary_jobs(cur):
+    # Fila persistente do resumo de Compliance: uma linha por chat. Cada novo pedido
+    # incrementa `version`, entao so o pedido mais recente de cada chat e calculado.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS summary_jobs (
+        chat_id INTEGER PRIMARY KEY REFERENCES chats(id) ON DELETE CASCADE,
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        status TEXT NOT NULL DEFAULT 'pending',
+        version INTEGER NOT NULL DEFAULT 1,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        requested_at TEXT NOT NULL DEFAULT (datetime('now')),
+        updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+    );
+    """)
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_summary_jobs_status ON summary_jobs(status, requested_at)"
+    )
+
+
+def _m004_chat_summary_state(cur):
+    # Ate qual mensagem o resumo do chat ja cobre (modo incremental) e metricas
+    # de tokens enviados/economizados nos resumos.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS chat_summary_state (
+        chat_id INTEGER PRIMARY KEY REFERENCES chats(id) ON DELETE CASCADE,
+        summarized_message_id INTEGER,
+        summaries INTEGER NOT NULL DEFAULT 0,
+        skipped INTEGER NOT NULL DEFAULT 0,
+        tokens_sent INTEGER NOT NULL DEFAULT 0,
+        tokens_saved INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+    );
+    """)
+
+
+def _m005_usage_daily(cur):
+    # Rollup diario de uso (dia x usuario x agente x modelo x origem) mantido pelo
+    # chat_repo a cada mensagem; o painel de Compliance le KPIs e grafico daqui.
+    # agent_id 0 = sem agente; agent_name so e preenchido nesse caso (Chat Testes).
+    # Sem coluna de custo: o preco e aplicado na leitura (usage_repo), com a tabela vigente.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS usage_daily (
+        day TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        agent_id INTEGER NOT NULL DEFAULT 0,
+        agent_name TEXT NOT NULL DEFAULT '',
+        model TEXT NOT NULL DEFAULT '',
+        origin TEXT NOT NULL,
+        tokens INTEGER NOT NULL DEFAULT 0,
+        messages INTEGER NOT NULL DEFAULT 0,
+        attachments INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, user_id, agent_id, agent_name, model, origin)
+    ) WITHOUT ROWID;
+    """)
+    # Backfill do historico existente (mesmas regras da auditoria).
+    cur.execute("""
+    INSERT OR IGNORE INTO usage_daily (day, user_id, agent_id, agent_name, model, origin, tokens, messages, attachments)
+    SELECT date(m.created_at), c.user_id, c.agent_id, '', COALESCE(a.model, '—'), 'Conversa',
+           SUM(m.tokens), COUNT(*), SUM(m.has_attachment > 0)
+    FROM chat_messages m
+    JOIN chats c ON c.id = m.chat_id
+    LEFT JOIN agents a ON a.id = c.agent_id
+    GROUP BY 1, 2, 3, 5
+    """)
+    cur.execute("""
+    INSERT OR IGNORE INTO usage_daily (day, user_id, agent_id, agent_name, model, origin, tokens, messages, attachments)
+    SELECT date(t.created_at), t.user_id, COALESCE(t.agent_id, 0),
+           CASE WHEN t.agent_id IS NULL THEN COALESCE(t.agent_name, '') ELSE '' END,
+           COALESCE(t.model, a.model, '—'), 'Teste',
+           SUM(t.tokens), COUNT(*), SUM(t.has_attachment > 0)
+    FROM chat_test_messages t
+    LEFT JOIN agents a ON a.id = t.agent_id
+    WHERE t.role = 'user'
+    GROUP BY 1, 2, 3, 4, 5
+    """)
+
+
+def _m006_full_text_search(cur):
+    # Indices FTS5 de conteudo externo (nao duplicam o texto), mantidos por triggers.
+    # remove_diacritics: "funcao" encontra "função".
+    tokenize = "unicode61 remove_diacritics 2"
+    cur.execute(f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5(
+        content, content='chat_messages', content_rowid='id', tokenize='{tokenize}'
+    )
+    """)
+    cur.execute(f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS chats_fts USING fts5(
+        title, conversation_topic_summary, content='chats', content_rowid='id', tokenize='{tokenize}'
+    )
+    """)
+    # Um execute por trigger: executescript faria COMMIT no meio da transacao do migrate().
+    triggers = [
+        """
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ai AFTER INSERT ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts(rowid, content) VALUES (new.id, new.content);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ad AFTER DELETE ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts(chat_messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS chat_messages_fts_au AFTER UPDATE OF content ON chat_messages BEGIN
+            INSERT INTO chat_messages_fts(chat_messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO chat_messages_fts(rowid, content) VALUES (new.id, new.content);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS chats_fts_ai AFTER INSERT ON chats BEGIN
+            INSERT INTO chats_fts(rowid, title, conversation_topic_summary)
+            VALUES (new.id, new.title, new.conversation_topic_summary);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS chats_fts_ad AFTER DELETE ON chats BEGIN
+            INSERT INTO chats_fts(chats_fts, rowid, title, conversation_topic_summary)
+            VALUES ('delete', old.id, old.title, old.conversation_topic_summary);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS chats_fts_au AFTER UPDATE OF title, conversation_topic_summary ON chats BEGIN
+            INSERT INTO chats_fts(chats_fts, rowid, title, conversation_topic_summary)
+            VALUES ('delete', old.id, old.title, old.conversation_topic_summary);
+            INSERT INTO chats_fts(rowid, title, conversation_topic_summary)
+            VALUES (new.id, new.title, new.conversation_topic_summary);
+        END
+        """,
+    ]
+    for sql in triggers:
+        cur.execute(sql)
+    # Indexa o historico existente.
+    cur.execute("INSERT INTO chat_messages_fts(chat_messages_fts) VALUES ('rebuild')")
+    cur.execute("INSERT INTO chats_fts(chats_fts) VALUES ('rebuild')")
+
+
+def _m007_documents(cur):
+    # PDFs extraidos localmente, chaveados pelo SHA-256 dos bytes: o mesmo arquivo
+    # anexado em varios turnos/chats e extraido uma vez so.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS documents (
+        hash TEXT PRIMARY KEY,
+        filename TEXT,
+        size_bytes INTEGER NOT NULL DEFAULT 0,
+        pages INTEGER NOT NULL DEFAULT 0,
+        chunks INTEGER NOT NULL DEFAULT 0,
+        created_at TEXT DEFAULT (datetime('now'))
+    );
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS document_chunks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        doc_hash TEXT NOT NULL,
+        idx INTEGER NOT NULL,
+        page INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        UNIQUE (doc_hash, idx),
+        FOREIGN KEY(doc_hash) REFERENCES documents(hash) ON DELETE CASCADE
+    );
+    """)
+    # Selecao dos trechos relevantes para a pergunta (bm25); chunks nao mudam depois de gravados.
+    cur.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS document_chunks_fts USING fts5(
+        content, content='document_chunks', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS document_chunks_fts_ai AFTER INSERT ON document_chunks BEGIN
+        INSERT INTO document_chunks_fts(rowid, content) VALUES (new.id, new.content);
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS document_chunks_fts_ad AFTER DELETE ON document_chunks BEGIN
+        INSERT INTO document_chunks_fts(document_chunks_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    """)
+
+
+def _m008_attachment_cache(cur):
+    # PDFs ja enviados a Files API: SHA-256 dos bytes -> file_id remoto. Evita
+    # reenviar o mesmo arquivo; a limpeza apaga o arquivo remoto apos expires_at.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS attachment_cache (
+        hash TEXT PRIMARY KEY,
+        file_id TEXT NOT NULL,
+        size_bytes INTEGER NOT NULL DEFAULT 0,
+        pages INTEGER,
+        first_seen TEXT DEFAULT (datetime('now')),
+        last_used TEXT DEFAULT (datetime('now')),
+        expires_at TEXT NOT NULL
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_attachment_cache_expires ON attachment_cache(expires_at)")
+
+
+def _m009_document_vectors(cur):
+    # Indice vetorial por documento e embedder: a matriz float32 (rows x dim)
+    # fica num arquivo lido por memmap; aqui so os metadados.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS document_vectors (
+        doc_hash TEXT NOT NULL,
+        embedder TEXT NOT NULL,
+        dim INTEGER NOT NULL,
+        rows INTEGER NOT NULL,
+        path TEXT NOT NULL,
+        created_at TEXT DEFAULT (datetime('now')),
+        PRIMARY KEY (doc_hash, embedder)
+    );
+    """)
+
+
+def _m010_response_cache(cur):
+    # Respostas reaproveitaveis do Chat Testes, pela chave deterministica da chamada
+    # (usuario + agente + config + input + anexo). agent_id permite invalidar ao editar o agente.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS response_cache (
+        key TEXT PRIMARY KEY,
+        user_id INTEGER,
+        agent_id INTEGER,
+        model TEXT,
+        response_id TEXT,
+        output_text TEXT NOT NULL,
+        created_at TEXT NOT NULL DEFAULT (datetime('now')),
+        expires_at TEXT NOT NULL
+    );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_agent ON response_cache(agent_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache(expires_at)")
+
+
+# (versao, descricao, funcao). Sempre acrescente no final com versao maior.
+MIGRATIONS = [
+    (1, "schema base: users, agents, chats, chat_messages, chat_test_messages", _m001_base_schema),
+    (2, "indices das consultas quentes dos repositorios", _m002_hot_query_indexes),
+    (3, "fila persistente de resumos de Compliance", _m003_summary_jobs),
+    (4, "estado incremental e metricas dos resumos de Compliance", _m004_chat_summary_state),
+    (5, "rollup diario de uso para KPIs e grafico do Compliance", _m005_usage_daily),
+    (6, "busca full-text (FTS5) em mensagens, titulos e resumos", _m006_full_text_search),
+    (7, "documentos PDF extraidos localmente e seus trechos", _m007_documents),
+    (8, "cache de anexos enviados a Files API por hash do conteudo", _m008_attachment_cache),
+    (9, "metadados dos indices vetoriais (embeddings) dos documentos", _m009_document_vectors),
+    (10, "cache de respostas do Chat Testes por configuracao e input", _m010_response_cache),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Aplica as migracoes pendentes e retorna a versao final do schema."""
+    current = get_schema_version(conn)
+    if current >= LATEST_VERSION:
+        return current
+
+    for version, _description, step in MIGRATIONS:
+        if version <= current:
+            continue
+        # BEGIN IMMEDIATE serializa processos migrando o mesmo arquivo; relemos a
+        # versao ja com o lock para nao reaplicar o que outro processo fez.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            step(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return get_schema_version(conn)
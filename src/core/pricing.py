@@ -0,0 +1,82 @@
+from typing import Optional
+
+from .config import get_settings
+
+
+# Tabelas de preco versionadas: (trecho do nome do modelo, USD/1k input, USD/1k output).
+# A primeira regra cujo trecho aparece no nome (minusculo) vence; "*" e o fallback.
+# "v1" reproduz a estimativa original do painel (preco medio igual para input/output).
+PRICING_TABLES = {
+    "v1": [
+        ("gpt-4", 0.03, 0.03),
+        ("gpt-3.5", 0.0015, 0.0015),
+        ("claude-3", 0.015, 0.015),
+        ("*", 0.001, 0.001),
+    ],
+    # Precos publicos de 2025 (por 1M tokens / 1000).
+    "v2": [
+        ("gpt-4o-mini", 0.00015, 0.0006),
+        ("gpt-4o", 0.0025, 0.01),
+        ("gpt-4.1-nano", 0.0001, 0.0004),
+        ("gpt-4.1-mini", 0.0004, 0.0016),
+        ("gpt-4.1", 0.002, 0.008),
+        ("gpt-4-turbo", 0.01, 0.03),
+        ("gpt-4", 0.03, 0.06),
+        ("gpt-3.5", 0.0005, 0.0015),
+        ("claude-3", 0.003, 0.015),
+        ("*", 0.001, 0.001),
+    ],
+}
+DEFAULT_PRICING_VERSION = "v1"
+
+# Os logs guardam so o total de tokens; fracao assumida como output no custo.
+OUTPUT_TOKEN_SHARE = 0.5
+
+
+def get_pricing_table(version: Optional[str] = None) -> list:
+    version = version or get_settings().get("COMPLIANCE_PRICING_VERSION") or DEFAULT_PRICING_VERSION
+    if version not in PRICING_TABLES:
+        raise ValueError(f"Tabela de precos desconhecida: {version!r}. Opcoes: {', '.join(PRICING_TABLES)}.")
+    return PRICING_TABLES[version]
+
+
+def price_per_1k(model: str, table: list) -> tuple:
+    """(input, output) em USD por 1k tokens para o modelo, segundo a tabela."""
+    name = str(model or "").lower()
+    fallback = (0.0, 0.0)
+    for pattern, input_price, output_price in table:
+        if pattern == "*":
+            fallback = (input_price, output_price)
+        elif pattern in name:
+            return input_price, output_price
+    return fallback
+
+
+def cost_sql(tokens_expr: str, model_expr: str, table: list, output_share: float = OUTPUT_TOKEN_SHARE) -> tuple:
+    """
+    Expressao SQL (+ parametros) equivalente a price_per_1k: custo em USD a partir
+    das colunas de tokens e modelo. Os nomes das colunas sao do chamador, nunca do usuario.
+    """
+    fallback = 0.0
+    whens, params = [], []
+    for pattern, input_price, output_price in table:
+        blended = input_price * (1 - output_share) + output_price * output_share
+        if pattern == "*":
+            fallback = blended
+            continue
+        whens.append(f"WHEN instr(lower(COALESCE({model_expr}, '')), ?) > 0 THEN ?")
+        params.extend([pattern, blended])
+    params.append(fallback)
+    return f"({tokens_expr} / 1000.0) * (CASE {' '.join(whens)} ELSE ? END)", params
+
+
+def estimate_cost(model: str, tokens: int, table: Optional[list] = None, output_share: float = OUTPUT_TOKEN_SHARE) -> float:
+    """Custo (USD) de `tokens` no modelo, com o mesmo preco medio usado no painel."""
+    input_price, output_price = price_per_1k(model, table if table is not None else get_pricing_table())
+    return (tokens or 0) / 1000 * (input_price * (1 - output_share) + output_price * output_share)
+
+
+def usage_cost(model: str, input_tokens: Optional[int], output_tokens: Optional[int], table: Optional[list] = None) -> float:
+    """Custo (USD) de uma chamada com input e output separados (ex.: response.usage)."""
+    input_price, output_price = price_per_1k(model, table if table is not None else get_pricing_table())
+    return (input_tokens or 0) / 1000 * input_price + (output_tokens or 0) / 1000 * output_price
@@ -0,0 +1,30 @@
+import re
+from typing import Optional
+
+
+# Marcadores do trecho destacado (markdown: negrito no st.markdown).
+HIGHLIGHT = ("**", "**")
+SNIPPET_TOKENS = 12
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fts_query(text: Optional[str], any_term: bool = False) -> Optional[str]:
+    """
+    Converte o texto digitado numa expressao FTS5 segura: cada palavra vira um
+    prefixo entre aspas ("abc"*), todas obrigatorias (ou qualquer uma, com
+    any_term). Operadores e aspas do usuario sao ignorados, entao nenhuma
+    entrada gera erro de sintaxe. Retorna None quando nao sobra palavra para buscar.
+    """
+    tokens = _TOKEN_RE.findall(text or "")
+    if not tokens:
+        return None
+    return (" OR " if any_term else " ").join(f'"{tok}"*' for tok in tokens)
+
+
+def page_bounds(total: int, page: int, page_size: int) -> tuple:
+    """(page, pages, offset) com a pagina limitada ao intervalo valido."""
+    page_size = max(1, int(page_size))
+    pages = max(1, -(-int(total) // page_size))
+    page = min(max(1, int(page)), pages)
+    return page, pages, (page - 1) * page_size
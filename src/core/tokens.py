@@ -0,0 +1,189 @@
+"""
+Contagem local de tokens e estimativa antes da chamada (sem ida a rede).
+
+Usa o tokenizer do tiktoken (em requirements.txt) com o encoding da familia do
+modelo, lido do cache local em TIKTOKEN_CACHE_DIR. Os encoders sao carregados
+em uma thread de fundo (warm_encoders, no boot); ate la, ou sem cache
+configurado, vale a aproximacao de ~4 caracteres por token. Uma carga que
+falha e tentada de novo depois, nunca fica memorizada.
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from .config import get_settings
+from .pricing import usage_cost
+
+
+# Familias de modelo: (trecho do nome, encoding do tiktoken, janela de contexto em tokens).
+# Mesma regra da tabela de precos: o primeiro trecho contido no nome vence; "*" e o fallback.
+MODEL_FAMILIES = [
+    ("gpt-4o", "o200k_base", 128000),
+    ("gpt-4.1", "o200k_base", 1047576),
+    ("gpt-4-turbo", "cl100k_base", 128000),
+    ("gpt-4", "cl100k_base", 8192),
+    ("gpt-3.5", "cl100k_base", 16385),
+    ("*", "o200k_base", 128000),
+]
+
+# Tokens extras por mensagem do input (papel e delimitadores).
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_CHARS_PER_TOKEN = 4
+
+
+class TokenLimitError(ValueError):
+    """O input estimado passa do teto configurado (ou da janela do modelo)."""
+
+    def __init__(self, tokens: int, limit: int):
+        super().__init__(f"Mensagem muito longa: ~{tokens} tokens de entrada (limite {limit}).")
+        self.tokens = tokens
+        self.limit = limit
+
+
+def model_family(model: Optional[str]) -> Tuple[str, int]:
+    """(encoding, janela de contexto) da familia do modelo."""
+    name = str(model or "").lower()
+    fallback = ("o200k_base", 128000)
+    for pattern, encoding, context in MODEL_FAMILIES:
+        if pattern == "*":
+            fallback = (encoding, context)
+        elif pattern in name:
+            return encoding, context
+    return fallback
+
+
+# Intervalo minimo (s) entre tentativas de carregar encoders que falharam.
+_WARM_RETRY_SECONDS = 300.0
+
+_encoders: Dict[str, Any] = {}
+_warm_lock = threading.Lock()
+_warm_thread: Optional[threading.Thread] = None
+_next_warm = 0.0
+
+
+def load_encoder(encoding: str) -> bool:
+    """
+    Carrega o encoding do tiktoken a partir de TIKTOKEN_CACHE_DIR (sem cache
+    configurado nada e carregado). Pode ler/baixar o arquivo BPE: nunca chamar no
+    caminho de uma requisicao. Sucesso fica em memoria; falha nao.
+    """
+    if encoding in _encoders:
+        return True
+    cache_dir = (get_settings().get("TIKTOKEN_CACHE_DIR") or "").strip()
+    if not cache_dir:
+        return False
+    os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir  # o tiktoken le o cache pelo ambiente
+    try:
+        import tiktoken
+
+        _encoders[encoding] = tiktoken.get_encoding(encoding)
+    except Exception:
+        return False
+    return True
+
+
+def _warm() -> None:
+    global _next_warm
+    loaded = [load_encoder(encoding) for encoding in {encoding for _p, encoding, _c in MODEL_FAMILIES}]
+    if not all(loaded):
+        with _warm_lock:
+            _next_warm = time.monotonic() + _WARM_RETRY_SECONDS
+
+
+def warm_encoders() -> bool:
+    """
+    Dispara a carga dos encoders numa thread de fundo (no boot e, se falhou,
+    de novo apos _WARM_RETRY_SECONDS). Retorna True se uma carga foi iniciada.
+    """
+    global _warm_thread
+    with _warm_lock:
+        if _warm_thread is not None and _warm_thread.is_alive():
+            return False
+        if len(_encoders) == len({encoding for _p, encoding, _c in MODEL_FAMILIES}) or time.monotonic() < _next_warm:
+            return False
+        _warm_thread = threading.Thread(target=_warm, name="tiktoken-warmup", daemon=True)
+        _warm_thread.start()
+    return True
+
+
+def get_encoder(encoding: str):
+    """Encoder ja carregado para o encoding, ou None (nunca carrega na hora; ver warm_encoders)."""
+    encoder = _encoders.get(encoding)
+    if encoder is None:
+        warm_encoders()
+    return encoder
+
+
+def count_tokens(text: Optional[str], model: Optional[str] = None) -> int:
+    if not text:
+        return 0
+    encoder = get_encoder(model_family(model)[0])
+    if encoder is None:
+        return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: Optional[str], max_tokens: int, model: Optional[str] = None) -> str:
+    """Os primeiros max_tokens tokens do texto."""
+    if not text or max_tokens <= 0:
+        return ""
+    encoder = get_encoder(model_family(model)[0])
+    if encoder is None:
+        return text[: max_tokens * _CHARS_PER_TOKEN]
+    tokens = encoder.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoder.decode(tokens[:max_tokens])
+
+
+def payload_input_tokens(payload: Dict[str, Any]) -> int:
+    """
+    Tokens de entrada de um payload da Responses API: instructions + textos do input.
+    Arquivos (input_file) e o historico de previous_response_id nao sao conhecidos localmente.
+    """
+    model = payload.get("model")
+    total = count_tokens(payload.get("instructions"), model)
+    items = payload.get("input")
+    if isinstance(items, str):
+        return total + count_tokens(items, model) + MESSAGE_OVERHEAD_TOKENS
+    for item in items or []:
+        total += MESSAGE_OVERHEAD_TOKENS
+        content = item.get("content")
+        if isinstance(content, str):
+            total += count_tokens(content, model)
+            continue
+        for part in content or []:
+            total += count_tokens(part.get("text"), model)
+    return total
+
+
+def input_token_cap(model: Optional[str], max_output_tokens: Optional[int] = None) -> int:
+    """Teto de entrada: MAX_INPUT_TOKENS (se > 0), nunca acima da janela do modelo menos a saida."""
+    window = model_family(model)[1] - max(int(max_output_tokens or 0), 0)
+    configured = get_settings().get_int("MAX_INPUT_TOKENS", 0) or 0
+    return min(configured, window) if configured > 0 else window
+
+
+def estimate_request(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Estimativa antes de enviar: tokens de entrada, teto e custo maximo (USD) se a
+    resposta usar todo o max_output_tokens, pela tabela de precos vigente.
+    """
+    model = payload.get("model")
+    input_tokens = payload_input_tokens(payload)
+    max_output = int(payload.get("max_output_tokens") or 0)
+    return {
+        "model": model,
+        "input_tokens": input_tokens,
+        "max_output_tokens": max_output,
+        "limit": input_token_cap(model, max_output),
+        "cost": usage_cost(model, input_tokens, max_output),
+    }
+
+
+def check_request(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """estimate_request, levantando TokenLimitError se o input passa do teto."""
+    estimate = estimate_request(payload)
+    if estimate["input_tokens"] > estimate["limit"]:
+        raise TokenLimitError(estimate["input_tokens"], estimate["limit"])
+    return estimate
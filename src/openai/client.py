@@ -1,19 +1,95 @@
-﻿from typing import Optional
+﻿import asyncio
+import weakref
+from typing import Optional
 
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
 
 from src.core.config import get_settings
+from src.openai.rate_limit import install_rate_limits
 
 
 _client: Optional[OpenAI] = None
+# httpx.AsyncClient fica preso ao event loop em que foi usado: um cliente por loop.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+
+
+def _to_float(value, default: float) -> float:
+    try:
+        if value is None or value == '':
+            return default
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _to_int(value, default: int) -> int:
+    try:
+        if value is None or value == '':
+            return default
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _api_key(settings: dict) -> str:
+    api_key = (settings.get('OPENAI_API_KEY') or '').strip()
+    if not api_key:
+        raise RuntimeError('OPENAI_API_KEY nao configurada.')
+    return api_key
+
+
+def get_http_options(settings: Optional[dict] = None) -> dict:
+    """Limites do pool HTTP, keep-alive e timeouts compartilhados pelos clientes sync e async."""
+    settings = settings if settings is not None else get_settings()
+    timeout = _to_float(settings.get('OPENAI_TIMEOUT'), 60.0)
+    return {
+        'limits': httpx.Limits(
+            max_connections=_to_int(settings.get('OPENAI_MAX_CONNECTIONS'), 20),
+            max_keepalive_connections=_to_int(settings.get('OPENAI_MAX_KEEPALIVE'), 10),
+            keepalive_expiry=_to_float(settings.get('OPENAI_KEEPALIVE_EXPIRY'), 30.0),
+        ),
+        'timeout': httpx.Timeout(
+            timeout,
+            connect=_to_float(settings.get('OPENAI_CONNECT_TIMEOUT'), 10.0),
+        ),
+    }
+
+
+def _base_url(settings: dict) -> Optional[str]:
+    # Permite apontar para um servidor compativel (ex.: scripts/fake_openai_server.py).
+    return (settings.get('OPENAI_BASE_URL') or '').strip() or None
 
 
 def get_openai_client() -> OpenAI:
     global _client
     if _client is None:
         settings = get_settings()
-        api_key = (settings.get('OPENAI_API_KEY') or '').strip()
-        if not api_key:
-            raise RuntimeError('OPENAI_API_KEY nao configurada.')
-        _client = OpenAI(api_key=api_key)
+        api_key = _api_key(settings)
+        # Retry fica a cargo do rate_limit (compartilhado pelo processo), nao do SDK.
+        _client = install_rate_limits(OpenAI(
+            api_key=api_key,
+            base_url=_base_url(settings),
+            max_retries=0,
+            http_client=DefaultHttpxClient(**get_http_options(settings)),
+        ))
     return _client
+
+
+def get_async_openai_client() -> AsyncOpenAI:
+    """
+    AsyncOpenAI do event loop atual, com pool de conexoes compartilhado por todas as
+    chamadas feitas nele (fan-out de resumos, uploads, varios modelos).
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        settings = get_settings()
+        client = install_rate_limits(AsyncOpenAI(
+            api_key=_api_key(settings),
+            base_url=_base_url(settings),
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(**get_http_options(settings)),
+        ), is_async=True)
+        _async_clients[loop] = client
+    return client
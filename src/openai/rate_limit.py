@@ -0,0 +1,342 @@
+import asyncio
+import functools
+import random
+import threading
+import time
+from typing import Optional
+
+import openai
+
+from src.core.config import get_settings
+
+
+# 429 (rate limit), timeouts/conflitos transitorios e erros 5xx do servidor.
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# Chave de limite usada para uploads (files.create nao tem modelo).
+FILES_KEY = '_files'
+
+
+def _to_float(value, default: float) -> float:
+    try:
+        if value is None or value == '':
+            return default
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _to_int(value, default: int) -> int:
+    try:
+        if value is None or value == '':
+            return default
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _sleep(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+async def _asleep(seconds: float) -> None:
+    await asyncio.sleep(seconds)
+
+
+class TokenBucket:
+    """
+    Balde de tokens com reabastecimento continuo (`per_minute` por minuto).
+
+    reserve() debita na hora e devolve quanto o chamador deve esperar: o saldo
+    pode ficar negativo, entao pedidos concorrentes entram numa fila implicita
+    em vez de disputarem o mesmo instante.
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.fill_rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            self._refill()
+            # Pedido maior que o balde inteiro: espera no maximo um balde cheio.
+            self.tokens -= min(float(amount), self.capacity)
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.fill_rate
+
+    def adjust(self, amount: float) -> None:
+        """Corrige uma reserva estimada (positivo devolve tokens, negativo debita)."""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + float(amount))
+
+
+def parse_model_limits(raw: str) -> dict:
+    """'gpt-4o=500/30000;gpt-4o-mini=500/200000' -> {'gpt-4o': (500, 30000), ...}."""
+    limits = {}
+    for item in (raw or '').replace(',', ';').split(';'):
+        if '=' not in item:
+            continue
+        model, _, values = item.partition('=')
+        rpm, _, tpm = values.partition('/')
+        limits[model.strip()] = (_to_int(rpm.strip(), 0), _to_int(tpm.strip(), 0))
+    return limits
+
+
+def estimate_request_tokens(kwargs: dict) -> int:
+    """Estimativa barata (~4 caracteres por token) de entrada + teto de saida do pedido."""
+    chars = len(str(kwargs.get('input') or '')) + len(str(kwargs.get('instructions') or ''))
+    return (chars + 3) // 4 + _to_int(kwargs.get('max_output_tokens'), 0)
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, openai.APIConnectionError):  # inclui APITimeoutError
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        # Cota esgotada tambem vem como 429, mas esperar nao resolve.
+        if getattr(exc, 'code', None) == 'insufficient_quota':
+            return False
+        return exc.status_code in RETRYABLE_STATUS
+    return False
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    retry_ms = headers.get('retry-after-ms')
+    if retry_ms:
+        value = _to_float(retry_ms, -1.0)
+        if value >= 0:
+            return value / 1000.0
+    value = _to_float(headers.get('retry-after'), -1.0)
+    return value if value >= 0 else None
+
+
+class _SettlingStream:
+    """
+    Repassa os eventos de uma resposta em streaming (sync ou async) e, no
+    response.completed/incomplete, entrega o response final para acertar a reserva.
+    O resto (close, context manager, atributos) e o do stream original.
+    """
+
+    _FINAL_EVENTS = ('response.completed', 'response.incomplete')
+
+    def __init__(self, stream, on_final):
+        self._stream = stream
+        self._on_final = on_final
+
+    def _observe(self, event) -> None:
+        if self._on_final is not None and getattr(event, 'type', '') in self._FINAL_EVENTS:
+            on_final, self._on_final = self._on_final, None
+            on_final(getattr(event, 'response', None))
+
+    def __iter__(self):
+        for event in self._stream:
+            self._observe(event)
+            yield event
+
+    async def __aiter__(self):
+        async for event in self._stream:
+            self._observe(event)
+            yield event
+
+    def __enter__(self):
+        self._stream.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._stream.__exit__(*exc)
+
+    async def __aenter__(self):
+        await self._stream.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc):
+        return await self._stream.__aexit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class RateLimiter:
+    """
+    Limite de requisicoes/min e tokens/min por modelo, compartilhado pelo processo
+    inteiro (todas as sessoes do Streamlit), com retry exponencial com jitter.
+    Limite 0 desliga o balde correspondente.
+    """
+
+    def __init__(
+        self,
+        rpm: int = 500,
+        tpm: int = 200000,
+        model_limits: Optional[dict] = None,
+        max_retries: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 20.0,
+    ):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.model_limits = dict(model_limits or {})
+        self.max_retries = max(0, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._buckets: dict = {}
+        self._lock = threading.Lock()
+
+    def _buckets_for(self, key: str):
+        buckets = self._buckets.get(key)
+        if buckets is None:
+            with self._lock:
+                buckets = self._buckets.get(key)
+                if buckets is None:
+                    rpm, tpm = self.model_limits.get(key, (self.rpm, self.tpm))
+                    if key == FILES_KEY:
+                        tpm = 0
+                    buckets = (
+                        TokenBucket(rpm) if rpm > 0 else None,
+                        TokenBucket(tpm) if tpm > 0 else None,
+                    )
+                    self._buckets[key] = buckets
+        return buckets
+
+    def reserve(self, key: str, tokens: int = 0) -> float:
+        """Debita 1 requisicao + `tokens` e devolve a espera necessaria em segundos."""
+        req_bucket, tok_bucket = self._buckets_for(key)
+        wait = req_bucket.reserve(1) if req_bucket else 0.0
+        if tok_bucket and tokens > 0:
+            wait = max(wait, tok_bucket.reserve(tokens))
+        return wait
+
+    def refund(self, key: str, tokens: int) -> None:
+        """Devolve os tokens de uma tentativa que falhou (a nova tentativa reserva de novo)."""
+        _, tok_bucket = self._buckets_for(key)
+        if tok_bucket and tokens > 0:
+            tok_bucket.adjust(tokens)
+
+    def settle(self, key: str, estimated: int, response) -> None:
+        """Troca a estimativa de tokens pelo uso real devolvido pela API, quando houver."""
+        _, tok_bucket = self._buckets_for(key)
+        usage = getattr(response, 'usage', None)
+        actual = getattr(usage, 'total_tokens', None)
+        if tok_bucket and isinstance(actual, int):
+            tok_bucket.adjust(estimated - actual)
+
+    def _settled(self, key: str, estimated: int, kwargs: dict, response):
+        # Em streaming o usage so chega no evento final: o acerto acontece quando ele passa.
+        if kwargs.get('stream'):
+            return _SettlingStream(response, functools.partial(self.settle, key, estimated))
+        self.settle(key, estimated, response)
+        return response
+
+    def backoff(self, attempt: int, exc: BaseException) -> float:
+        """Espera antes da tentativa `attempt` (1, 2, ...): respeita Retry-After, limitado a max_delay."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        retry_after = retry_after_seconds(exc)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return min(delay, self.max_delay)
+
+    def _request(self, kind: str, kwargs: dict):
+        if kind == 'files':
+            return FILES_KEY, 0
+        return str(kwargs.get('model') or ''), estimate_request_tokens(kwargs)
+
+    def call(self, fn, kind: str, *args, **kwargs):
+        key, tokens = self._request(kind, kwargs)
+        attempt = 0
+        while True:
+            wait = self.reserve(key, tokens)
+            if wait > 0:
+                _sleep(wait)
+            try:
+                response = fn(*args, **kwargs)
+            except Exception as exc:
+                if attempt >= self.max_retries or not is_retryable(exc):
+                    raise
+                self.refund(key, tokens)
+                attempt += 1
+                _sleep(self.backoff(attempt, exc))
+                continue
+            return self._settled(key, tokens, kwargs, response)
+
+    async def acall(self, fn, kind: str, *args, **kwargs):
+        key, tokens = self._request(kind, kwargs)
+        attempt = 0
+        while True:
+            wait = self.reserve(key, tokens)
+            if wait > 0:
+                await _asleep(wait)
+            try:
+                response = await fn(*args, **kwargs)
+            except Exception as exc:
+                if attempt >= self.max_retries or not is_retryable(exc):
+                    raise
+                self.refund(key, tokens)
+                attempt += 1
+                await _asleep(self.backoff(attempt, exc))
+                continue
+            return self._settled(key, tokens, kwargs, response)
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                settings = get_settings()
+                _limiter = RateLimiter(
+                    rpm=_to_int(settings.get('OPENAI_RPM'), 500),
+                    tpm=_to_int(settings.get('OPENAI_TPM'), 200000),
+                    model_limits=parse_model_limits(settings.get('OPENAI_MODEL_LIMITS') or ''),
+                    max_retries=_to_int(settings.get('OPENAI_MAX_RETRIES'), 4),
+                    base_delay=_to_float(settings.get('OPENAI_RETRY_BASE_DELAY'), 0.5),
+                    max_delay=_to_float(settings.get('OPENAI_RETRY_MAX_DELAY'), 20.0),
+                )
+    return _limiter
+
+
+def reset_rate_limiter() -> None:
+    global _limiter
+    with _limiter_lock:
+        _limiter = None
+
+
+def rate_limited(fn, kind: str):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return get_rate_limiter().call(fn, kind, *args, **kwargs)
+
+    return wrapper
+
+
+def arate_limited(fn, kind: str):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await get_rate_limiter().acall(fn, kind, *args, **kwargs)
+
+    return wrapper
+
+
+def install_rate_limits(client, is_async: bool = False):
+    """Envolve client.responses/embeddings.create e client.files.create com o limitador do processo."""
+    wrap = arate_limited if is_async else rate_limited
+    for kind in ('responses', 'embeddings', 'files'):
+        resource = getattr(client, kind, None)
+        if resource is not None:
+            resource.create = wrap(resource.create, kind)
+    return client
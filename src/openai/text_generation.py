@@ -1,7 +1,7 @@
 ﻿from typing import Optional, Tuple
 
 from src.core.config import get_settings
-from src.openai.client import get_openai_client
+from src.openai.client import get_async_openai_client, get_openai_client
 
 
 def _to_float(value, default: float) -> float:
@@ -22,7 +22,7 @@ def _to_int(value, default: Optional[int]) -> Optional[int]:
         return default
 
 
-def generate_text(
+def _build_payload(
     model: str,
     input_text: str,
     instructions: Optional[str] = None,
@@ -30,13 +30,13 @@ def generate_text(
     previous_response_id: Optional[str] = None,
     temperature: Optional[float] = None,
     max_output_tokens: Optional[int] = None,
-) -> Tuple[str, str]:
+) -> dict:
     if not input_text:
         raise ValueError('Mensagem vazia.')
 
     settings = get_settings()
-    default_temperature = _to_float(settings.get('OPENAI_TEMPERATURE'), 1.0)
-    default_max_tokens = _to_int(settings.get('OPENAI_MAX_OUTPUT_TOKENS'), None)
+    default_temperature = settings.openai_temperature
+    default_max_tokens = settings.openai_max_output_tokens
 
     payload = {
         'model': model,
@@ -54,7 +54,43 @@ def generate_text(
     max_tokens = _to_int(max_output_tokens, default_max_tokens)
     if max_tokens is not None and max_tokens > 0:
         payload['max_output_tokens'] = max_tokens
+    return payload
+
+
+def generate_text(
+    model: str,
+    input_text: str,
+    instructions: Optional[str] = None,
+    reasoning_effort: Optional[str] = None,
+    previous_response_id: Optional[str] = None,
+    temperature: Optional[float] = None,
+    max_output_tokens: Optional[int] = None,
+) -> Tuple[str, str]:
+    payload = _build_payload(
+        model, input_text, instructions, reasoning_effort,
+        previous_response_id, temperature, max_output_tokens,
+    )
 
     client = get_openai_client()
     response = client.responses.create(**payload)
     return response.output_text, response.id
+
+
+async def agenerate_text(
+    model: str,
+    input_text: str,
+    instructions: Optional[str] = None,
+    reasoning_effort: Optional[str] = None,
+    previous_response_id: Optional[str] = None,
+    temperature: Optional[float] = None,
+    max_output_tokens: Optional[int] = None,
+) -> Tuple[str, str]:
+    """Versao async de generate_text (AsyncOpenAI com pool HTTP compartilhado)."""
+    payload = _build_payload(
+        model, input_text, instructions, reasoning_effort,
+        previous_response_id, temperature, max_output_tokens,
+    )
+
+    client = get_async_openai_client()
+    response = await client.responses.create(**payload)
+    return response.output_text, response.id
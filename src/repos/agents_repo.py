@@ -1,27 +1,20 @@
 ﻿from typing import Optional, List, Dict, Any
 
 from ..core.config import get_settings
-from ..core.db import connect
+from ..core.db import get_connection, retry_on_busy, transaction
+from .response_cache_repo import invalidate_agent
+from .usage_repo import discard_chat_usage
 
 
 def _default_temperature() -> float:
-    settings = get_settings()
-    try:
-        return float(settings.get('OPENAI_TEMPERATURE') or 0.7)
-    except (TypeError, ValueError):
-        return 0.7
+    return get_settings().openai_temperature
 
 
 def _default_max_tokens() -> int:
-    settings = get_settings()
-    try:
-        value = settings.get('OPENAI_MAX_OUTPUT_TOKENS') or 1024
-        parsed = int(value)
-        return parsed if parsed > 0 else 1024
-    except (TypeError, ValueError):
-        return 1024
+    return get_settings().openai_max_output_tokens or 1024
 
 
+@retry_on_busy
 def create_agent(
     user_id: int,
     name: str,
@@ -36,42 +29,32 @@ def create_agent(
     if temperature is None:
         temperature = _default_temperature()
 
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        """INSERT INTO agents (user_id, name, description, model, max_tokens, temperature, system_prompt)
-           VALUES (?, ?, ?, ?, ?, ?, ?)""",
-        (user_id, name, description, model, max_tokens, temperature, system_prompt),
-    )
-    conn.commit()
-    agent_id = cur.lastrowid
-    conn.close()
-    return agent_id
+    with transaction() as conn:
+        cur = conn.execute(
+            """INSERT INTO agents (user_id, name, description, model, max_tokens, temperature, system_prompt)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            (user_id, name, description, model, max_tokens, temperature, system_prompt),
+        )
+        return cur.lastrowid
 
 
 def list_agents_by_user(user_id: int) -> List[Dict[str, Any]]:
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        'SELECT id, user_id, name, description, model, max_tokens, temperature, system_prompt, created_at '
-        'FROM agents WHERE user_id = ? ORDER BY id',
-        (user_id,),
-    )
-    rows = cur.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        rows = conn.execute(
+            'SELECT id, user_id, name, description, model, max_tokens, temperature, system_prompt, created_at '
+            'FROM agents WHERE user_id = ? ORDER BY id',
+            (user_id,),
+        ).fetchall()
     return [dict(r) for r in rows]
 
 
 def get_agent(agent_id: int, user_id: int) -> Optional[Dict[str, Any]]:
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        'SELECT id, user_id, name, description, model, max_tokens, temperature, system_prompt, created_at '
-        'FROM agents WHERE id = ? AND user_id = ?',
-        (agent_id, user_id),
-    )
-    row = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        row = conn.execute(
+            'SELECT id, user_id, name, description, model, max_tokens, temperature, system_prompt, created_at '
+            'FROM agents WHERE id = ? AND user_id = ?',
+            (agent_id, user_id),
+        ).fetchone()
     return dict(row) if row else None
 
 
@@ -79,6 +62,7 @@ def get_agent_by_id(user_id: int, agent_id: int) -> Optional[Dict[str, Any]]:
     return get_agent(agent_id, user_id)
 
 
+@retry_on_busy
 def update_agent(
     agent_id: int,
     user_id: int,
@@ -117,21 +101,27 @@ def update_agent(
     sql = 'UPDATE agents SET ' + ', '.join(fields) + ' WHERE id = ? AND user_id = ?'
     values.extend([agent_id, user_id])
 
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(sql, tuple(values))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        cur = conn.execute(sql, tuple(values))
+        if cur.rowcount:
+            # Config nova: respostas cacheadas do agente deixam de valer.
+            invalidate_agent(conn, agent_id)
 
 
+@retry_on_busy
 def delete_agent(agent_id: int, user_id: int) -> None:
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        'DELETE FROM chat_messages WHERE chat_id IN (SELECT id FROM chats WHERE user_id = ? AND agent_id = ?)',
-        (user_id, agent_id),
-    )
-    cur.execute('DELETE FROM chats WHERE user_id = ? AND agent_id = ?', (user_id, agent_id))
-    cur.execute('DELETE FROM agents WHERE id = ? AND user_id = ?', (agent_id, user_id))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        discard_chat_usage(conn, 'SELECT id FROM chats WHERE user_id = ? AND agent_id = ?', [user_id, agent_id])
+        conn.execute(
+            'DELETE FROM chat_messages WHERE chat_id IN (SELECT id FROM chats WHERE user_id = ? AND agent_id = ?)',
+            (user_id, agent_id),
+        )
+        for table in ('summary_jobs', 'chat_summary_state'):
+            conn.execute(
+                f'DELETE FROM {table} WHERE chat_id IN (SELECT id FROM chats WHERE user_id = ? AND agent_id = ?)',
+                (user_id, agent_id),
+            )
+        conn.execute('DELETE FROM chats WHERE user_id = ? AND agent_id = ?', (user_id, agent_id))
+        cur = conn.execute('DELETE FROM agents WHERE id = ? AND user_id = ?', (agent_id, user_id))
+        if cur.rowcount:
+            invalidate_agent(conn, agent_id)
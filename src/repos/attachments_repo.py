@@ -0,0 +1,82 @@
+from typing import Any, Dict, List, Optional
+
+from ..core.db import get_connection, retry_on_busy, transaction
+
+
+_COLUMNS = "hash, file_id, size_bytes, pages, first_seen, last_used, expires_at"
+
+
+def get_cached_file(content_hash: str) -> Optional[Dict[str, Any]]:
+    """Entrada do cache ainda valida (expires_at no futuro) para o hash, ou None."""
+    with get_connection() as conn:
+        row = conn.execute(
+            f"SELECT {_COLUMNS} FROM attachment_cache WHERE hash = ? AND expires_at > datetime('now')",
+            (content_hash,),
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def get_file_hash(file_id: str) -> Optional[str]:
+    """Hash do conteudo enviado com esse file_id (ex.: para chaves de cache), ou None."""
+    with get_connection() as conn:
+        row = conn.execute("SELECT hash FROM attachment_cache WHERE file_id = ?", (file_id,)).fetchone()
+    return row["hash"] if row else None
+
+
+@retry_on_busy
+def save_cached_file(
+    content_hash: str,
+    file_id: str,
+    size_bytes: int,
+    pages: Optional[int],
+    ttl_seconds: float,
+) -> None:
+    """Registra (ou substitui, se expirado) o file_id remoto do conteudo."""
+    with transaction() as conn:
+        conn.execute(
+            """
+            INSERT INTO attachment_cache (hash, file_id, size_bytes, pages, expires_at)
+            VALUES (?, ?, ?, ?, datetime('now', ?))
+            ON CONFLICT (hash) DO UPDATE SET
+                file_id = excluded.file_id,
+                size_bytes = excluded.size_bytes,
+                pages = excluded.pages,
+                last_used = datetime('now'),
+                expires_at = excluded.expires_at
+            """,
+            (content_hash, file_id, int(size_bytes), pages, f"+{int(ttl_seconds)} seconds"),
+        )
+
+
+@retry_on_busy
+def touch_cached_file(content_hash: str, ttl_seconds: float) -> None:
+    """Marca uso e estende a validade (arquivo em uso numa conversa nao expira)."""
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE attachment_cache SET last_used = datetime('now'), expires_at = datetime('now', ?) WHERE hash = ?",
+            (f"+{int(ttl_seconds)} seconds", content_hash),
+        )
+
+
+def list_expired_files(limit: int = 100) -> List[Dict[str, Any]]:
+    with get_connection() as conn:
+        rows = conn.execute(
+            f"""SELECT {_COLUMNS} FROM attachment_cache
+                WHERE expires_at <= datetime('now') ORDER BY expires_at LIMIT ?""",
+            (max(1, int(limit)),),
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+@retry_on_busy
+def delete_cached_file(content_hash: str, file_id: str) -> bool:
+    """
+    Remove a entrada se ela continua expirada e com o mesmo file_id (nao apaga
+    uma entrada reusada ou regravada enquanto a limpeza rodava). True se removeu.
+    """
+    with transaction() as conn:
+        cur = conn.execute(
+            "DELETE FROM attachment_cache WHERE hash = ? AND file_id = ? AND expires_at <= datetime('now')",
+            (content_hash, file_id),
+        )
+        return cur.rowcount > 0
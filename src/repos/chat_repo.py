@@ -1,56 +1,155 @@
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Any, Optional
-from ..core.db import connect
+from typing import List, Dict, Any, Optional, Tuple
+from ..core.db import get_connection, retry_on_busy, transaction
+from ..core.search import HIGHLIGHT, SNIPPET_TOKENS, fts_query, page_bounds
+from .usage_repo import discard_chat_usage, record_usage
 
 
+@retry_on_busy
 def create_chat(user_id: int, agent_id: int, title: Optional[str] = None) -> int:
     """Cria um novo chat para o agente. title opcional (ex.: 'Chat 02/02/2025')."""
     if not title:
         title = f"Chat {datetime.now().strftime('%d/%m/%Y %H:%M')}"
     default_topic_summary = "Novo chat iniciado."
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO chats (user_id, agent_id, title, conversation_topic_summary) VALUES (?, ?, ?, ?)",
-        (user_id, agent_id, title, default_topic_summary),
-    )
-    conn.commit()
-    chat_id = cur.lastrowid
-    conn.close()
-    return chat_id
+    with transaction() as conn:
+        cur = conn.execute(
+            "INSERT INTO chats (user_id, agent_id, title, conversation_topic_summary) VALUES (?, ?, ?, ?)",
+            (user_id, agent_id, title, default_topic_summary),
+        )
+        return cur.lastrowid
 
 
 def list_chats(user_id: int, agent_id: int) -> List[Dict[str, Any]]:
     """Lista chats do usuário para um agente (mais recentes primeiro)."""
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        """SELECT id, title, created_at, updated_at FROM chats
-           WHERE user_id = ? AND agent_id = ? ORDER BY updated_at DESC, created_at DESC""",
-        (user_id, agent_id),
-    )
-    rows = cur.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        rows = conn.execute(
+            """SELECT id, title, created_at, updated_at FROM chats
+               WHERE user_id = ? AND agent_id = ? ORDER BY updated_at DESC, created_at DESC""",
+            (user_id, agent_id),
+        ).fetchall()
     return [
         {"id": r["id"], "title": r["title"], "created_at": r["created_at"], "updated_at": r["updated_at"]}
         for r in rows
     ]
 
 
-def get_messages(chat_id: int) -> List[Dict[str, Any]]:
-    """Mensagens de um chat (ordem cronológica)."""
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT role, content, tokens FROM chat_messages WHERE chat_id = ? ORDER BY id",
-        (chat_id,),
+def search_chats(
+    user_id: int,
+    query: str,
+    agent_id: Optional[int] = None,
+    page: int = 1,
+    page_size: int = 20,
+) -> Dict[str, Any]:
+    """
+    Busca full-text (FTS5) nas mensagens, titulos e resumos dos chats do usuario.
+    Um resultado por chat (o trecho mais relevante), ordenado por bm25.
+
+    Retorna {"rows": [{"id", "title", "agent_id", "updated_at", "snippet", "score"}],
+    "total", "page", "pages"}.
+    """
+    match = fts_query(query)
+    if match is None:
+        return {"rows": [], "total": 0, "page": 1, "pages": 1}
+
+    scope, scope_params = "c.user_id = ?", [user_id]
+    if agent_id is not None:
+        scope += " AND c.agent_id = ?"
+        scope_params.append(agent_id)
+    open_mark, close_mark = HIGHLIGHT
+    # Titulo pesa mais que o resumo; bm25 menor = mais relevante.
+    cte = f"""
+    WITH hits AS (
+        SELECT m.chat_id AS chat_id, bm25(chat_messages_fts) AS score,
+               snippet(chat_messages_fts, 0, ?, ?, '…', {SNIPPET_TOKENS}) AS snippet
+        FROM chat_messages_fts
+        JOIN chat_messages m ON m.id = chat_messages_fts.rowid
+        JOIN chats c ON c.id = m.chat_id
+        WHERE chat_messages_fts MATCH ? AND {scope}
+        UNION ALL
+        SELECT c.id, bm25(chats_fts, 2.0, 1.0),
+               snippet(chats_fts, -1, ?, ?, '…', {SNIPPET_TOKENS})
+        FROM chats_fts
+        JOIN chats c ON c.id = chats_fts.rowid
+        WHERE chats_fts MATCH ? AND {scope}
+    ),
+    best AS (
+        SELECT chat_id, score, snippet,
+               ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY score) AS rn
+        FROM hits
     )
-    rows = cur.fetchall()
-    conn.close()
-    return [{"role": r["role"], "content": r["content"], "tokens": r["tokens"]} for r in rows]
+    """
+    params = [open_mark, close_mark, match, *scope_params, open_mark, close_mark, match, *scope_params]
+    with get_connection() as conn:
+        total = conn.execute(f"{cte} SELECT COUNT(*) FROM best WHERE rn = 1", params).fetchone()[0]
+        page, pages, offset = page_bounds(total, page, page_size)
+        rows = conn.execute(
+            f"""{cte}
+            SELECT c.id, c.title, c.agent_id, c.updated_at, b.snippet, b.score
+            FROM best b JOIN chats c ON c.id = b.chat_id
+            WHERE b.rn = 1
+            ORDER BY b.score, c.updated_at DESC, c.id DESC
+            LIMIT ? OFFSET ?""",
+            params + [max(1, int(page_size)), offset],
+        ).fetchall()
+    return {"rows": [dict(r) for r in rows], "total": int(total), "page": page, "pages": pages}
+
+
+def get_messages(
+    chat_id: int,
+    before_id: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Mensagens de um chat (ordem cronológica). Com limit, traz só as `limit` mais
+    recentes anteriores a before_id (paginação por chave: usa o índice (chat_id, id),
+    custo constante mesmo em chats com milhares de mensagens).
+    """
+    sql = "SELECT id, role, content, tokens FROM chat_messages WHERE chat_id = ?"
+    params: list = [chat_id]
+    if before_id is not None:
+        sql += " AND id < ?"
+        params.append(before_id)
+    if limit is None:
+        sql += " ORDER BY id"
+    else:
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(max(0, int(limit)))
+    with get_connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+    if limit is not None:
+        rows = rows[::-1]
+    return [{"id": r["id"], "role": r["role"], "content": r["content"], "tokens": r["tokens"]} for r in rows]
+
+
+def get_message_page(chat_id: int, before_id: Optional[int] = None, limit: int = 30) -> Dict[str, Any]:
+    """
+    Janela de mensagens para a tela: {"messages": [...] (cronológica), "has_older": bool}.
+    Para continuar, passe before_id = messages[0]["id"].
+    """
+    limit = max(1, int(limit))
+    rows = get_messages(chat_id, before_id=before_id, limit=limit + 1)
+    return {"messages": rows[-limit:], "has_older": len(rows) > limit}
+
+
+def _attachment_name(attachment_filename: Optional[str]) -> Optional[str]:
+    filename = (attachment_filename or "").strip() or None
+    if filename:
+        # `Path(...).name` is OS-specific. On Linux, a Windows path like
+        # "C:\tmp\file.pdf" doesn't get split on "\". Normalize separators so we
+        # persist only the basename across platforms.
+        filename = Path(filename.replace("\\", "/")).name[:200] or None
+    return filename
+
+
+def _tokens(value) -> int:
+    try:
+        return int(value) if value is not None else 0
+    except (TypeError, ValueError):
+        return 0
 
 
+@retry_on_busy
 def add_message(
     chat_id: int,
     role: str,
@@ -58,95 +157,141 @@ def add_message(
     tokens: Optional[int] = None,
     has_attachment: Optional[bool] = None,
     attachment_filename: Optional[str] = None,
-) -> None:
-    conn = connect()
-    cur = conn.cursor()
-    try:
-        tokens_value = int(tokens) if tokens is not None else 0
-    except (TypeError, ValueError):
-        tokens_value = 0
-
-    filename_value = (attachment_filename or "").strip() or None
-    if filename_value:
-        # `Path(...).name` is OS-specific. On Linux, a Windows path like
-        # "C:\tmp\file.pdf" doesn't get split on "\". Normalize separators so we
-        # persist only the basename across platforms.
-        filename_value = Path(filename_value.replace("\\", "/")).name[:200] or None
+) -> int:
+    """Grava a mensagem (e o uso no rollup) e retorna o id dela."""
+    tokens_value = _tokens(tokens)
+    filename_value = _attachment_name(attachment_filename)
     has_attachment_value = bool(has_attachment) if has_attachment is not None else bool(filename_value)
-    cur.execute(
-        "INSERT INTO chat_messages (chat_id, role, content, tokens, has_attachment, attachment_filename) VALUES (?, ?, ?, ?, ?, ?)",
-        (chat_id, role, content, tokens_value, 1 if has_attachment_value else 0, filename_value),
-    )
-    cur.execute("UPDATE chats SET updated_at = datetime('now') WHERE id = ?", (chat_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        cur = conn.execute(
+            "INSERT INTO chat_messages (chat_id, role, content, tokens, has_attachment, attachment_filename) VALUES (?, ?, ?, ?, ?, ?)",
+            (chat_id, role, content, tokens_value, 1 if has_attachment_value else 0, filename_value),
+        )
+        conn.execute("UPDATE chats SET updated_at = datetime('now') WHERE id = ?", (chat_id,))
+        owner = conn.execute(
+            "SELECT c.user_id, c.agent_id, a.model FROM chats c LEFT JOIN agents a ON a.id = c.agent_id WHERE c.id = ?",
+            (chat_id,),
+        ).fetchone()
+        if owner:
+            record_usage(conn, owner["user_id"], owner["agent_id"], owner["model"], "Conversa", tokens_value, has_attachment_value)
+        return cur.lastrowid
 
 
+@retry_on_busy
+def record_turn(
+    chat_id: int,
+    user_id: int,
+    prompt: str,
+    reply: str,
+    input_tokens: Optional[int] = None,
+    output_tokens: Optional[int] = None,
+    has_attachment: Optional[bool] = None,
+    attachment_filename: Optional[str] = None,
+    previous_response_id: Optional[str] = None,
+) -> Optional[Tuple[int, int]]:
+    """
+    Grava um turno inteiro (pergunta, resposta, uso, response id e updated_at)
+    numa unica transacao: um commit por turno em vez de um por escrita.
+    Retorna os ids (pergunta, resposta), ou None se o chat nao e do usuario.
+    """
+    filename_value = _attachment_name(attachment_filename)
+    has_attachment_value = bool(has_attachment) if has_attachment is not None else bool(filename_value)
+    rows = [
+        (chat_id, "user", prompt, _tokens(input_tokens), 1 if has_attachment_value else 0, filename_value),
+        (chat_id, "assistant", reply, _tokens(output_tokens), 0, None),
+    ]
+    with transaction() as conn:
+        owner = conn.execute(
+            "SELECT c.agent_id, a.model FROM chats c LEFT JOIN agents a ON a.id = c.agent_id WHERE c.id = ? AND c.user_id = ?",
+            (chat_id, user_id),
+        ).fetchone()
+        if not owner:
+            return None
+        conn.executemany(
+            "INSERT INTO chat_messages (chat_id, role, content, tokens, has_attachment, attachment_filename) VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        # O lock de escrita e nosso ate o commit: as duas ultimas linhas do chat sao as do turno.
+        ids = [
+            r["id"]
+            for r in conn.execute(
+                "SELECT id FROM chat_messages WHERE chat_id = ? ORDER BY id DESC LIMIT 2", (chat_id,)
+            )
+        ]
+        conn.execute(
+            """UPDATE chats SET updated_at = datetime('now'),
+                   previous_response_id = COALESCE(?, previous_response_id)
+               WHERE id = ?""",
+            (previous_response_id, chat_id),
+        )
+        for _chat, _role, _content, tokens_value, attached, _filename in rows:
+            record_usage(conn, user_id, owner["agent_id"], owner["model"], "Conversa", tokens_value, bool(attached))
+    return ids[1], ids[0]
+
 
 def get_chat(chat_id: int, user_id: int) -> Optional[Dict[str, Any]]:
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT id, user_id, agent_id, title, conversation_topic_summary, previous_response_id, created_at, updated_at FROM chats WHERE id = ? AND user_id = ?",
-        (chat_id, user_id),
-    )
-    row = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT id, user_id, agent_id, title, conversation_topic_summary, previous_response_id, created_at, updated_at FROM chats WHERE id = ? AND user_id = ?",
+            (chat_id, user_id),
+        ).fetchone()
     return dict(row) if row else None
 
 
+@retry_on_busy
 def update_conversation_topic_summary(
     chat_id: int,
     user_id: int,
     conversation_topic_summary: Optional[str],
 ) -> None:
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE chats SET conversation_topic_summary = ? WHERE id = ? AND user_id = ?",
-        (conversation_topic_summary, chat_id, user_id),
-    )
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE chats SET conversation_topic_summary = ? WHERE id = ? AND user_id = ?",
+            (conversation_topic_summary, chat_id, user_id),
+        )
 
 
+@retry_on_busy
 def update_previous_response_id(chat_id: int, user_id: int, previous_response_id: Optional[str]) -> None:
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE chats SET previous_response_id = ? WHERE id = ? AND user_id = ?",
-        (previous_response_id, chat_id, user_id),
-    )
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE chats SET previous_response_id = ? WHERE id = ? AND user_id = ?",
+            (previous_response_id, chat_id, user_id),
+        )
 
 
+@retry_on_busy
 def rename_chat(chat_id: int, user_id: int, title: str) -> None:
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE chats SET title = ?, updated_at = datetime('now') WHERE id = ? AND user_id = ?",
-        (title, chat_id, user_id),
-    )
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE chats SET title = ?, updated_at = datetime('now') WHERE id = ? AND user_id = ?",
+            (title, chat_id, user_id),
+        )
 
 
+@retry_on_busy
 def delete_chat(chat_id: int, user_id: int) -> None:
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        "DELETE FROM chat_messages WHERE chat_id = ?",
-        (chat_id,),
-    )
-    cur.execute(
-        "DELETE FROM chats WHERE id = ? AND user_id = ?",
-        (chat_id, user_id),
-    )
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        discard_chat_usage(conn, "SELECT id FROM chats WHERE id = ? AND user_id = ?", [chat_id, user_id])
+        conn.execute(
+            "DELETE FROM chat_messages WHERE chat_id IN (SELECT id FROM chats WHERE id = ? AND user_id = ?)",
+            (chat_id, user_id),
+        )
+        conn.execute(
+            "DELETE FROM summary_jobs WHERE chat_id = ? AND user_id = ?",
+            (chat_id, user_id),
+        )
+        conn.execute(
+            "DELETE FROM chat_summary_state WHERE chat_id IN (SELECT id FROM chats WHERE id = ? AND user_id = ?)",
+            (chat_id, user_id),
+        )
+        conn.execute(
+            "DELETE FROM chats WHERE id = ? AND user_id = ?",
+            (chat_id, user_id),
+        )
 
 
+@retry_on_busy
 def add_chat_test_message(
     user_id: int,
     role: str,
@@ -159,16 +304,53 @@ def add_chat_test_message(
     agent_name: Optional[str] = None,
 ) -> None:
     """Persiste mensagem do Chat Testes para auditoria no Compliance."""
-    conn = connect()
-    cur = conn.cursor()
     tokens_val = int(tokens) if tokens is not None else 0
-    fn = (attachment_filename or "").strip() or None
-    if fn:
-        fn = Path(fn.replace("\\", "/")).name[:200] or None
-    cur.execute(
-        """INSERT INTO chat_test_messages (user_id, agent_id, role, content, tokens, has_attachment, attachment_filename, model, agent_name)
-           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-        (user_id, agent_id, role, content, tokens_val, 1 if has_attachment else 0, fn, model, agent_name),
-    )
-    conn.commit()
-    conn.close()
+    fn = _attachment_name(attachment_filename)
+    with transaction() as conn:
+        conn.execute(
+            """INSERT INTO chat_test_messages (user_id, agent_id, role, content, tokens, has_attachment, attachment_filename, model, agent_name)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (user_id, agent_id, role, content, tokens_val, 1 if has_attachment else 0, fn, model, agent_name),
+        )
+        # A auditoria conta o Chat Testes pelas mensagens do usuario (que levam o total do turno).
+        if role == "user":
+            agent_model = None
+            if agent_id is not None:
+                row = conn.execute("SELECT model FROM agents WHERE id = ?", (agent_id,)).fetchone()
+                agent_model = row["model"] if row else None
+            record_usage(
+                conn, user_id, agent_id, model or agent_model, "Teste", tokens_val, bool(has_attachment), agent_name
+            )
+
+
+@retry_on_busy
+def record_test_turn(
+    user_id: int,
+    prompt: str,
+    reply: str,
+    agent_id: Optional[int] = None,
+    input_tokens: Optional[int] = None,
+    output_tokens: Optional[int] = None,
+    has_attachment: bool = False,
+    attachment_filename: Optional[str] = None,
+    model: Optional[str] = None,
+    agent_name: Optional[str] = None,
+) -> None:
+    """Par pergunta/resposta do Chat Testes numa transacao (mesma auditoria de add_chat_test_message)."""
+    tokens_val = _tokens(input_tokens)
+    fn = _attachment_name(attachment_filename)
+    with transaction() as conn:
+        conn.executemany(
+            """INSERT INTO chat_test_messages (user_id, agent_id, role, content, tokens, has_attachment, attachment_filename, model, agent_name)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            [
+                (user_id, agent_id, "user", prompt, tokens_val, 1 if has_attachment else 0, fn, model, agent_name),
+                (user_id, agent_id, "assistant", reply, _tokens(output_tokens), 0, None, model, agent_name),
+            ],
+        )
+        agent_model = None
+        if agent_id is not None:
+            row = conn.execute("SELECT model FROM agents WHERE id = ?", (agent_id,)).fetchone()
+            agent_model = row["model"] if row else None
+        # O modelo passado e o que respondeu (ex.: variante da comparacao); o do agente so na falta dele.
+        record_usage(conn, user_id, agent_id, model or agent_model, "Teste", tokens_val, bool(has_attachment), agent_name)
@@ -1,10 +1,43 @@
+from typing import Optional
+
+import numpy as np
 import pandas as pd
-from src.core.db import connect
+from src.core.db import get_connection
+from src.core.search import HIGHLIGHT, SNIPPET_TOKENS, fts_query, page_bounds
+# Registro de precos vive em core.pricing (tambem usado pelo rollup diario); reexportado aqui.
+from src.core.pricing import (
+    DEFAULT_PRICING_VERSION,
+    OUTPUT_TOKEN_SHARE,
+    PRICING_TABLES,
+    cost_sql,
+    get_pricing_table,
+    price_per_1k,
+)
+from src.repos.usage_repo import agent_label_sql
 
 
-def get_compliance_data():
-    conn = connect()
+def estimate_costs(
+    models: pd.Series,
+    tokens: pd.Series,
+    version: Optional[str] = None,
+    output_share: float = OUTPUT_TOKEN_SHARE,
+) -> pd.Series:
+    """
+    Custo estimado (USD) por linha. O preco e resolvido uma vez por modelo distinto
+    (categorias) e aplicado por indice, sem apply linha a linha.
+    """
+    table = get_pricing_table(version)
+    categories = models.fillna("").astype(str).astype("category")
+    prices = np.array(
+        [price_per_1k(model, table) for model in categories.cat.categories],
+        dtype=float,
+    ).reshape(-1, 2)
+    blended = prices[:, 0] * (1 - output_share) + prices[:, 1] * output_share
+    per_1k = blended[categories.cat.codes.to_numpy()] if len(blended) else np.zeros(len(models))
+    return pd.Series(tokens.to_numpy(dtype=float) / 1000 * per_1k, index=models.index)
+
 
+def get_compliance_data():
     # Query para Conversas Reais (Agrupando para somar tokens de User + Assistant)
     query_conversas = """
     SELECT
@@ -27,16 +60,16 @@ def get_compliance_data():
     """
 
     # Query para Mensagens de Teste
-    query_testes = """
+    query_testes = f"""
     SELECT
         t.id,
         t.created_at as "Data/Hora",
         u.email as "Usuário",
         u.role as "Acesso",
-        COALESCE(a.name, t.agent_name, '(Em configuração)') as "Agente",
+        {_TEST_AGENT} as "Agente",
         '(Chat Testes)' as "Resumo",
         t.tokens as "Tokens",
-        COALESCE(a.model, t.model, '—') as "Modelo",
+        COALESCE(t.model, a.model, '—') as "Modelo",
         t.has_attachment as "Tem Anexo?",
         t.attachment_filename as "Arquivo"
     FROM chat_test_messages t
@@ -46,7 +79,7 @@ def get_compliance_data():
     ORDER BY t.created_at DESC
     """
 
-    try:
+    with get_connection() as conn:
         df = pd.read_sql_query(query_conversas, conn)
         df["Origem"] = "Conversa"
 
@@ -58,25 +91,356 @@ def get_compliance_data():
 
         if not df.empty:
             df["Data/Hora"] = pd.to_datetime(df["Data/Hora"])
-            df["Tokens"] = df["Tokens"].fillna(0).astype(int)
+            df["Tokens"] = pd.to_numeric(df["Tokens"], errors="coerce").fillna(0).astype(int)
             df["Tem Anexo?"] = df["Tem Anexo?"].astype(bool)
             df["Resumo"] = (
                 df["Resumo"].fillna("(Tópico não sumarizado)").astype(str).str.strip()
             )
 
             # Categorização simples
-            def _categorizar(txt):
-                txt = str(txt).lower()
-                if "teste" in txt:
-                    return "Teste"
-                if "código" in txt or "code" in txt:
-                    return "Dev"
-                return "Geral"
-
-            df["Categoria (IA)"] = df["Resumo"].apply(_categorizar)
+            resumo = df["Resumo"].str.lower()
+            df["Categoria (IA)"] = np.select(
+                [
+                    resumo.str.contains("teste", regex=False),
+                    resumo.str.contains("código", regex=False) | resumo.str.contains("code", regex=False),
+                ],
+                ["Teste", "Dev"],
+                default="Geral",
+            )
+            df["Custo ($)"] = estimate_costs(df["Modelo"], df["Tokens"])
 
             df = df.sort_values("Data/Hora", ascending=False).reset_index(drop=True)
 
         return df
-    finally:
-        conn.close()
+
+
+# --- Consulta paginada com filtros no SQL ---
+
+# Chave de ordenacao (nome da coluna no painel) -> coluna do CTE de auditoria.
+SORT_COLUMNS = {
+    "Data/Hora": "ts",
+    "Tokens": "tokens",
+    "Custo ($)": "cost",
+    "Usuário": "user_email",
+    "Agente": "agent",
+}
+ORIGINS = ("Conversa", "Teste")
+
+# Rotulo do agente nas linhas de teste: mesma regra do rollup usage_daily.
+_TEST_AGENT = agent_label_sql("t.agent_id", "t.agent_name")
+
+_PAGE_COLUMNS = """
+    id,
+    ts AS "Data/Hora",
+    user_email AS "Usuário",
+    role AS "Acesso",
+    agent AS "Agente",
+    summary AS "Resumo",
+    tokens AS "Tokens",
+    model AS "Modelo",
+    has_attachment AS "Tem Anexo?",
+    filename AS "Arquivo",
+    origin AS "Origem",
+    cost AS "Custo ($)"
+"""
+
+
+def _in_clause(column: str, values) -> tuple:
+    values = list(values)
+    return f"{column} IN ({', '.join('?' for _ in values)})", values
+
+
+def _period(column: str, date_from=None, date_to=None) -> tuple:
+    """
+    Filtro de periodo (date_to inclusivo) sobre um created_at ('YYYY-MM-DD HH:MM:SS'),
+    pelo dia de cada mensagem, como o rollup.
+    """
+    clauses, params = [], []
+    if date_from:
+        clauses.append(f"{column} >= ?")
+        params.append(str(pd.Timestamp(date_from).date()))
+    if date_to:
+        clauses.append(f"{column} < ?")
+        params.append(str((pd.Timestamp(date_to) + pd.Timedelta(days=1)).date()))
+    return clauses, params
+
+
+def _audit_cte(
+    users=None,
+    agents=None,
+    date_from=None,
+    date_to=None,
+    has_attachment: Optional[bool] = None,
+    origin: Optional[str] = None,
+    pricing_version: Optional[str] = None,
+) -> tuple:
+    """
+    Monta o CTE `audit` ja filtrado (usuario/agente no WHERE de cada ramo, periodo e
+    anexo antes de paginar) com a coluna de custo calculada no SQL. Uma conversa soma
+    so as mensagens do periodo, como o rollup diario.
+    """
+    branches, params = [], []
+
+    if origin in (None, "", "Conversa"):
+        where, having, branch_params, having_params = [], [], [], []
+        if users:
+            clause, values = _in_clause("u.email", users)
+            where.append(clause)
+            branch_params.extend(values)
+        if agents:
+            clause, values = _in_clause("a.name", agents)
+            where.append(clause)
+            branch_params.extend(values)
+        clauses, values = _period("m.created_at", date_from, date_to)
+        where.extend(clauses)
+        branch_params.extend(values)
+        if has_attachment is not None:
+            having.append("MAX(CAST(m.has_attachment AS INT)) = ?")
+            having_params.append(1 if has_attachment else 0)
+        branches.append(f"""
+        SELECT
+            c.id AS id,
+            MAX(m.created_at) AS ts,
+            u.email AS user_email,
+            u.role AS role,
+            a.name AS agent,
+            c.conversation_topic_summary AS summary,
+            SUM(m.tokens) AS tokens,
+            COUNT(*) AS messages,
+            a.model AS model,
+            MAX(CAST(m.has_attachment AS INT)) AS has_attachment,
+            MAX(m.attachment_filename) AS filename,
+            'Conversa' AS origin
+        FROM chats c
+        JOIN chat_messages m ON m.chat_id = c.id
+        JOIN users u ON c.user_id = u.id
+        JOIN agents a ON c.agent_id = a.id
+        {"WHERE " + " AND ".join(where) if where else ""}
+        GROUP BY c.id
+        {"HAVING " + " AND ".join(having) if having else ""}
+        """)
+        params.extend(branch_params + having_params)
+
+    if origin in (None, "", "Teste"):
+        where, branch_params = ["t.role = 'user'"], []
+        if users:
+            clause, values = _in_clause("u.email", users)
+            where.append(clause)
+            branch_params.extend(values)
+        if agents:
+            clause, values = _in_clause(_TEST_AGENT, agents)
+            where.append(clause)
+            branch_params.extend(values)
+        clauses, values = _period("t.created_at", date_from, date_to)
+        where.extend(clauses)
+        branch_params.extend(values)
+        if has_attachment is not None:
+            where.append("t.has_attachment = ?")
+            branch_params.append(1 if has_attachment else 0)
+        branches.append(f"""
+        SELECT
+            t.id AS id,
+            t.created_at AS ts,
+            u.email AS user_email,
+            u.role AS role,
+            {_TEST_AGENT} AS agent,
+            '(Chat Testes)' AS summary,
+            t.tokens AS tokens,
+            1 AS messages,
+            COALESCE(t.model, a.model, '—') AS model,
+            t.has_attachment AS has_attachment,
+            t.attachment_filename AS filename,
+            'Teste' AS origin
+        FROM chat_test_messages t
+        JOIN users u ON t.user_id = u.id
+        LEFT JOIN agents a ON t.agent_id = a.id
+        WHERE {" AND ".join(where)}
+        """)
+        params.extend(branch_params)
+
+    if not branches:
+        raise ValueError(f"Origem invalida: {origin!r}. Opcoes: {', '.join(ORIGINS)}.")
+
+    cost_expr, cost_params = cost_sql("tokens", "model", get_pricing_table(pricing_version))
+    sql = f"""
+    WITH base AS ({" UNION ALL ".join(branches)}),
+    audit AS (SELECT base.*, {cost_expr} AS cost FROM base)
+    """
+    return sql, params + cost_params
+
+
+def query_compliance(
+    users=None,
+    agents=None,
+    date_from=None,
+    date_to=None,
+    has_attachment: Optional[bool] = None,
+    origin: Optional[str] = None,
+    page: int = 1,
+    page_size: int = 50,
+    sort: str = "Data/Hora",
+    descending: bool = True,
+    pricing_version: Optional[str] = None,
+    with_daily: bool = True,
+) -> dict:
+    """
+    Uma pagina da auditoria com os filtros aplicados no SQL, mais os KPIs do
+    conjunto filtrado inteiro (total de linhas, mensagens, tokens, custo) e o uso diario
+    para o grafico (with_daily=False pula esse agrupamento quando o grafico vem
+    do rollup usage_daily). Memoria proporcional a pagina, nao ao historico.
+
+    Retorna {"rows", "total", "messages", "tokens", "cost", "daily", "page", "page_size", "pages"}.
+    "messages" conta como o rollup: toda mensagem de conversa e a pergunta de cada teste.
+    """
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"Ordenacao invalida: {sort!r}. Opcoes: {', '.join(SORT_COLUMNS)}.")
+    page_size = max(1, int(page_size))
+    cte, params = _audit_cte(users, agents, date_from, date_to, has_attachment, origin, pricing_version)
+    direction = "DESC" if descending else "ASC"
+
+    with get_connection() as conn:
+        total, messages, tokens, cost = conn.execute(
+            f"{cte} SELECT COUNT(*), COALESCE(SUM(messages), 0), COALESCE(SUM(tokens), 0), COALESCE(SUM(cost), 0.0) FROM audit",
+            params,
+        ).fetchone()
+        pages = max(1, -(-total // page_size))
+        page = min(max(1, int(page)), pages)
+        rows = pd.read_sql_query(
+            f"""{cte} SELECT {_PAGE_COLUMNS} FROM audit
+            ORDER BY {SORT_COLUMNS[sort]} {direction}, ts {direction}, origin, id {direction}
+            LIMIT ? OFFSET ?""",
+            conn,
+            params=params + [page_size, (page - 1) * page_size],
+        )
+        daily = pd.DataFrame(columns=["Dia", "Tokens"])
+        if with_daily:
+            # Conversas entram no dia de cada mensagem (como no rollup), nao no da ultima.
+            clauses, period_params = _period("m.created_at", date_from, date_to)
+            daily = pd.read_sql_query(
+                f"""{cte}
+                SELECT day AS "Dia", SUM(tokens) AS "Tokens" FROM (
+                    SELECT date(m.created_at) AS day, m.tokens AS tokens
+                    FROM audit JOIN chat_messages m ON m.chat_id = audit.id
+                    WHERE audit.origin = 'Conversa' {"".join(" AND " + c for c in clauses)}
+                    UNION ALL
+                    SELECT date(ts), tokens FROM audit WHERE origin = 'Teste'
+                )
+                GROUP BY day ORDER BY 1""",
+                conn,
+                params=params + period_params,
+            )
+
+    if not rows.empty:
+        rows["Data/Hora"] = pd.to_datetime(rows["Data/Hora"])
+        rows["Tokens"] = pd.to_numeric(rows["Tokens"], errors="coerce").fillna(0).astype(int)
+        rows["Tem Anexo?"] = rows["Tem Anexo?"].astype(bool)
+        rows["Resumo"] = rows["Resumo"].fillna("(Tópico não sumarizado)").astype(str).str.strip()
+    if not daily.empty:
+        daily["Dia"] = pd.to_datetime(daily["Dia"]).dt.date
+
+    return {
+        "rows": rows,
+        "total": int(total),
+        "messages": int(messages),
+        "tokens": int(tokens),
+        "cost": float(cost),
+        "daily": daily,
+        "page": page,
+        "page_size": page_size,
+        "pages": pages,
+    }
+
+
+def get_compliance_filter_options(users=None) -> dict:
+    """Valores para os filtros do painel: usuarios, agentes (dos usuarios escolhidos) e data minima."""
+    user_filter, user_params = ("", [])
+    if users:
+        clause, user_params = _in_clause("u.email", users)
+        user_filter = f"AND {clause}"
+
+    with get_connection() as conn:
+        emails = [
+            r[0]
+            for r in conn.execute(
+                """
+                SELECT email FROM users u
+                WHERE EXISTS (SELECT 1 FROM chats c WHERE c.user_id = u.id)
+                   OR EXISTS (SELECT 1 FROM chat_test_messages t WHERE t.user_id = u.id AND t.role = 'user')
+                ORDER BY email
+                """
+            ).fetchall()
+        ]
+        agents = [
+            r[0]
+            for r in conn.execute(
+                f"""
+                SELECT a.name FROM chats c JOIN agents a ON a.id = c.agent_id JOIN users u ON u.id = c.user_id
+                WHERE 1 = 1 {user_filter}
+                UNION
+                SELECT {_TEST_AGENT}
+                FROM chat_test_messages t JOIN users u ON u.id = t.user_id LEFT JOIN agents a ON a.id = t.agent_id
+                WHERE t.role = 'user' {user_filter}
+                ORDER BY 1
+                """,
+                user_params + user_params,
+            ).fetchall()
+        ]
+        min_ts = conn.execute(
+            """
+            SELECT MIN(ts) FROM (
+                SELECT MIN(created_at) AS ts FROM chat_messages
+                UNION ALL
+                SELECT MIN(created_at) FROM chat_test_messages WHERE role = 'user'
+            )
+            """
+        ).fetchone()[0]
+
+    return {
+        "users": emails,
+        "agents": agents,
+        "min_date": pd.Timestamp(min_ts).date() if min_ts else None,
+    }
+
+
+def search_summaries(query: str, page: int = 1, page_size: int = 20) -> dict:
+    """
+    Busca full-text apenas nos resumos de topico dos chats (visao de Compliance):
+    o conteudo das mensagens nao e consultado nem retornado.
+
+    Retorna {"rows": DataFrame(id, Usuário, Agente, Resumo, Atualizado em, score), "total", "page", "pages"}.
+    """
+    columns = ["id", "Usuário", "Agente", "Resumo", "Atualizado em", "score"]
+    match = fts_query(query)
+    if match is None:
+        return {"rows": pd.DataFrame(columns=columns), "total": 0, "page": 1, "pages": 1}
+    match = f"{{conversation_topic_summary}} : ({match})"
+    open_mark, close_mark = HIGHLIGHT
+
+    with get_connection() as conn:
+        total = conn.execute(
+            """
+            SELECT COUNT(*) FROM chats_fts
+            JOIN chats c ON c.id = chats_fts.rowid
+            JOIN agents a ON a.id = c.agent_id
+            WHERE chats_fts MATCH ?
+            """,
+            (match,),
+        ).fetchone()[0]
+        page, pages, offset = page_bounds(total, page, page_size)
+        rows = pd.read_sql_query(
+            f"""
+            SELECT c.id AS id, u.email AS "Usuário", a.name AS "Agente",
+                   snippet(chats_fts, 1, ?, ?, '…', {SNIPPET_TOKENS}) AS "Resumo",
+                   c.updated_at AS "Atualizado em", bm25(chats_fts) AS score
+            FROM chats_fts
+            JOIN chats c ON c.id = chats_fts.rowid
+            JOIN users u ON u.id = c.user_id
+            JOIN agents a ON a.id = c.agent_id
+            WHERE chats_fts MATCH ?
+            ORDER BY score, c.updated_at DESC, c.id DESC
+            LIMIT ? OFFSET ?
+            """,
+            conn,
+            params=[open_mark, close_mark, match, max(1, int(page_size)), offset],
+        )
+    return {"rows": rows, "total": int(total), "page": page, "pages": pages}
@@ -0,0 +1,151 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ..core.db import get_connection, retry_on_busy, transaction
+from ..core.search import fts_query
+
+
+# Quantos chunks vao para o banco por executemany (memoria limitada na ingestao).
+_INSERT_BATCH = 64
+
+
+def get_document(doc_hash: str) -> Optional[Dict[str, Any]]:
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT hash, filename, size_bytes, pages, chunks, created_at FROM documents WHERE hash = ?",
+            (doc_hash,),
+        ).fetchone()
+    return dict(row) if row else None
+
+
+@retry_on_busy
+def _insert_chunks(rows: List[Tuple[str, int, int, str]]) -> None:
+    # OR IGNORE: uma ingestao anterior interrompida (ou concorrente) pode ter gravado o lote.
+    with transaction() as conn:
+        conn.executemany("INSERT OR IGNORE INTO document_chunks (doc_hash, idx, page, content) VALUES (?, ?, ?, ?)", rows)
+
+
+@retry_on_busy
+def _insert_document(doc_hash: str, filename: Optional[str], size_bytes: int, pages: int, chunks: int) -> None:
+    with transaction() as conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO documents (hash, filename, size_bytes, pages, chunks) VALUES (?, ?, ?, ?, ?)",
+            (doc_hash, filename, int(size_bytes), pages, chunks),
+        )
+
+
+def save_document(
+    doc_hash: str,
+    filename: Optional[str],
+    size_bytes: int,
+    chunks: Iterable[Tuple[int, str]],
+) -> Dict[str, Any]:
+    """
+    Grava os chunks (page, texto) consumindo o iteravel em lotes, cada lote numa
+    transacao curta: o lock de escrita nao fica preso enquanto o PDF e extraido.
+    A linha de documents entra por ultimo, entao o documento so aparece completo.
+    Se o hash ja existe, nada e regravado.
+    """
+    doc = get_document(doc_hash)
+    if doc is not None:
+        return doc
+    count, last_page, batch = 0, 0, []
+    for page, text in chunks:
+        batch.append((doc_hash, count, page, text))
+        count += 1
+        last_page = max(last_page, page)
+        if len(batch) >= _INSERT_BATCH:
+            _insert_chunks(batch)
+            batch = []
+    if batch:
+        _insert_chunks(batch)
+    _insert_document(doc_hash, filename, size_bytes, last_page, count)
+    return get_document(doc_hash)
+
+
+def search_chunks(doc_hash: str, question: str, limit: int = 4) -> List[Dict[str, Any]]:
+    """
+    Chunks do documento mais relevantes para a pergunta (bm25, qualquer termo),
+    devolvidos na ordem do documento. Sem termo util, ou sem acerto, vale o inicio do arquivo.
+    """
+    limit = max(1, int(limit))
+    terms = " ".join(w for w in (question or "").split() if len(w) >= 3)
+    match = fts_query(terms, any_term=True)
+    rows = []
+    with get_connection() as conn:
+        if match is not None:
+            rows = conn.execute(
+                """
+                SELECT d.idx, d.page, d.content
+                FROM document_chunks_fts
+                JOIN document_chunks d ON d.id = document_chunks_fts.rowid
+                WHERE document_chunks_fts MATCH ? AND d.doc_hash = ?
+                ORDER BY bm25(document_chunks_fts)
+                LIMIT ?
+                """,
+                (match, doc_hash, limit),
+            ).fetchall()
+        if not rows:
+            rows = conn.execute(
+                "SELECT idx, page, content FROM document_chunks WHERE doc_hash = ? ORDER BY idx LIMIT ?",
+                (doc_hash, limit),
+            ).fetchall()
+    return sorted((dict(r) for r in rows), key=lambda r: r["idx"])
+
+
+def iter_chunk_texts(doc_hash: str, batch_size: int = 64) -> Iterator[List[str]]:
+    """Textos dos chunks em ordem (idx), em lotes: para gerar embeddings sem carregar tudo."""
+    last = -1
+    while True:
+        with get_connection() as conn:
+            rows = conn.execute(
+                "SELECT idx, content FROM document_chunks WHERE doc_hash = ? AND idx > ? ORDER BY idx LIMIT ?",
+                (doc_hash, last, max(1, int(batch_size))),
+            ).fetchall()
+        if not rows:
+            return
+        last = rows[-1]["idx"]
+        yield [r["content"] for r in rows]
+
+
+def get_chunks(doc_hash: str, indexes: Iterable[int]) -> List[Dict[str, Any]]:
+    """Chunks pelos idx pedidos, na ordem do documento."""
+    indexes = [int(i) for i in indexes]
+    if not indexes:
+        return []
+    with get_connection() as conn:
+        rows = conn.execute(
+            f"""SELECT idx, page, content FROM document_chunks
+                WHERE doc_hash = ? AND idx IN ({', '.join('?' for _ in indexes)}) ORDER BY idx""",
+            [doc_hash, *indexes],
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def get_vector_index(doc_hash: str, embedder: str) -> Optional[Dict[str, Any]]:
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT doc_hash, embedder, dim, rows, path FROM document_vectors WHERE doc_hash = ? AND embedder = ?",
+            (doc_hash, embedder),
+        ).fetchone()
+    return dict(row) if row else None
+
+
+@retry_on_busy
+def save_vector_index(doc_hash: str, embedder: str, dim: int, rows: int, path: str) -> None:
+    with transaction() as conn:
+        conn.execute(
+            """INSERT OR REPLACE INTO document_vectors (doc_hash, embedder, dim, rows, path)
+               VALUES (?, ?, ?, ?, ?)""",
+            (doc_hash, embedder, int(dim), int(rows), path),
+        )
+
+
+@retry_on_busy
+def delete_document(doc_hash: str) -> List[str]:
+    """Apaga documento, chunks e metadados vetoriais; retorna os arquivos de vetores a remover."""
+    with transaction() as conn:
+        paths = [r[0] for r in conn.execute("SELECT path FROM document_vectors WHERE doc_hash = ?", (doc_hash,))]
+        conn.execute("DELETE FROM document_vectors WHERE doc_hash = ?", (doc_hash,))
+        conn.execute("DELETE FROM document_chunks WHERE doc_hash = ?", (doc_hash,))
+        conn.execute("DELETE FROM documents WHERE hash = ?", (doc_hash,))
+    return paths
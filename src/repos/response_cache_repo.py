@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from ..core.config import get_settings
+from ..core.db import get_connection, get_db_path, retry_on_busy, transaction
+
+
+# LRU em memoria na frente da tabela response_cache (compartilhado pelo processo).
+# Entrada: (banco, chave) -> (expira em epoch, agent_id, resposta).
+_memory: "OrderedDict[tuple, tuple]" = OrderedDict()
+_memory_lock = threading.Lock()
+
+
+def _max_entries() -> int:
+    return max(1, get_settings().get_int("RESPONSE_CACHE_MAX_ENTRIES", 256) or 256)
+
+
+def _remember(key: str, agent_id: Optional[int], response: Dict[str, Any], ttl_seconds: float) -> None:
+    mem_key = (get_db_path(), key)
+    limit = _max_entries()
+    with _memory_lock:
+        _memory[mem_key] = (time.time() + ttl_seconds, agent_id, response)
+        _memory.move_to_end(mem_key)
+        while len(_memory) > limit:
+            _memory.popitem(last=False)
+
+
+def get_response(key: str) -> Optional[Dict[str, Any]]:
+    """{output_text, response_id, model} ainda valido para a chave, ou None."""
+    mem_key = (get_db_path(), key)
+    with _memory_lock:
+        entry = _memory.get(mem_key)
+        if entry is not None:
+            if entry[0] > time.time():
+                _memory.move_to_end(mem_key)
+                return dict(entry[2])
+            del _memory[mem_key]
+
+    with get_connection() as conn:
+        row = conn.execute(
+            """SELECT agent_id, model, response_id, output_text,
+                      (julianday(expires_at) - julianday('now')) * 86400 AS ttl
+               FROM response_cache WHERE key = ? AND expires_at > datetime('now')""",
+            (key,),
+        ).fetchone()
+    if not row:
+        return None
+    response = {"output_text": row["output_text"], "response_id": row["response_id"], "model": row["model"]}
+    _remember(key, row["agent_id"], response, row["ttl"])
+    return dict(response)
+
+
+@retry_on_busy
+def save_response(
+    key: str,
+    output_text: str,
+    response_id: Optional[str],
+    model: Optional[str],
+    ttl_seconds: float,
+    agent_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+) -> None:
+    """Grava (ou renova) a resposta da chave; aproveita para apagar as expiradas."""
+    with transaction() as conn:
+        conn.execute("DELETE FROM response_cache WHERE expires_at <= datetime('now')")
+        conn.execute(
+            """INSERT OR REPLACE INTO response_cache (key, user_id, agent_id, model, response_id, output_text, expires_at)
+               VALUES (?, ?, ?, ?, ?, ?, datetime('now', ?))""",
+            (key, user_id, agent_id, model, response_id, output_text, f"+{int(ttl_seconds)} seconds"),
+        )
+    _remember(key, agent_id, {"output_text": output_text, "response_id": response_id, "model": model}, ttl_seconds)
+
+
+def invalidate_agent(conn, agent_id: int) -> None:
+    """
+    Descarta as respostas do agente (banco e memoria). Roda na transacao de quem
+    altera o agente, como record_usage.
+    """
+    conn.execute("DELETE FROM response_cache WHERE agent_id = ?", (agent_id,))
+    db_path = get_db_path()
+    with _memory_lock:
+        for mem_key in [k for k, entry in _memory.items() if k[0] == db_path and entry[1] == agent_id]:
+            del _memory[mem_key]
@@ -0,0 +1,213 @@
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from ..core.config import get_settings
+from . import agents_repo, chat_repo
+
+
+_MISSING = object()
+
+
+def _now_sql() -> str:
+    # Mesmo formato de datetime('now') do SQLite (UTC).
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class RepoCache:
+    """
+    Cache por sessao (um por usuario logado) na frente de chat_repo e agents_repo.
+    Leituras repetidas nos reruns do Streamlit nao vao ao SQLite; as escritas
+    feitas por aqui gravam no banco e atualizam o cache na mesma chamada
+    (write-through). LRU limitado a max_entries; ttl cobre escritas de fora
+    da sessao (worker de resumo, outra aba). Os objetos devolvidos sao
+    compartilhados com o cache: nao modifique.
+    """
+
+    def __init__(
+        self,
+        user_id: int,
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        settings = get_settings()
+        self.user_id = user_id
+        self.max_entries = max(1, max_entries or settings.get_int("SESSION_CACHE_MAX_ENTRIES", 256) or 256)
+        self.ttl = ttl if ttl is not None else settings.get_float("SESSION_CACHE_TTL", 30.0)
+        self._clock = clock
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # --- infraestrutura ---
+
+    def _peek(self, key: tuple) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        expires, value = entry
+        if expires <= self._clock():
+            del self._entries[key]
+            return _MISSING
+        return value
+
+    def _put(self, key: tuple, value: Any) -> Any:
+        self._entries[key] = (self._clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return value
+
+    def _get(self, key: tuple, loader: Callable[[], Any]) -> Any:
+        value = self._peek(key)
+        if value is _MISSING:
+            self.misses += 1
+            return self._put(key, loader())
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value
+
+    def _keys(self, kind: str) -> List[tuple]:
+        return [k for k in self._entries if k[0] == kind]
+
+    def _drop(self, predicate: Callable[[tuple], bool]) -> None:
+        for key in [k for k in self._entries if predicate(k)]:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    # --- agentes ---
+
+    def list_agents(self) -> List[Dict[str, Any]]:
+        return self._get(("agents",), lambda: agents_repo.list_agents_by_user(self.user_id))
+
+    def get_agent(self, agent_id: int) -> Optional[Dict[str, Any]]:
+        return self._get(("agent", agent_id), lambda: agents_repo.get_agent(agent_id, self.user_id))
+
+    def create_agent(self, **fields) -> int:
+        agent_id = agents_repo.create_agent(user_id=self.user_id, **fields)
+        # Defaults e created_at vem do banco: a lista e relida no proximo acesso.
+        self._drop(lambda k: k == ("agents",))
+        return agent_id
+
+    def update_agent(self, agent_id: int, **fields) -> None:
+        agents_repo.update_agent(agent_id, self.user_id, **fields)
+        changes = {k: v for k, v in fields.items() if v is not None}
+        agent = self._peek(("agent", agent_id))
+        if agent is not _MISSING and agent is not None:
+            agent.update(changes)
+        agents = self._peek(("agents",))
+        if agents is not _MISSING:
+            for row in agents:
+                if row["id"] == agent_id and row is not agent:
+                    row.update(changes)
+
+    # --- chats ---
+
+    def list_chats(self, agent_id: int) -> List[Dict[str, Any]]:
+        return self._get(("chats", agent_id), lambda: chat_repo.list_chats(self.user_id, agent_id))
+
+    def get_chat(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        return self._get(("chat", chat_id), lambda: chat_repo.get_chat(chat_id, self.user_id))
+
+    def get_message_page(self, chat_id: int, before_id: Optional[int] = None, limit: int = 30) -> Dict[str, Any]:
+        return self._get(
+            ("messages", chat_id, before_id, limit),
+            lambda: chat_repo.get_message_page(chat_id, before_id=before_id, limit=limit),
+        )
+
+    def create_chat(self, agent_id: int, title: Optional[str] = None) -> int:
+        chat_id = chat_repo.create_chat(self.user_id, agent_id, title)
+        self._drop(lambda k: k == ("chats", agent_id))
+        return chat_id
+
+    def _touch_chat(self, chat_id: int, **changes) -> None:
+        """Aplica mudancas no chat cacheado e o leva ao topo da lista (updated_at novo)."""
+        changes["updated_at"] = _now_sql()
+        chat = self._peek(("chat", chat_id))
+        if chat is not _MISSING and chat is not None:
+            chat.update(changes)
+        for key in self._keys("chats"):
+            chats = self._peek(key)
+            if chats is _MISSING:
+                continue
+            for i, row in enumerate(chats):
+                if row["id"] == chat_id:
+                    row.update({k: v for k, v in changes.items() if k in row})
+                    chats.insert(0, chats.pop(i))
+                    break
+
+    def _append_messages(self, chat_id: int, new_messages: List[Dict[str, Any]]) -> None:
+        for key in self._keys("messages"):
+            _kind, key_chat, before_id, limit = key
+            if key_chat != chat_id:
+                continue
+            page = self._peek(key)
+            if page is _MISSING or before_id is not None:
+                # Paginas antigas nao mudam com uma mensagem nova.
+                continue
+            messages = page["messages"] + new_messages
+            page["has_older"] = page["has_older"] or len(messages) > limit
+            page["messages"] = messages[-limit:]
+
+    def add_message(self, chat_id: int, role: str, content: str, **kwargs) -> int:
+        message_id = chat_repo.add_message(chat_id, role, content, **kwargs)
+        self._append_messages(
+            chat_id, [{"id": message_id, "role": role, "content": content, "tokens": int(kwargs.get("tokens") or 0)}]
+        )
+        self._touch_chat(chat_id)
+        return message_id
+
+    def record_turn(
+        self,
+        chat_id: int,
+        prompt: str,
+        reply: str,
+        input_tokens: Optional[int] = None,
+        output_tokens: Optional[int] = None,
+        previous_response_id: Optional[str] = None,
+        **kwargs,
+    ):
+        ids = chat_repo.record_turn(
+            chat_id,
+            self.user_id,
+            prompt,
+            reply,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            previous_response_id=previous_response_id,
+            **kwargs,
+        )
+        if ids is None:
+            return None
+        self._append_messages(
+            chat_id,
+            [
+                {"id": ids[0], "role": "user", "content": prompt, "tokens": int(input_tokens or 0)},
+                {"id": ids[1], "role": "assistant", "content": reply, "tokens": int(output_tokens or 0)},
+            ],
+        )
+        changes = {} if previous_response_id is None else {"previous_response_id": previous_response_id}
+        self._touch_chat(chat_id, **changes)
+        return ids
+
+    def rename_chat(self, chat_id: int, title: str) -> None:
+        chat_repo.rename_chat(chat_id, self.user_id, title)
+        self._touch_chat(chat_id, title=title)
+
+    def update_previous_response_id(self, chat_id: int, previous_response_id: Optional[str]) -> None:
+        chat_repo.update_previous_response_id(chat_id, self.user_id, previous_response_id)
+        chat = self._peek(("chat", chat_id))
+        if chat is not _MISSING and chat is not None:
+            chat["previous_response_id"] = previous_response_id
+
+    def delete_chat(self, chat_id: int) -> None:
+        chat_repo.delete_chat(chat_id, self.user_id)
+        self._drop(lambda k: k[0] in ("chat", "messages") and k[1] == chat_id)
+        for key in self._keys("chats"):
+            chats = self._peek(key)
+            if chats is not _MISSING:
+                chats[:] = [row for row in chats if row["id"] != chat_id]
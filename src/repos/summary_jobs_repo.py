@@ -0,0 +1,187 @@
+from typing import Optional, Dict, Any
+from ..core.db import get_connection, retry_on_busy, transaction
+
+
+@retry_on_busy
+def enqueue_summary_job(chat_id: int, user_id: int) -> int:
+    """
+    Pede (novo) resumo para o chat. Se ja houver pedido pendente ou em execucao,
+    ele e substituido: a versao sobe e so a mais recente sera concluida.
+    Um pedido em execucao continua 'running' (nenhum outro worker o pega); quem
+    o executa ve a versao nova ao concluir e devolve o pedido para a fila.
+    Retorna a versao do pedido.
+    """
+    with transaction() as conn:
+        conn.execute(
+            """INSERT INTO summary_jobs (chat_id, user_id) VALUES (?, ?)
+               ON CONFLICT(chat_id) DO UPDATE SET
+                   status = CASE WHEN status = 'running' THEN 'running' ELSE 'pending' END,
+                   version = version + 1,
+                   attempts = 0,
+                   last_error = NULL,
+                   requested_at = datetime('now'),
+                   updated_at = datetime('now')""",
+            (chat_id, user_id),
+        )
+        row = conn.execute("SELECT version FROM summary_jobs WHERE chat_id = ?", (chat_id,)).fetchone()
+        return row["version"]
+
+
+@retry_on_busy
+def claim_summary_job() -> Optional[Dict[str, Any]]:
+    """Marca o pedido pendente mais antigo como 'running' e o devolve (ou None)."""
+    with transaction() as conn:
+        while True:
+            row = conn.execute(
+                """SELECT chat_id, user_id, version FROM summary_jobs
+                   WHERE status = 'pending' ORDER BY requested_at, chat_id LIMIT 1"""
+            ).fetchone()
+            if row is None:
+                return None
+            cur = conn.execute(
+                """UPDATE summary_jobs SET status = 'running', attempts = attempts + 1, updated_at = datetime('now')
+                   WHERE chat_id = ? AND version = ? AND status = 'pending'""",
+                (row["chat_id"], row["version"]),
+            )
+            if cur.rowcount == 1:
+                return dict(row)
+
+
+def get_summary_context(chat_id: int, limit: int = 12) -> Dict[str, Any]:
+    """
+    Dados para resumir o chat: resumo atual, ultimas `limit` mensagens e as
+    mensagens ainda nao cobertas pelo resumo (com id, em ordem cronologica).
+    """
+    with get_connection() as conn:
+        chat = conn.execute(
+            "SELECT conversation_topic_summary FROM chats WHERE id = ?", (chat_id,)
+        ).fetchone()
+        state = conn.execute(
+            "SELECT summarized_message_id FROM chat_summary_state WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        last_id = state["summarized_message_id"] if state and state["summarized_message_id"] else 0
+        recent = conn.execute(
+            "SELECT id, role, content FROM chat_messages WHERE chat_id = ? ORDER BY id DESC LIMIT ?",
+            (chat_id, limit),
+        ).fetchall()
+        new = conn.execute(
+            "SELECT id, role, content FROM chat_messages WHERE chat_id = ? AND id > ? ORDER BY id DESC LIMIT ?",
+            (chat_id, last_id, limit),
+        ).fetchall()
+    return {
+        "summary": chat["conversation_topic_summary"] if chat else None,
+        "summarized_message_id": last_id or None,
+        "recent_messages": [dict(r) for r in reversed(recent)],
+        "new_messages": [dict(r) for r in reversed(new)],
+    }
+
+
+@retry_on_busy
+def complete_summary_job(
+    chat_id: int,
+    user_id: int,
+    version: int,
+    summary: Optional[str],
+    summarized_message_id: Optional[int] = None,
+    tokens_sent: int = 0,
+    tokens_saved: int = 0,
+) -> bool:
+    """
+    Grava o resumo no chat (summary=None: resumo adiado, nada muda) e encerra o
+    pedido se ele ainda for a versao atual. Retorna False quando um pedido mais
+    novo chegou durante o calculo: o resultado velho e descartado e o pedido
+    volta para a fila.
+    """
+    with transaction() as conn:
+        cur = conn.execute(
+            "DELETE FROM summary_jobs WHERE chat_id = ? AND version = ?",
+            (chat_id, version),
+        )
+        if cur.rowcount != 1:
+            _requeue_newer(conn, chat_id)
+            return False
+        if summary is not None:
+            conn.execute(
+                "UPDATE chats SET conversation_topic_summary = ? WHERE id = ? AND user_id = ?",
+                (summary, chat_id, user_id),
+            )
+        conn.execute(
+            """INSERT INTO chat_summary_state (chat_id, summarized_message_id, summaries, skipped, tokens_sent, tokens_saved)
+               VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(chat_id) DO UPDATE SET
+                   summarized_message_id = COALESCE(excluded.summarized_message_id, summarized_message_id),
+                   summaries = summaries + excluded.summaries,
+                   skipped = skipped + excluded.skipped,
+                   tokens_sent = tokens_sent + excluded.tokens_sent,
+                   tokens_saved = tokens_saved + excluded.tokens_saved,
+                   updated_at = datetime('now')""",
+            (
+                chat_id,
+                summarized_message_id,
+                0 if summary is None else 1,
+                1 if summary is None else 0,
+                int(tokens_sent),
+                int(tokens_saved),
+            ),
+        )
+        return True
+
+
+def _requeue_newer(conn, chat_id: int) -> None:
+    # A versao que estava rodando ficou velha: a nova (ainda 'running') volta para a fila.
+    conn.execute(
+        "UPDATE summary_jobs SET status = 'pending', updated_at = datetime('now') WHERE chat_id = ? AND status = 'running'",
+        (chat_id,),
+    )
+
+
+@retry_on_busy
+def fail_summary_job(chat_id: int, version: int, error: str, max_attempts: int = 3) -> None:
+    with transaction() as conn:
+        cur = conn.execute(
+            """UPDATE summary_jobs SET
+                   status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                   last_error = ?,
+                   updated_at = datetime('now')
+               WHERE chat_id = ? AND version = ? AND status = 'running'""",
+            (max_attempts, (error or "")[:500], chat_id, version),
+        )
+        if cur.rowcount == 0:
+            _requeue_newer(conn, chat_id)
+
+
+@retry_on_busy
+def requeue_running_summary_jobs() -> int:
+    """Devolve para a fila pedidos que ficaram 'running' (ex.: processo reiniciado)."""
+    with transaction() as conn:
+        cur = conn.execute(
+            "UPDATE summary_jobs SET status = 'pending', updated_at = datetime('now') WHERE status = 'running'"
+        )
+        return cur.rowcount
+
+
+def count_open_summary_jobs() -> int:
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT COUNT(*) FROM summary_jobs WHERE status IN ('pending', 'running')"
+        ).fetchone()
+    return row[0]
+
+
+def get_summary_job(chat_id: int) -> Optional[Dict[str, Any]]:
+    with get_connection() as conn:
+        row = conn.execute("SELECT * FROM summary_jobs WHERE chat_id = ?", (chat_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def get_summary_token_stats() -> Dict[str, int]:
+    """Totais de resumos gerados/adiados e tokens enviados/economizados (estimados)."""
+    with get_connection() as conn:
+        row = conn.execute(
+            """SELECT COALESCE(SUM(summaries), 0) AS summaries,
+                      COALESCE(SUM(skipped), 0) AS skipped,
+                      COALESCE(SUM(tokens_sent), 0) AS tokens_sent,
+                      COALESCE(SUM(tokens_saved), 0) AS tokens_saved
+               FROM chat_summary_state"""
+        ).fetchone()
+    return dict(row)
@@ -0,0 +1,171 @@
+from typing import Optional
+
+import pandas as pd
+
+from ..core.db import get_connection
+from ..core.pricing import cost_sql, get_pricing_table
+
+
+def agent_label_sql(agent_id: str, agent_name: str) -> str:
+    """
+    Nome exibido para o agente de uma linha de uso, igual no rollup e na auditoria
+    (`a` = agents): o nome atual do agente salvo; sem agente, o nome digitado no
+    Chat Testes; senao '(Em configuração)'. Agente excluido nao volta ao nome antigo
+    da linha, que o rollup nao guarda.
+    """
+    return (
+        f"COALESCE(a.name, CASE WHEN COALESCE({agent_id}, 0) = 0 THEN NULLIF(TRIM({agent_name}), '') END, "
+        "'(Em configuração)')"
+    )
+
+
+_AGENT_LABEL = agent_label_sql("r.agent_id", "r.agent_name")
+
+
+def record_usage(
+    conn,
+    user_id: int,
+    agent_id: Optional[int],
+    model: Optional[str],
+    origin: str,
+    tokens: int,
+    has_attachment: bool = False,
+    agent_name: Optional[str] = None,
+) -> None:
+    """
+    Soma uma mensagem no rollup usage_daily do dia atual. Deve rodar na mesma
+    transacao que grava a mensagem, para o rollup nunca divergir do log.
+    Guarda so tokens: o custo e calculado na leitura, com a tabela de precos vigente.
+    """
+    model = (model or "").strip() or "—"
+    tokens = int(tokens or 0)
+    conn.execute(
+        """
+        INSERT INTO usage_daily (day, user_id, agent_id, agent_name, model, origin, tokens, messages, attachments)
+        VALUES (date('now'), ?, ?, ?, ?, ?, ?, 1, ?)
+        ON CONFLICT (day, user_id, agent_id, agent_name, model, origin) DO UPDATE SET
+            tokens = tokens + excluded.tokens,
+            messages = messages + 1,
+            attachments = attachments + excluded.attachments
+        """,
+        (
+            user_id,
+            agent_id or 0,
+            "" if agent_id else (agent_name or "").strip(),
+            model,
+            origin,
+            tokens,
+            1 if has_attachment else 0,
+        ),
+    )
+
+
+def discard_chat_usage(conn, chats_sql: str, params) -> None:
+    """
+    Refaz os buckets "Conversa" do rollup tocados pelos chats que vao ser apagados
+    (chats_sql: SELECT dos ids), recontando o log sem eles. Roda na transacao do
+    delete, antes de apagar as mensagens.
+    """
+    buckets = conn.execute(
+        f"""
+        SELECT DISTINCT date(m.created_at) AS day, c.user_id, COALESCE(c.agent_id, 0) AS agent_id
+        FROM chat_messages m JOIN chats c ON c.id = m.chat_id
+        WHERE m.chat_id IN ({chats_sql})
+        """,
+        params,
+    ).fetchall()
+    for day, user_id, agent_id in buckets:
+        conn.execute(
+            "DELETE FROM usage_daily WHERE day = ? AND user_id = ? AND agent_id = ? AND origin = 'Conversa'",
+            (day, user_id, agent_id),
+        )
+        # Mesma agregacao do backfill da migracao 5.
+        conn.execute(
+            f"""
+            INSERT INTO usage_daily (day, user_id, agent_id, agent_name, model, origin, tokens, messages, attachments)
+            SELECT date(m.created_at), c.user_id, COALESCE(c.agent_id, 0), '', COALESCE(a.model, '—'), 'Conversa',
+                   SUM(m.tokens), COUNT(*), SUM(m.has_attachment > 0)
+            FROM chat_messages m
+            JOIN chats c ON c.id = m.chat_id
+            LEFT JOIN agents a ON a.id = c.agent_id
+            WHERE date(m.created_at) = ? AND c.user_id = ? AND COALESCE(c.agent_id, 0) = ?
+              AND m.chat_id NOT IN ({chats_sql})
+            GROUP BY 1, 2, 3, 5
+            """,
+            [day, user_id, agent_id, *params],
+        )
+
+
+def _usage_filters(users=None, agents=None, date_from=None, date_to=None, origin=None) -> tuple:
+    where, params = [], []
+    if users:
+        where.append(f"u.email IN ({', '.join('?' for _ in users)})")
+        params.extend(users)
+    if agents:
+        where.append(f"{_AGENT_LABEL} IN ({', '.join('?' for _ in agents)})")
+        params.extend(agents)
+    if date_from:
+        where.append("r.day >= ?")
+        params.append(str(pd.Timestamp(date_from).date()))
+    if date_to:
+        where.append("r.day <= ?")
+        params.append(str(pd.Timestamp(date_to).date()))
+    if origin:
+        where.append("r.origin = ?")
+        params.append(origin)
+    return ("WHERE " + " AND ".join(where)) if where else "", params
+
+
+def _cost_expr(pricing_version: Optional[str] = None) -> tuple:
+    # Mesmo custo da auditoria: conversas pelo modelo atual do agente, testes pelo modelo
+    # que respondeu (gravado na linha), na tabela pedida.
+    model = "CASE WHEN r.origin = 'Teste' THEN r.model ELSE COALESCE(a.model, r.model) END"
+    return cost_sql("r.tokens", model, get_pricing_table(pricing_version))
+
+
+_FROM = """
+FROM usage_daily r
+JOIN users u ON u.id = r.user_id
+LEFT JOIN agents a ON a.id = r.agent_id
+"""
+
+
+def get_usage_kpis(
+    users=None, agents=None, date_from=None, date_to=None, origin=None, pricing_version: Optional[str] = None
+) -> dict:
+    """Totais de tokens, mensagens, anexos e custo no filtro, direto do rollup."""
+    where, params = _usage_filters(users, agents, date_from, date_to, origin)
+    cost, cost_params = _cost_expr(pricing_version)
+    with get_connection() as conn:
+        row = conn.execute(
+            f"""
+            SELECT COALESCE(SUM(r.tokens), 0), COALESCE(SUM(r.messages), 0),
+                   COALESCE(SUM(r.attachments), 0), COALESCE(SUM({cost}), 0.0)
+            {_FROM} {where}
+            """,
+            cost_params + params,
+        ).fetchone()
+    return {"tokens": int(row[0]), "messages": int(row[1]), "attachments": int(row[2]), "cost": float(row[3])}
+
+
+def get_daily_usage(
+    users=None, agents=None, date_from=None, date_to=None, origin=None, pricing_version: Optional[str] = None
+) -> pd.DataFrame:
+    """Serie diaria (Dia, Tokens, Mensagens, Custo ($)) para o grafico do painel."""
+    where, params = _usage_filters(users, agents, date_from, date_to, origin)
+    cost, cost_params = _cost_expr(pricing_version)
+    with get_connection() as conn:
+        df = pd.read_sql_query(
+            f"""
+            SELECT r.day AS "Dia", SUM(r.tokens) AS "Tokens", SUM(r.messages) AS "Mensagens",
+                   SUM({cost}) AS "Custo ($)"
+            {_FROM} {where}
+            GROUP BY r.day
+            ORDER BY r.day
+            """,
+            conn,
+            params=cost_params + params,
+        )
+    if not df.empty:
+        df["Dia"] = pd.to_datetime(df["Dia"]).dt.date
+    return df
@@ -1,36 +1,28 @@
 from typing import Optional, List, Dict, Any
-from ..core.db import connect
+from ..core.db import get_connection, retry_on_busy, transaction
 from ..auth.auth import hash_password
 
 
+@retry_on_busy
 def create_user(email: str, password: str, role: str, active: bool = True) -> int:
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO users (email, password_hash, role, active) VALUES (?, ?, ?, ?)",
-        (email.lower().strip(), hash_password(password), role, 1 if active else 0),
-    )
-    conn.commit()
-    user_id = cur.lastrowid
-    conn.close()
-    return user_id
+    with transaction() as conn:
+        cur = conn.execute(
+            "INSERT INTO users (email, password_hash, role, active) VALUES (?, ?, ?, ?)",
+            (email.lower().strip(), hash_password(password), role, 1 if active else 0),
+        )
+        return cur.lastrowid
 
 def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE email = ?", (email.lower().strip(),))
-    row = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        row = conn.execute("SELECT * FROM users WHERE email = ?", (email.lower().strip(),)).fetchone()
     return dict(row) if row else None
 
 def list_users() -> List[Dict[str, Any]]:
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users ORDER BY created_at DESC")
-    rows = cur.fetchall()
-    conn.close()
+    with get_connection() as conn:
+        rows = conn.execute("SELECT * FROM users ORDER BY created_at DESC").fetchall()
     return [dict(r) for r in rows]
 
+@retry_on_busy
 def update_user(user_id: int, email: Optional[str] = None, role: Optional[str] = None, active: Optional[bool] = None):
     fields = []
     values = []
@@ -51,18 +43,13 @@ def update_user(user_id: int, email: Optional[str] = None, role: Optional[str] =
     sql = f"UPDATE users SET {', '.join(fields)} WHERE id = ?"
     values.append(user_id)
 
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(sql, tuple(values))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(sql, tuple(values))
 
+@retry_on_busy
 def set_password(user_id: int, new_password: str):
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute(
-        "UPDATE users SET password_hash = ?, updated_at = datetime('now') WHERE id = ?",
-        (hash_password(new_password), user_id),
-    )
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE users SET password_hash = ?, updated_at = datetime('now') WHERE id = ?",
+            (hash_password(new_password), user_id),
+        )
\ No newline at end of file
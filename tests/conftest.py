@@ -0,0 +1,21 @@
+import pytest
+
+from src.agents.embeddings import set_embedder
+from src.core.config import clear_settings_cache
+
+
+@pytest.fixture(autouse=True)
+def _fresh_settings_cache():
+    # get_settings() e memoizado: cada teste parte do ambiente que ele mesmo montou.
+    clear_settings_cache()
+    yield
+    clear_settings_cache()
+
+
+@pytest.fixture(autouse=True)
+def _offline_embeddings(monkeypatch: pytest.MonkeyPatch):
+    # Sem chamadas de rede para embeddings: testes de RAG instalam um embedder local.
+    monkeypatch.setenv("RAG_EMBEDDER", "off")
+    set_embedder(None)
+    yield
+    set_embedder(None)
@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+
+import pytest
+
+from src.agents import service as agents_service
+
+
+def _event(type_, **kwargs):
+    return SimpleNamespace(type=type_, **kwargs)
+
+
+def _completed(resp_id="resp_1", input_tokens=11, output_tokens=7):
+    usage = SimpleNamespace(input_tokens=input_tokens, output_tokens=output_tokens, total_tokens=input_tokens + output_tokens)
+    return _event("response.completed", response=SimpleNamespace(id=resp_id, usage=usage))
+
+
+class _DummyResponses:
+    def __init__(self, events):
+        self.events = events
+        self.kwargs = None
+
+    def create(self, **kwargs):
+        self.kwargs = kwargs
+        return iter(self.events)
+
+
+def _patch_client(monkeypatch, events):
+    responses = _DummyResponses(events)
+    monkeypatch.setattr(agents_service, "get_openai_client", lambda: SimpleNamespace(responses=responses))
+    return responses
+
+
+AGENT = {"model": "gpt-4o-mini", "temperature": 0.3, "max_tokens": 200, "system_prompt": "Seja breve."}
+
+
+def test_stream_agent_chat_yields_deltas_then_exposes_id_and_usage(monkeypatch: pytest.MonkeyPatch):
+    responses = _patch_client(
+        monkeypatch,
+        [
+            _event("response.created"),
+            _event("response.output_text.delta", delta="Olá"),
+            _event("response.output_text.delta", delta=", mundo"),
+            _completed(),
+        ],
+    )
+
+    stream = agents_service.stream_agent_chat(AGENT, "oi", previous_response_id="resp_0", file_id="file_1")
+    assert stream.response_id is None
+
+    assert list(stream) == ["Olá", ", mundo"]
+    assert stream.text == "Olá, mundo"
+    assert stream.response_id == "resp_1"
+    assert stream.usage == {"input_tokens": 11, "output_tokens": 7, "total_tokens": 18}
+
+    assert responses.kwargs["stream"] is True
+    assert responses.kwargs["previous_response_id"] == "resp_0"
+    assert responses.kwargs["instructions"] == "Seja breve."
+    assert responses.kwargs["max_output_tokens"] == 200
+    assert responses.kwargs["input"][0]["content"][1] == {"type": "input_file", "file_id": "file_1"}
+
+
+def test_stream_agent_chat_raises_on_failed_or_truncated_stream(monkeypatch: pytest.MonkeyPatch):
+    failed = SimpleNamespace(error=SimpleNamespace(message="quota"))
+    _patch_client(monkeypatch, [_event("response.output_text.delta", delta="x"), _event("response.failed", response=failed)])
+    with pytest.raises(RuntimeError, match="quota"):
+        list(agents_service.stream_agent_chat(AGENT, "oi"))
+
+    _patch_client(monkeypatch, [_event("response.output_text.delta", delta="x")])
+    with pytest.raises(RuntimeError):
+        list(agents_service.stream_agent_chat(AGENT, "oi"))
+
+
+def test_stream_agent_chat_rejects_empty_message():
+    with pytest.raises(ValueError):
+        agents_service.stream_agent_chat(AGENT, "")
@@ -0,0 +1,117 @@
+import asyncio
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.agents import service as agents_service
+from src.core.config import clear_settings_cache
+from src.core.db import init_db
+from src.openai import client as openai_client
+from src.openai import text_generation
+
+
+class _AsyncDummyResponses:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        await asyncio.sleep(self.delay)
+        usage = SimpleNamespace(input_tokens=5, output_tokens=3, total_tokens=8)
+        return SimpleNamespace(output_text=f"resp:{kwargs['model']}", id=f"resp_{len(self.calls)}", usage=usage)
+
+
+class _AsyncDummyFiles:
+    def __init__(self):
+        self.calls = []
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs)
+        return SimpleNamespace(id=f"file_{len(self.calls)}")
+
+
+def _patch_async_client(monkeypatch, module, delay=0.0):
+    dummy = SimpleNamespace(responses=_AsyncDummyResponses(delay), files=_AsyncDummyFiles())
+    monkeypatch.setattr(module, "get_async_openai_client", lambda: dummy)
+    return dummy
+
+
+AGENT = {"model": "gpt-4o-mini", "temperature": 0.3, "max_tokens": 200, "system_prompt": "Seja breve."}
+
+
+def test_arun_agent_chat_matches_sync_payload(monkeypatch: pytest.MonkeyPatch):
+    dummy = _patch_async_client(monkeypatch, agents_service)
+
+    text, resp_id, usage = asyncio.run(
+        agents_service.arun_agent_chat(AGENT, "oi", previous_response_id="resp_0", file_id="file_1")
+    )
+
+    assert (text, resp_id) == ("resp:gpt-4o-mini", "resp_1")
+    assert usage == {"input_tokens": 5, "output_tokens": 3, "total_tokens": 8}
+    assert dummy.responses.calls[0] == agents_service._build_agent_payload(AGENT, "oi", "resp_0", "file_1")
+
+
+def test_agenerate_text_and_aupload_pdf(monkeypatch: pytest.MonkeyPatch):
+    os.environ["APP_DB_PATH"] = tempfile.NamedTemporaryFile(delete=False).name
+    init_db()
+    gen_dummy = _patch_async_client(monkeypatch, text_generation)
+    svc_dummy = _patch_async_client(monkeypatch, agents_service)
+
+    text, resp_id = asyncio.run(text_generation.agenerate_text("gpt-4o", "oi", instructions="x"))
+    assert (text, resp_id) == ("resp:gpt-4o", "resp_1")
+    assert gen_dummy.responses.calls[0]["instructions"] == "x"
+
+    upload = SimpleNamespace(name="a.pdf", type="application/pdf", getvalue=lambda: b"%PDF")
+    assert asyncio.run(agents_service.aupload_pdf(upload)) == "file_1"
+    assert svc_dummy.files.calls[0]["file"] == ("a.pdf", b"%PDF", "application/pdf")
+
+    with pytest.raises(ValueError):
+        asyncio.run(agents_service.aupload_pdf(None))
+
+
+def test_agenerate_compliance_summary_skips_call_without_messages(monkeypatch: pytest.MonkeyPatch):
+    dummy = _patch_async_client(monkeypatch, agents_service)
+
+    assert asyncio.run(agents_service.agenerate_compliance_summary([])) == "Novo chat iniciado."
+    summary = asyncio.run(
+        agents_service.agenerate_compliance_summary([{"role": "user", "content": "Politica de ferias"}])
+    )
+    assert summary == "resp:gpt-4o-mini"
+    assert len(dummy.responses.calls) == 1
+
+
+def test_async_fan_out_runs_concurrently(monkeypatch: pytest.MonkeyPatch):
+    _patch_async_client(monkeypatch, agents_service, delay=0.2)
+    messages = [{"role": "user", "content": "Duvida sobre reembolso"}]
+
+    async def fan_out():
+        return await asyncio.gather(*(agents_service.agenerate_compliance_summary(messages) for _ in range(5)))
+
+    started = time.perf_counter()
+    results = asyncio.run(fan_out())
+    elapsed = time.perf_counter() - started
+
+    assert len(results) == 5
+    # Serial seriam ~1s; em paralelo no mesmo loop ficam perto de 0.2s.
+    assert elapsed < 0.6
+
+
+def test_async_client_is_shared_per_event_loop(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setenv("OPENAI_MAX_CONNECTIONS", "7")
+    clear_settings_cache()
+    monkeypatch.setattr(openai_client, "_async_clients", openai_client.weakref.WeakKeyDictionary())
+
+    async def two_clients():
+        return openai_client.get_async_openai_client(), openai_client.get_async_openai_client()
+
+    first_a, first_b = asyncio.run(two_clients())
+    second_a, _ = asyncio.run(two_clients())
+
+    assert first_a is first_b
+    assert first_a is not second_a
+    assert openai_client.get_http_options()["limits"].max_connections == 7
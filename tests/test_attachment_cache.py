@@ -0,0 +1,113 @@
+import hashlib
+import os
+import tempfile
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from src.agents import service as agents_service
+from src.core.config import clear_settings_cache
+from src.core.db import init_db, transaction
+from src.repos.attachments_repo import get_cached_file
+
+
+def setup_temp_db():
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    os.environ["APP_DB_PATH"] = tmp.name
+    init_db()
+    return tmp.name
+
+
+PDF = b"%PDF-1.4\n1 0 obj << /Type /Pages /Count 2 >>\n2 0 obj << /Type /Page >>\n3 0 obj << /Type/Page >>\n"
+
+
+class _DummyFiles:
+    def __init__(self):
+        self.created = []
+        self.deleted = []
+        self.fail_delete = None
+
+    def create(self, **kwargs):
+        self.created.append(kwargs)
+        return SimpleNamespace(id=f"file_{len(self.created)}")
+
+    def delete(self, file_id):
+        if self.fail_delete is not None:
+            raise self.fail_delete
+        self.deleted.append(file_id)
+        return SimpleNamespace(id=file_id, deleted=True)
+
+
+@pytest.fixture
+def files(monkeypatch: pytest.MonkeyPatch):
+    setup_temp_db()
+    monkeypatch.setenv("ATTACHMENT_CLEANUP_INTERVAL", "0")  # sem limpeza em thread durante o teste
+    clear_settings_cache()
+    dummy = _DummyFiles()
+    monkeypatch.setattr(agents_service, "get_openai_client", lambda: SimpleNamespace(files=dummy))
+    return dummy
+
+
+def _upload(data=PDF, name="a.pdf"):
+    return SimpleNamespace(name=name, type="application/pdf", getvalue=lambda: data)
+
+
+def _expire_all():
+    with transaction() as conn:
+        conn.execute("UPDATE attachment_cache SET expires_at = datetime('now', '-1 minute')")
+
+
+def test_same_content_is_uploaded_once(files):
+    first = agents_service.upload_pdf(_upload())
+    again = agents_service.upload_pdf(_upload(name="copia.pdf"))
+    other = agents_service.upload_pdf(_upload(PDF + b"%%EOF"))
+
+    assert first == again == "file_1"
+    assert other == "file_2"
+    assert len(files.created) == 2
+
+    entry = get_cached_file(hashlib.sha256(PDF).hexdigest())
+    assert entry["file_id"] == "file_1"
+    assert entry["size_bytes"] == len(PDF) and entry["pages"] == 2
+
+
+def test_expired_entries_are_reuploaded_and_cleaned(files):
+    agents_service.upload_pdf(_upload())
+    _expire_all()
+
+    assert agents_service.upload_pdf(_upload()) == "file_2"  # expirado: novo upload
+    _expire_all()
+    assert agents_service.cleanup_attachment_cache() == 1
+    assert files.deleted == ["file_2"]
+    assert agents_service.cleanup_attachment_cache() == 0
+
+
+def test_cleanup_keeps_entry_when_remote_delete_fails(files):
+    agents_service.upload_pdf(_upload())
+    _expire_all()
+
+    files.fail_delete = RuntimeError("rede fora")
+    assert agents_service.cleanup_attachment_cache() == 0
+    files.fail_delete = None
+    assert agents_service.cleanup_attachment_cache() == 1
+    assert files.deleted == ["file_1"]
+
+    # Arquivo ja apagado no servidor tambem sai do cache
+    agents_service.upload_pdf(_upload(PDF + b"x"))
+    _expire_all()
+    request = httpx.Request("DELETE", "https://api.openai.com/v1/files/file_2")
+    files.fail_delete = openai.NotFoundError("not found", response=httpx.Response(404, request=request), body=None)
+    assert agents_service.cleanup_attachment_cache() == 1
+
+
+def test_maybe_cleanup_respects_interval(files, monkeypatch: pytest.MonkeyPatch):
+    assert agents_service.maybe_cleanup_attachments() is False  # intervalo 0 desliga
+
+    monkeypatch.setenv("ATTACHMENT_CLEANUP_INTERVAL", "3600")
+    clear_settings_cache()
+    monkeypatch.setattr(agents_service, "_next_cleanup", 0.0)
+    monkeypatch.setattr(agents_service, "cleanup_attachment_cache", lambda: 0)
+    assert agents_service.maybe_cleanup_attachments() is True
+    assert agents_service.maybe_cleanup_attachments() is False
@@ -0,0 +1,127 @@
+import os
+import sqlite3
+import tempfile
+
+from src.core.db import init_db, transaction
+from src.core.migrations import MIGRATIONS
+from src.core.search import fts_query
+from src.repos.agents_repo import create_agent
+from src.repos.chat_repo import (
+    add_message,
+    create_chat,
+    delete_chat,
+    rename_chat,
+    search_chats,
+    update_conversation_topic_summary,
+)
+from src.repos.compliance_repo import search_summaries
+from src.repos.users_repo import create_user
+
+
+def setup_temp_db():
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    os.environ["APP_DB_PATH"] = tmp.name
+    init_db()
+    return tmp.name
+
+
+def _seed():
+    setup_temp_db()
+    alice = create_user("alice@s.com", "pw123456", "USER", True)
+    bob = create_user("bob@s.com", "pw123456", "USER", True)
+    agent_a = create_agent(alice, "Agente A", "Desc", "gpt-4o-mini", 256, 0.7, "P")
+    agent_b = create_agent(bob, "Agente B", "Desc", "gpt-4o-mini", 256, 0.7, "P")
+    return alice, bob, agent_a, agent_b
+
+
+def test_fts_query_sanitizes_input():
+    assert fts_query('impostos "OR" NEAR(') == '"impostos"* "OR"* "NEAR"*'
+    assert fts_query("  ** ") is None
+    assert fts_query(None) is None
+
+
+def test_search_chats_ranks_highlights_and_scopes_by_user():
+    alice, bob, agent_a, agent_b = _seed()
+    fiscal = create_chat(alice, agent_a, title="Relatório fiscal")
+    add_message(fiscal, "user", "Preciso revisar a função de cálculo de impostos")
+    other = create_chat(alice, agent_a, title="Outro")
+    add_message(other, "user", "Receita de bolo de cenoura")
+    bob_chat = create_chat(bob, agent_b, title="Impostos do Bob")
+    add_message(bob_chat, "user", "impostos impostos")
+
+    found = search_chats(alice, "funcao calc")  # sem acento e por prefixo
+    assert [r["id"] for r in found["rows"]] == [fiscal]
+    assert "**função**" in found["rows"][0]["snippet"]
+
+    # Titulo e mensagem do mesmo chat viram um resultado so
+    assert search_chats(alice, "fiscal")["total"] == 1
+    assert [r["id"] for r in search_chats(bob, "impostos")["rows"]] == [bob_chat]
+    assert search_chats(alice, "impostos", agent_id=agent_b)["total"] == 0
+    assert search_chats(alice, '"')["rows"] == []
+
+
+def test_triggers_keep_index_in_sync():
+    alice, _bob, agent_a, _agent_b = _seed()
+    chat_id = create_chat(alice, agent_a, title="Planejamento")
+    add_message(chat_id, "user", "orçamento trimestral")
+
+    rename_chat(chat_id, alice, "Viagem")
+    assert search_chats(alice, "planejamento")["total"] == 0
+    assert search_chats(alice, "viagem")["total"] == 1
+
+    with transaction() as conn:
+        conn.execute("UPDATE chat_messages SET content = 'agenda' WHERE chat_id = ?", (chat_id,))
+    assert search_chats(alice, "orcamento")["total"] == 0
+    assert search_chats(alice, "agenda")["total"] == 1
+
+    delete_chat(chat_id, alice)
+    assert search_chats(alice, "agenda")["total"] == 0
+    assert search_chats(alice, "viagem")["total"] == 0
+
+
+def test_search_chats_paginates():
+    alice, _bob, agent_a, _agent_b = _seed()
+    for i in range(5):
+        add_message(create_chat(alice, agent_a, title=f"Chat {i}"), "user", "contrato de locação")
+
+    first = search_chats(alice, "contrato", page=1, page_size=2)
+    assert first["total"] == 5 and first["pages"] == 3 and len(first["rows"]) == 2
+    seen = {r["id"] for p in (1, 2, 3) for r in search_chats(alice, "contrato", page=p, page_size=2)["rows"]}
+    assert len(seen) == 5
+    assert search_chats(alice, "contrato", page=99, page_size=2)["page"] == 3
+
+
+def test_search_summaries_ignores_message_content():
+    alice, bob, agent_a, agent_b = _seed()
+    chat_a = create_chat(alice, agent_a, title="Dúvida")
+    add_message(chat_a, "user", "meu CPF é 123 e o salário é confidencial")
+    update_conversation_topic_summary(chat_a, alice, "Dúvida sobre folha de pagamento")
+    chat_b = create_chat(bob, agent_b, title="Folha")
+    update_conversation_topic_summary(chat_b, bob, "Cálculo de férias")
+
+    assert search_summaries("salario")["total"] == 0
+    assert search_summaries("Folha")["total"] == 1  # titulo do Bob nao conta
+
+    found = search_summaries("folha pagamento")
+    row = found["rows"].iloc[0]
+    assert row["Usuário"] == "alice@s.com" and row["Agente"] == "Agente A"
+    assert "**folha**" in row["Resumo"]
+    assert search_summaries("ferias")["rows"]["id"].tolist() == [chat_b]
+
+
+def test_migration_indexes_existing_history():
+    path = setup_temp_db()
+    alice = create_user("old@s.com", "pw123456", "USER", True)
+    agent_id = create_agent(alice, "Agente", "Desc", "gpt-4o-mini", 256, 0.7, "P")
+    chat_id = create_chat(alice, agent_id, title="Antigo")
+    add_message(chat_id, "user", "histórico legado")
+
+    raw = sqlite3.connect(path)
+    raw.executescript("DROP TABLE chat_messages_fts; DROP TABLE chats_fts;")
+    step = next(fn for version, _desc, fn in MIGRATIONS if version == 6)
+    step(raw.cursor())
+    raw.commit()
+    raw.close()
+
+    assert search_chats(alice, "legado")["total"] == 1
+    assert search_chats(alice, "antigo")["total"] == 1
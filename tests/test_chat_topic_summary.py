@@ -101,3 +101,33 @@ def test_add_message_persists_attachment_fields():
         assert row["attachment_filename"] == "meu_pdf.pdf"
     finally:
         conn.close()
+
+
+def test_generate_compliance_summary_incremental_sends_previous_summary_and_new_turn(monkeypatch: pytest.MonkeyPatch):
+    sent = {}
+
+    class _DummyResp:
+        output_text = "Configuração de agentes e histórico."
+
+    class _DummyResponses:
+        def create(self, **kwargs):
+            sent.update(kwargs)
+            return _DummyResp()
+
+    class _DummyClient:
+        responses = _DummyResponses()
+
+    monkeypatch.setattr(agents_service, "get_openai_client", lambda: _DummyClient())
+
+    summary = agents_service.generate_compliance_summary(
+        [{"role": "user", "content": "E como vejo o histórico?"}],
+        previous_summary="Configuração de agentes.",
+    )
+    assert summary == "Configuração de agentes e histórico."
+    assert "Resumo anterior: Configuração de agentes." in sent["input"]
+    assert "USER: E como vejo o histórico?" in sent["input"]
+
+    # sem mensagens novas, o resumo anterior e mantido sem chamar o modelo
+    sent.clear()
+    assert agents_service.generate_compliance_summary([], previous_summary="Tema X.") == "Tema X."
+    assert sent == {}
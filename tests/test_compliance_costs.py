@@ -0,0 +1,143 @@
+import os
+import tempfile
+
+import pandas as pd
+import pytest
+
+from src.core.db import init_db, transaction
+from src.repos.agents_repo import create_agent
+from src.repos.chat_repo import add_chat_test_message, add_message, create_chat
+from src.repos.compliance_repo import (
+    PRICING_TABLES,
+    estimate_costs,
+    get_compliance_data,
+    get_compliance_filter_options,
+    price_per_1k,
+    query_compliance,
+)
+from src.repos.users_repo import create_user
+
+
+def setup_temp_db():
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    os.environ["APP_DB_PATH"] = tmp.name
+    init_db()
+    return tmp.name
+
+
+def _legacy_cost(model, tokens):
+    # Estimativa linha a linha que o painel de Compliance usava antes.
+    modelo = str(model).lower()
+    if "gpt-4" in modelo:
+        custo_por_1k = 0.03
+    elif "gpt-3.5" in modelo:
+        custo_por_1k = 0.0015
+    elif "claude-3" in modelo:
+        custo_por_1k = 0.015
+    else:
+        custo_por_1k = 0.001
+    return (tokens / 1000) * custo_por_1k
+
+
+def test_v1_costs_match_legacy_row_wise_estimate():
+    models = pd.Series(["gpt-4o-mini", "GPT-3.5-turbo", "claude-3-opus", "—", None, "gpt-4o-mini"] * 50)
+    tokens = pd.Series([1200, 300, 0, 50, 10, 999] * 50)
+
+    costs = estimate_costs(models, tokens, version="v1")
+
+    expected = [_legacy_cost(m, t) for m, t in zip(models, tokens)]
+    assert costs.tolist() == pytest.approx(expected)
+
+
+def test_v2_splits_input_and_output_prices():
+    assert price_per_1k("gpt-4o-mini-2024-07-18", PRICING_TABLES["v2"]) == (0.00015, 0.0006)
+    assert price_per_1k("gpt-4o", PRICING_TABLES["v2"]) == (0.0025, 0.01)
+
+    costs = estimate_costs(pd.Series(["gpt-4o"]), pd.Series([1000]), version="v2", output_share=0.25)
+    assert costs.iloc[0] == pytest.approx(0.0025 * 0.75 + 0.01 * 0.25)
+
+    with pytest.raises(ValueError):
+        estimate_costs(pd.Series(["gpt-4o"]), pd.Series([1]), version="v99")
+
+
+def test_estimate_costs_handles_empty_frame():
+    assert estimate_costs(pd.Series([], dtype=object), pd.Series([], dtype=int)).empty
+
+
+def test_get_compliance_data_includes_cost_column():
+    setup_temp_db()
+    uid = create_user("cost@a.com", "pw123456", "USER", True)
+    agent_id = create_agent(uid, "Agent A", "Desc A", "gpt-4o-mini", 256, 0.7, "Prompt A")
+    chat_id = create_chat(uid, agent_id, title="Chat")
+    add_message(chat_id, "user", "oi", tokens=400)
+    add_message(chat_id, "assistant", "ola", tokens=600)
+
+    df = get_compliance_data()
+
+    row = df[df["Usuário"] == "cost@a.com"].iloc[0]
+    assert row["Tokens"] == 1000
+    assert row["Custo ($)"] == pytest.approx(_legacy_cost("gpt-4o-mini", 1000))
+    assert row["Categoria (IA)"] == "Geral"
+
+
+def _seed_audit():
+    setup_temp_db()
+    alice = create_user("alice@a.com", "pw123456", "USER", True)
+    bob = create_user("bob@a.com", "pw123456", "USER", True)
+    a1 = create_agent(alice, "Agente A", "Desc", "gpt-4o-mini", 256, 0.7, "P")
+    b1 = create_agent(bob, "Agente B", "Desc", "gpt-3.5-turbo", 256, 0.7, "P")
+    for i in range(7):
+        chat_id = create_chat(alice, a1, title=f"A{i}")
+        add_message(chat_id, "user", "oi", tokens=100 + i)
+        add_message(chat_id, "assistant", "ola", tokens=50, attachment_filename="doc.pdf" if i == 0 else None)
+    chat_b = create_chat(bob, b1, title="B")
+    add_message(chat_b, "user", "oi", tokens=10)
+    add_chat_test_message(bob, "user", "teste", agent_id=b1, tokens=30, model="gpt-3.5-turbo")
+    add_chat_test_message(bob, "assistant", "resp", agent_id=b1, tokens=99)
+    with transaction() as conn:
+        conn.execute("UPDATE chat_messages SET created_at = '2024-01-10 12:00:00' WHERE chat_id = ?", (chat_b,))
+    return alice, bob
+
+
+def test_query_compliance_filters_paginates_and_matches_in_memory_kpis():
+    _seed_audit()
+    full = get_compliance_data()
+
+    result = query_compliance(page=1, page_size=3)
+    assert result["total"] == len(full) == 9
+    assert result["pages"] == 3
+    assert len(result["rows"]) == 3
+    assert result["tokens"] == full["Tokens"].sum()
+    assert result["cost"] == pytest.approx(full["Custo ($)"].sum())
+    assert set(result["rows"].columns) >= {"Data/Hora", "Usuário", "Agente", "Tokens", "Custo ($)", "Origem"}
+
+    last = query_compliance(page=99, page_size=3)
+    assert last["page"] == 3 and len(last["rows"]) == 3
+    seen = pd.concat([query_compliance(page=p, page_size=3)["rows"] for p in (1, 2, 3)])
+    assert len(seen[["id", "Origem"]].drop_duplicates()) == 9
+
+    bob_tests = query_compliance(users=["bob@a.com"], origin="Teste")
+    assert bob_tests["total"] == 1 and bob_tests["tokens"] == 30
+
+    with_files = query_compliance(has_attachment=True)
+    assert with_files["total"] == 1 and bool(with_files["rows"]["Tem Anexo?"].iloc[0])
+
+    old = query_compliance(date_from="2024-01-01", date_to="2024-01-31")
+    assert old["total"] == 1 and old["rows"]["Usuário"].iloc[0] == "bob@a.com"
+    assert old["daily"]["Dia"].astype(str).tolist() == ["2024-01-10"]
+
+    by_tokens = query_compliance(agents=["Agente A"], sort="Tokens", descending=False)["rows"]
+    assert by_tokens["Tokens"].tolist() == sorted(by_tokens["Tokens"].tolist())
+
+    with pytest.raises(ValueError):
+        query_compliance(sort="content")
+
+
+def test_compliance_filter_options():
+    _seed_audit()
+
+    opts = get_compliance_filter_options()
+    assert opts["users"] == ["alice@a.com", "bob@a.com"]
+    assert opts["agents"] == ["Agente A", "Agente B"]
+    assert str(opts["min_date"]) == "2024-01-10"
+    assert get_compliance_filter_options(["alice@a.com"])["agents"] == ["Agente A"]
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from src.core import config
+
+
+@pytest.fixture
+def fresh_settings(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(config, "_secrets_dict", lambda: {})
+    config.clear_settings_cache()
+    yield
+    config.clear_settings_cache()
+
+
+def test_settings_are_memoised_and_typed(fresh_settings, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("OPENAI_TEMPERATURE", "0.25")
+    monkeypatch.setenv("OPENAI_MAX_OUTPUT_TOKENS", "512")
+    calls = []
+    build = config._build_values
+    monkeypatch.setattr(config, "_build_values", lambda secrets: calls.append(1) or build(secrets))
+
+    first = config.get_settings()
+    assert config.get_settings() is first
+    assert len(calls) == 1
+
+    assert first.openai_temperature == 0.25
+    assert first.openai_max_output_tokens == 512
+    assert first.get("OPENAI_TEMPERATURE") == "0.25"
+    assert dict(first)["OPENAI_MAX_OUTPUT_TOKENS"] == "512"
+    assert first.get_int("DB_POOL_SIZE") == int(first["DB_POOL_SIZE"])
+    assert first.get_bool("SUMMARY_INCREMENTAL", False) is (first["SUMMARY_INCREMENTAL"] == "true")
+
+
+def test_env_change_invalidates_cache(fresh_settings, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("OPENAI_MODEL", "gpt-4o-mini")
+    first = config.get_settings()
+
+    monkeypatch.setenv("OPENAI_MODEL", "gpt-4o")
+    assert config.get_settings() is first  # conferido no maximo 1x por intervalo
+
+    monkeypatch.setattr(config, "_next_file_check", 0.0)
+    second = config.get_settings()
+
+    assert second is not first
+    assert second.openai_model == "gpt-4o"
+
+
+def test_dotenv_file_change_reloads(fresh_settings, monkeypatch: pytest.MonkeyPatch, tmp_path):
+    dotenv = tmp_path / ".env"
+    dotenv.write_text("OPENAI_RPM=111\n", encoding="utf-8")
+    monkeypatch.setattr(config, "DOTENV_PATH", dotenv)
+    monkeypatch.setattr(config, "_WATCHED_FILES", (dotenv,))
+    monkeypatch.setattr(config, "_dotenv_loaded", {})
+    monkeypatch.delenv("OPENAI_RPM", raising=False)
+    monkeypatch.setenv("OPENAI_TPM", "999")  # exportada de verdade: o .env nao sobrescreve
+
+    config._load_dotenv_file()
+    assert config.get_settings()["OPENAI_RPM"] == "111"
+
+    dotenv.write_text("OPENAI_RPM=222\nOPENAI_TPM=1\n", encoding="utf-8")
+    os.utime(dotenv, ns=(1, 10**18))
+    monkeypatch.setattr(config, "_next_file_check", 0.0)
+
+    settings = config.get_settings()
+    assert settings["OPENAI_RPM"] == "222"
+    assert settings["OPENAI_TPM"] == "999"
+
+
+def test_override_settings_hook(fresh_settings):
+    with config.override_settings(OPENAI_TEMPERATURE=0.1, OPENAI_MODEL="modelo-teste") as settings:
+        assert settings.openai_temperature == 0.1
+        assert config.get_settings().openai_model == "modelo-teste"
+    assert config.get_settings().openai_model != "modelo-teste"
@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import tempfile
+import threading
+
+import pytest
+
+from src.core import db
+from src.core.db import get_connection, init_db, retry_on_busy
+from src.repos.users_repo import create_user
+from src.repos.agents_repo import create_agent
+from src.repos.chat_repo import add_message, create_chat, get_messages
+from src.repos.compliance_repo import get_compliance_data
+
+
+def setup_temp_db():
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    os.environ["APP_DB_PATH"] = tmp.name
+    init_db()
+    return tmp.name
+
+
+def test_performance_profile_is_applied_to_pooled_connections():
+    setup_temp_db()
+    with get_connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+        assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2  # MEMORY
+        assert conn.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+
+
+def test_profile_overrides_from_settings():
+    pragmas = db.get_db_profile({"DB_PROFILE": "performance", "DB_BUSY_TIMEOUT_MS": "250"})
+    assert pragmas["busy_timeout"] == "250"
+    assert pragmas["journal_mode"] == "WAL"
+    assert "journal_mode" not in db.get_db_profile({"DB_PROFILE": "default"})
+    with pytest.raises(ValueError):
+        db.get_db_profile({"DB_PROFILE": "turbo"})
+
+
+def test_concurrent_writers_and_readers_do_not_hit_locked_errors():
+    setup_temp_db()
+    uid = create_user("w@a.com", "pw123456", "USER", True)
+    agent_id = create_agent(uid, "Agent", None, "gpt-4o-mini", 256, 0.7, "Prompt")
+    chat_ids = [create_chat(uid, agent_id, title=f"Chat {i}") for i in range(4)]
+
+    writes_per_thread = 40
+    errors = []
+    stop = threading.Event()
+
+    def writer(chat_id):
+        try:
+            for i in range(writes_per_thread):
+                add_message(chat_id, "user", f"msg {i}", tokens=i)
+        except Exception as exc:  # pragma: no cover - falha do teste
+            errors.append(exc)
+
+    def reader(chat_id):
+        try:
+            while not stop.is_set():
+                get_messages(chat_id)
+                get_compliance_data()
+        except Exception as exc:  # pragma: no cover - falha do teste
+            errors.append(exc)
+
+    writers = [threading.Thread(target=writer, args=(c,)) for c in chat_ids]
+    readers = [threading.Thread(target=reader, args=(c,)) for c in chat_ids[:2]]
+    for t in readers + writers:
+        t.start()
+    for t in writers:
+        t.join()
+    stop.set()
+    for t in readers:
+        t.join()
+
+    assert errors == []
+    for chat_id in chat_ids:
+        assert len(get_messages(chat_id)) == writes_per_thread
+
+
+def test_retry_on_busy_retries_locked_errors(monkeypatch):
+    setup_temp_db()
+    monkeypatch.setattr(db.time, "sleep", lambda s: None)
+    calls = {"n": 0}
+
+    @retry_on_busy
+    def flaky():
+        calls["n"] += 1
+        if calls["n"] < 3:
+            raise sqlite3.OperationalError("database is locked")
+        return "ok"
+
+    assert flaky() == "ok"
+    assert calls["n"] == 3
+
+
+def test_retry_on_busy_does_not_retry_other_errors():
+    setup_temp_db()
+    calls = {"n": 0}
+
+    @retry_on_busy
+    def broken():
+        calls["n"] += 1
+        raise sqlite3.OperationalError("no such table: nope")
+
+    with pytest.raises(sqlite3.OperationalError):
+        broken()
+    assert calls["n"] == 1
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import threading
+
+import pytest
+
+from src.core.db import (
+    ConnectionPool,
+    PoolTimeoutError,
+    get_connection,
+    get_pool,
+    init_db,
+    transaction,
+)
+from src.repos.users_repo import create_user, get_user_by_email
+
+
+def setup_temp_db():
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    os.environ["APP_DB_PATH"] = tmp.name
+    init_db()
+    return tmp.name
+
+
+def test_repo_calls_reuse_pooled_connection():
+    setup_temp_db()
+    pool = get_pool()
+
+    create_user("pool@a.com", "pw123456", "USER", True)
+    with get_connection() as first:
+        pass
+    assert get_user_by_email("pool@a.com") is not None
+    with get_connection() as second:
+        pass
+
+    assert first is second
+    assert len(pool._idle) == 1
+
+
+def test_nested_transactions_share_connection_and_commit_once():
+    setup_temp_db()
+    with pytest.raises(RuntimeError):
+        with transaction() as outer:
+            with transaction() as inner:
+                assert inner is outer
+                inner.execute(
+                    "INSERT INTO users (email, password_hash, role) VALUES ('n@a.com', 'x', 'USER')"
+                )
+            # a transacao interna nao faz commit; o erro na externa desfaz tudo
+            assert outer.in_transaction is True
+            raise RuntimeError("boom")
+    assert get_user_by_email("n@a.com") is None
+
+
+def test_transaction_rolls_back_on_error():
+    setup_temp_db()
+    with pytest.raises(RuntimeError):
+        with transaction() as conn:
+            conn.execute(
+                "INSERT INTO users (email, password_hash, role) VALUES ('r@a.com', 'x', 'USER')"
+            )
+            raise RuntimeError("boom")
+    assert get_user_by_email("r@a.com") is None
+
+
+def test_pool_size_bounds_open_connections():
+    path = setup_temp_db()
+    pool = ConnectionPool(path, size=1, timeout=0.05)
+    held = pool.acquire()
+    errors = []
+
+    def other_thread():
+        try:
+            pool.acquire()
+        except PoolTimeoutError as exc:
+            errors.append(exc)
+
+    t = threading.Thread(target=other_thread)
+    t.start()
+    t.join()
+    pool.release(held)
+    pool.close()
+
+    assert len(errors) == 1
@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+from src.agents import documents
+from src.agents import service as agents_service
+from src.core.config import clear_settings_cache
+from src.core.db import get_connection, init_db
+from src.repos.documents_repo import _INSERT_BATCH, get_document, save_document, search_chunks
+
+
+def setup_temp_db():
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    os.environ["APP_DB_PATH"] = tmp.name
+    init_db()
+    return tmp.name
+
+
+PAGES = [
+    (1, "Contrato de prestação de serviços entre as partes. " * 20),
+    (2, ""),  # pagina sem texto
+    (3, "Cláusula de multa: atraso na entrega gera multa de dois por cento ao mês. " * 10),
+    (4, "Foro eleito para dirimir dúvidas é o da comarca da capital. " * 10),
+]
+
+
+@pytest.fixture
+def fake_pdf(monkeypatch: pytest.MonkeyPatch):
+    setup_temp_db()
+    extracted = []
+
+    def fake_pages(data):
+        extracted.append(data)
+        yield from PAGES
+
+    monkeypatch.setattr(documents, "pdf_text_available", lambda: True)
+    monkeypatch.setattr(documents, "iter_pdf_pages", fake_pages)
+    return extracted
+
+
+def _upload(data=b"%PDF-1.4 contrato"):
+    return SimpleNamespace(name="contrato.pdf", type="application/pdf", getvalue=lambda: data)
+
+
+def test_chunk_pages_overlaps_and_tracks_pages():
+    chunks = list(documents.chunk_pages(PAGES, size=300, overlap=50))
+
+    assert all(len(text) <= 300 for _page, text in chunks)
+    assert chunks[0][0] == 1 and chunks[-1][0] == 4
+    assert 3 in {page for page, _text in chunks}
+    # o fim de um chunk reaparece no comeco do seguinte
+    first, second = chunks[0][1], chunks[1][1]
+    assert second[:20] in first
+    total_words = sum(len(t.split()) for _p, t in PAGES)
+    assert sum(len(t.split()) for _p, t in chunks) >= total_words
+
+
+def test_ingest_is_keyed_by_content_hash(fake_pdf):
+    doc = documents.ingest_pdf(_upload())
+    again = documents.ingest_pdf(_upload())
+
+    assert doc == again
+    assert len(fake_pdf) == 1  # segunda vez nao extrai de novo
+    assert doc["pages"] == 4 and doc["chunks"] > 1
+    with get_connection() as conn:
+        stored = conn.execute("SELECT COUNT(*) FROM document_chunks WHERE doc_hash = ?", (doc["hash"],)).fetchone()[0]
+    assert stored == doc["chunks"]
+
+
+def test_extraction_does_not_hold_the_write_lock():
+    path = setup_temp_db()
+    seen = []
+
+    def slow_chunks():
+        for idx in range(_INSERT_BATCH * 2 + 1):
+            if idx in (0, _INSERT_BATCH + 1):
+                # No meio da extracao outro processo consegue escrever e nao ve documento pela metade
+                other = sqlite3.connect(path, timeout=0)
+                try:
+                    other.execute("BEGIN IMMEDIATE")
+                    other.rollback()
+                finally:
+                    other.close()
+                seen.append(get_document("hash-lento"))
+            yield idx // 10 + 1, f"trecho {idx}"
+
+    doc = save_document("hash-lento", "lento.pdf", 10, slow_chunks())
+
+    assert seen == [None, None]
+    assert doc["chunks"] == _INSERT_BATCH * 2 + 1 and doc["pages"] == (_INSERT_BATCH * 2) // 10 + 1
+
+
+def test_only_relevant_chunks_are_sent(fake_pdf, monkeypatch: pytest.MonkeyPatch):
+    files = []
+    monkeypatch.setattr(agents_service, "upload_pdf", lambda f: files.append(f) or "file_1")
+    monkeypatch.setenv("DOC_CHUNK_CHARS", "300")
+    monkeypatch.setenv("DOC_CONTEXT_CHUNKS", "2")
+    clear_settings_cache()
+
+    attachment = agents_service.attach_pdf(_upload(), "Qual a multa por atraso?")
+
+    assert attachment["file_id"] is None and files == []
+    text = attachment["document_text"]
+    assert "multa" in text and "[p. 3]" in text
+    assert "comarca" not in text and "Contrato" not in text
+
+    payload = agents_service._build_agent_payload({"model": "gpt-4o-mini"}, "Qual a multa?", **attachment)
+    content = payload["input"][0]["content"]
+    assert [c["type"] for c in content] == ["input_text", "input_text"]
+    assert content[1]["text"] == "Qual a multa?"
+
+    doc = documents.ingest_pdf(_upload())
+    assert [c["idx"] for c in search_chunks(doc["hash"], "??", limit=2)] == [0, 1]
+
+
+def test_falls_back_to_upload_without_text(monkeypatch: pytest.MonkeyPatch):
+    setup_temp_db()
+    monkeypatch.setattr(agents_service, "upload_pdf", lambda f: "file_1")
+
+    monkeypatch.setattr(documents, "pdf_text_available", lambda: False)
+    assert agents_service.attach_pdf(_upload(), "oi") == {"file_id": "file_1", "document_text": None}
+
+    # PDF escaneado: nenhuma pagina com texto
+    monkeypatch.setattr(documents, "pdf_text_available", lambda: True)
+    monkeypatch.setattr(documents, "iter_pdf_pages", lambda data: iter([(1, ""), (2, "  ")]))
+    assert agents_service.attach_pdf(_upload(b"%PDF scan"), "oi") == {"file_id": "file_1", "document_text": None}
+
+    # PDF corrompido/cifrado: erro do pypdf vira upload, nao falha do turno
+    def broken(data):
+        raise ValueError("EOF marker not found")
+        yield
+
+    monkeypatch.setattr(documents, "iter_pdf_pages", broken)
+    assert agents_service.attach_pdf(_upload(b"%PDF quebrado"), "oi") == {"file_id": "file_1", "document_text": None}
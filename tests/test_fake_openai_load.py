@@ -0,0 +1,73 @@
+import os
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+from scripts.fake_openai_server import FakeServerConfig, start_fake_server
+from scripts.load_test import percentile, run_load_test
+from src.agents import service as agents_service
+from src.agents.embeddings import OpenAIEmbedder
+from src.core.config import clear_settings_cache
+from src.core.db import init_db
+from src.openai import client as openai_client
+from src.openai import rate_limit
+
+
+@pytest.fixture
+def fake_api(monkeypatch: pytest.MonkeyPatch):
+    server, base_url = start_fake_server(config=FakeServerConfig(latency=0.01, output_tokens=8, chunk_delay=0))
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-fake")
+    monkeypatch.setenv("OPENAI_BASE_URL", base_url)
+    clear_settings_cache()
+    monkeypatch.setattr(openai_client, "_client", None)
+    rate_limit.reset_rate_limiter()
+    yield base_url
+    server.shutdown()
+    rate_limit.reset_rate_limiter()
+
+
+AGENT = {"model": "gpt-4o-mini", "temperature": 0.3, "max_tokens": 64, "system_prompt": "Seja breve."}
+
+
+def test_sdk_client_talks_to_fake_server(fake_api):
+    os.environ["APP_DB_PATH"] = tempfile.NamedTemporaryFile(delete=False).name
+    init_db()
+    text, resp_id, usage = agents_service.run_agent_chat(AGENT, "oi")
+    assert len(text.split()) == 8
+    assert resp_id.startswith("resp_fake")
+    assert usage["output_tokens"] == 8
+
+    stream = agents_service.stream_agent_chat(AGENT, "oi")
+    assert "".join(stream) == stream.text
+    assert len(stream.text.split()) == 8
+    assert stream.usage["total_tokens"] == usage["total_tokens"]
+
+    upload = SimpleNamespace(name="a.pdf", type="application/pdf", getvalue=lambda: b"%PDF-1.4")
+    file_id = agents_service.upload_pdf(upload)
+    assert file_id.startswith("file-fake")
+    assert agents_service.upload_pdf(upload) == file_id  # cache por conteudo
+    assert openai_client.get_openai_client().files.delete(file_id).deleted
+
+    vectors = OpenAIEmbedder(batch_size=2).embed(["a", "b", "a"])
+    assert vectors.shape == (3, 16) and (vectors[0] == vectors[2]).all()
+
+
+def test_load_test_reports_percentiles_and_db_waits(fake_api):
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    os.environ["APP_DB_PATH"] = tmp.name
+
+    report = run_load_test(users=3, turns=2)
+
+    assert report["failed_sessions"] == 0
+    ops = report["operations"]
+    assert ops["run_agent_chat"]["count"] == 6
+    assert ops["add_message"]["count"] == 12
+    assert ops["turn"]["p50"] <= ops["turn"]["p95"] <= ops["turn"]["p99"]
+    assert set(report["db_waits"]) == {"pool_waits", "pool_wait_s", "busy_retries", "busy_wait_s"}
+
+
+def test_percentile_interpolates():
+    assert percentile([], 95) == 0.0
+    assert percentile([1, 2, 3, 4], 50) == pytest.approx(2.5)
+    assert percentile([1, 2, 3, 4], 100) == 4
@@ -0,0 +1,49 @@
+import os
+import tempfile
+
+from src.core.db import init_db
+from src.repos.agents_repo import create_agent
+from src.repos.chat_repo import add_message, create_chat, get_message_page, get_messages
+from src.repos.users_repo import create_user
+
+
+def setup_temp_db():
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    os.environ["APP_DB_PATH"] = tmp.name
+    init_db()
+    return tmp.name
+
+
+def _chat_with_messages(n):
+    setup_temp_db()
+    uid = create_user("page@a.com", "pw123456", "USER", True)
+    agent_id = create_agent(uid, "Agent", "Desc", "gpt-4o-mini", 256, 0.7, "Prompt")
+    chat_id = create_chat(uid, agent_id)
+    for i in range(n):
+        add_message(chat_id, "user" if i % 2 == 0 else "assistant", f"msg {i}")
+    return chat_id
+
+
+def test_keyset_pages_walk_history_backwards():
+    chat_id = _chat_with_messages(7)
+
+    page = get_message_page(chat_id, limit=3)
+    assert [m["content"] for m in page["messages"]] == ["msg 4", "msg 5", "msg 6"]
+    assert page["has_older"]
+
+    page = get_message_page(chat_id, before_id=page["messages"][0]["id"], limit=3)
+    assert [m["content"] for m in page["messages"]] == ["msg 1", "msg 2", "msg 3"]
+    assert page["has_older"]
+
+    page = get_message_page(chat_id, before_id=page["messages"][0]["id"], limit=3)
+    assert [m["content"] for m in page["messages"]] == ["msg 0"]
+    assert not page["has_older"]
+
+
+def test_get_messages_without_limit_returns_everything_in_order():
+    chat_id = _chat_with_messages(4)
+
+    full = get_messages(chat_id)
+    assert [m["content"] for m in full] == ["msg 0", "msg 1", "msg 2", "msg 3"]
+    assert get_messages(chat_id, limit=2) == full[-2:]
+    assert get_message_page(chat_id, limit=4) == {"messages": full, "has_older": False}
@@ -0,0 +1,87 @@
+import os
+import sqlite3
+import tempfile
+
+from src.core import db
+from src.core.db import get_connection, init_db
+from src.core.migrations import LATEST_VERSION, MIGRATIONS, get_schema_version, migrate
+
+
+def new_db_path():
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    os.environ["APP_DB_PATH"] = tmp.name
+    return tmp.name
+
+
+def test_init_db_sets_user_version_and_runs_once_per_process(monkeypatch):
+    new_db_path()
+    init_db()
+    with get_connection() as conn:
+        assert get_schema_version(conn) == LATEST_VERSION
+
+    # chamadas seguintes nao tocam no banco
+    def _fail():
+        raise AssertionError("init_db nao deveria abrir conexao de novo")
+
+    monkeypatch.setattr(db, "get_connection", _fail)
+    init_db()
+
+
+def test_migrate_upgrades_legacy_database_without_user_version():
+    path = new_db_path()
+    legacy = sqlite3.connect(path)
+    legacy.executescript(
+        """
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT NOT NULL UNIQUE,
+            password_hash TEXT NOT NULL,
+            role TEXT NOT NULL,
+            active INTEGER NOT NULL DEFAULT 1,
+            created_at TEXT NOT NULL DEFAULT (datetime('now')),
+            updated_at TEXT NOT NULL DEFAULT (datetime('now'))
+        );
+        CREATE TABLE agents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            model TEXT NOT NULL,
+            instructions TEXT
+        );
+        INSERT INTO users (email, password_hash, role) VALUES ('old@a.com', 'x', 'USER');
+        INSERT INTO agents (user_id, name, model, instructions) VALUES (1, 'Old', 'gpt-4o', 'Seja breve.');
+        """
+    )
+    legacy.commit()
+    legacy.close()
+
+    init_db()
+
+    with get_connection() as conn:
+        assert get_schema_version(conn) == LATEST_VERSION
+        agent = conn.execute("SELECT system_prompt, max_tokens FROM agents").fetchone()
+        assert agent["system_prompt"] == "Seja breve."
+        assert agent["max_tokens"] == 1024
+        assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 1
+
+
+def test_migrate_is_noop_when_current():
+    new_db_path()
+    init_db()
+    with get_connection() as conn:
+        assert migrate(conn) == LATEST_VERSION
+        assert conn.in_transaction is False
+
+
+def test_steps_do_not_commit_inside_the_migration_transaction():
+    conn = sqlite3.connect(new_db_path())
+    try:
+        for version, _description, step in MIGRATIONS:
+            conn.execute("BEGIN IMMEDIATE")
+            step(conn.cursor())
+            # executescript faria COMMIT aqui e o passo deixaria de ser atomico
+            assert conn.in_transaction, f"migracao {version} encerrou a transacao"
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+    finally:
+        conn.close()
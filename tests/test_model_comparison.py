@@ -0,0 +1,73 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.agents import service as agents_service
+from src.core.config import clear_settings_cache
+
+
+class SlowResponses:
+    """responses.create de mentira: demora, conta chamadas simultaneas e falha para um modelo."""
+
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.active = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def create(self, **kwargs):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(self.delay)
+            if kwargs["model"] == "quebrado":
+                raise RuntimeError("modelo indisponivel")
+            usage = SimpleNamespace(input_tokens=1000, output_tokens=500, total_tokens=1500)
+            return SimpleNamespace(output_text=f"{kwargs['model']}@{kwargs['temperature']}", id="resp", usage=usage)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+@pytest.fixture
+def responses(monkeypatch: pytest.MonkeyPatch):
+    fake = SlowResponses()
+    monkeypatch.setattr(agents_service, "get_openai_client", lambda: SimpleNamespace(responses=fake))
+    monkeypatch.setenv("COMPLIANCE_PRICING_VERSION", "v2")
+    clear_settings_cache()
+    yield fake
+    clear_settings_cache()
+
+
+def test_variants_run_concurrently_in_order(responses):
+    variants = [
+        {"model": "gpt-4o", "temperature": 0.2},
+        {"model": "gpt-4o-mini", "temperature": 0.7},
+        {"model": "quebrado", "temperature": 0.5},
+    ]
+
+    started = time.perf_counter()
+    results = agents_service.compare_agent_models({"model": "gpt-4o", "system_prompt": "P"}, "oi", variants, max_workers=3)
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < 0.2 * len(variants) * 0.8
+    assert responses.peak == 3
+    assert [r["text"] for r in results] == ["gpt-4o@0.2", "gpt-4o-mini@0.7", ""]
+    assert results[0]["cost"] == pytest.approx(1 * 0.0025 + 0.5 * 0.01)
+    assert results[1]["usage"]["output_tokens"] == 500 and results[1]["latency"] >= 0.2
+    assert results[2]["error"] == "modelo indisponivel" and results[2]["cost"] == 0
+
+
+def test_pool_is_bounded(responses, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("COMPARE_MAX_WORKERS", "2")
+    clear_settings_cache()
+    variants = [{"model": "gpt-4o-mini", "temperature": t} for t in (0.0, 0.2, 0.5, 0.7, 1.0)]
+
+    results = agents_service.compare_agent_models({"model": "gpt-4o"}, "oi", variants)
+
+    assert responses.peak == 2
+    assert [r["temperature"] for r in results] == [0.0, 0.2, 0.5, 0.7, 1.0]
+    assert agents_service.compare_agent_models({"model": "gpt-4o"}, "oi", []) == []
@@ -0,0 +1,85 @@
+import os
+import tempfile
+
+from src.core.db import get_connection, init_db
+from src.repos.users_repo import create_user, get_user_by_email
+from src.repos.agents_repo import create_agent, list_agents_by_user, get_agent, delete_agent
+from src.repos.chat_repo import (
+    add_message,
+    create_chat,
+    delete_chat,
+    get_chat,
+    get_message_page,
+    get_messages,
+    list_chats,
+)
+from src.repos.threads_repo import get_thread_by_agent
+from src.repos.compliance_repo import get_compliance_data
+
+
+def setup_temp_db():
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    os.environ["APP_DB_PATH"] = tmp.name
+    init_db()
+    return tmp.name
+
+
+# Relatorio do Compliance lista todos os chats: percorrer `chats` inteira e esperado,
+# mas as mensagens precisam ser buscadas pelo indice.
+ALLOWED_SCANS = {"SCAN c"}
+
+
+def _traced_statements(fn, *args):
+    """Executa a funcao do repo capturando o SQL (ja com parametros) que ela roda."""
+    statements = []
+    with get_connection() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            fn(*args)
+        finally:
+            conn.set_trace_callback(None)
+    return [
+        s for s in statements
+        if s.lstrip().upper().startswith(("SELECT", "DELETE", "UPDATE"))
+    ]
+
+
+def _plan(sql):
+    with get_connection() as conn:
+        return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+
+
+def test_hot_queries_use_indexes():
+    setup_temp_db()
+    uid = create_user("plan@a.com", "pw123456", "USER", True)
+    agent_id = create_agent(uid, "Agent", None, "gpt-4o-mini", 256, 0.7, "Prompt")
+    chat_id = create_chat(uid, agent_id, title="Chat")
+    add_message(chat_id, "user", "oi", tokens=3)
+
+    hot_calls = [
+        (get_messages, chat_id),
+        (get_message_page, chat_id, 10**9, 30),
+        (list_chats, uid, agent_id),
+        (get_chat, chat_id, uid),
+        (list_agents_by_user, uid),
+        (get_agent, agent_id, uid),
+        (get_user_by_email, "plan@a.com"),
+        (get_thread_by_agent, uid, agent_id),
+        (get_compliance_data,),
+        (delete_chat, chat_id, uid),
+        (delete_agent, agent_id, uid),
+    ]
+
+    offenders = {}
+    for fn, *args in hot_calls:
+        statements = _traced_statements(fn, *args)
+        assert statements, f"{fn.__name__} nao executou SQL"
+        for sql in statements:
+            scans = [
+                step for step in _plan(sql)
+                if step.startswith("SCAN") and step not in ALLOWED_SCANS
+            ]
+            if scans:
+                offenders.setdefault(fn.__name__, []).extend(scans)
+
+    assert offenders == {}
@@ -0,0 +1,125 @@
+import os
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from src.agents import documents, vector_store
+from src.agents import service as agents_service
+from src.agents.embeddings import HashingEmbedder, set_embedder
+from src.core.config import clear_settings_cache
+from src.core.db import init_db
+from src.repos.documents_repo import delete_document, get_vector_index
+
+
+def setup_temp_db():
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    os.environ["APP_DB_PATH"] = tmp.name
+    init_db()
+    return tmp.name
+
+
+TOPICS = [
+    "Politica de ferias: o colaborador tem direito a trinta dias de descanso remunerado por ano.",
+    "Reembolso de despesas de viagem exige nota fiscal e aprovacao do gestor imediato.",
+    "Seguranca da informacao: senhas devem ser trocadas a cada noventa dias e nunca compartilhadas.",
+    "Multa contratual por atraso na entrega corresponde a dois por cento do valor ao mes.",
+    "Home office permitido tres dias por semana mediante acordo com a lideranca da area.",
+]
+
+
+class CountingEmbedder(HashingEmbedder):
+    def __init__(self, dim=128):
+        super().__init__(dim)
+        self.calls = 0
+
+    def embed(self, texts):
+        self.calls += 1
+        return super().embed(texts)
+
+
+class BrokenEmbedder:
+    name = "broken"
+
+    def embed(self, texts):
+        raise RuntimeError("sem rede")
+
+
+@pytest.fixture
+def doc(monkeypatch: pytest.MonkeyPatch):
+    setup_temp_db()
+    # Um topico por pagina e chunks pequenos: um chunk por topico.
+    monkeypatch.setenv("DOC_CHUNK_CHARS", "100")
+    monkeypatch.setenv("DOC_CHUNK_OVERLAP", "0")
+    clear_settings_cache()
+    monkeypatch.setattr(documents, "pdf_text_available", lambda: True)
+    monkeypatch.setattr(documents, "iter_pdf_pages", lambda data: iter(enumerate(TOPICS, start=1)))
+    upload = SimpleNamespace(name="politicas.pdf", type="application/pdf", getvalue=lambda: b"%PDF politicas")
+    record = documents.ingest_pdf(upload)
+    assert record["chunks"] == len(TOPICS)
+    return record
+
+
+def test_hashing_embedder_is_deterministic():
+    emb = HashingEmbedder(64)
+    a, b = emb.embed(["Férias anuais"]), emb.embed(["ferias ANUAIS"])
+    assert a.dtype == np.float32 and a.shape == (1, 64)
+    assert np.array_equal(a, b)
+
+
+def test_top_k_uses_memmapped_index_built_once(doc):
+    embedder = CountingEmbedder()
+
+    best = vector_store.top_k(doc, "qual a multa por atraso na entrega?", 2, embedder)
+    assert best[0] == 3
+    calls_after_build = embedder.calls
+
+    assert vector_store.top_k(doc, "trocar senhas", 1, embedder) == [2]
+    assert embedder.calls == calls_after_build + 1  # so a pergunta, o indice ja existe
+
+    index = get_vector_index(doc["hash"], embedder.name)
+    assert (index["rows"], index["dim"]) == (len(TOPICS), 128)
+    matrix = np.memmap(index["path"], dtype=np.float32, mode="r", shape=(index["rows"], index["dim"]))
+    assert np.allclose(np.linalg.norm(matrix, axis=1), 1.0, atol=1e-5)
+    assert Path(index["path"]).parent == vector_store.index_dir()
+
+    # Outro embedder = outro espaco vetorial = outro indice
+    other = HashingEmbedder(32)
+    assert vector_store.top_k(doc, "ferias", 1, other) == [0]
+    assert get_vector_index(doc["hash"], other.name)["dim"] == 32
+
+    for path in delete_document(doc["hash"]):
+        os.remove(path)
+    assert get_vector_index(doc["hash"], embedder.name) is None
+
+
+def test_agent_receives_only_top_k_chunks(doc, monkeypatch: pytest.MonkeyPatch):
+    set_embedder(HashingEmbedder(128))
+    monkeypatch.setenv("DOC_CONTEXT_CHUNKS", "1")
+    clear_settings_cache()
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        return SimpleNamespace(output_text="ok", id="resp_1", usage=None)
+
+    monkeypatch.setattr(agents_service, "get_openai_client", lambda: SimpleNamespace(responses=SimpleNamespace(create=create)))
+    upload = SimpleNamespace(name="politicas.pdf", type="application/pdf", getvalue=lambda: b"%PDF politicas")
+
+    question = "Como funciona o reembolso de despesas de viagem?"
+    attachment = agents_service.attach_pdf(upload, question)
+    agents_service.run_agent_chat({"model": "gpt-4o-mini"}, question, **attachment)
+
+    context = calls[0]["input"][0]["content"][0]["text"]
+    assert "Reembolso de despesas" in context and "[p. 2]" in context
+    assert all(topic not in context for i, topic in enumerate(TOPICS) if i != 1)
+
+
+def test_embedder_failure_falls_back_to_lexical_search(doc):
+    set_embedder(BrokenEmbedder())
+
+    chunks = documents.relevant_chunks(doc, "senhas", 1)
+
+    assert [c["idx"] for c in chunks] == [2]
@@ -0,0 +1,153 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from src.core.config import clear_settings_cache
+from src.openai import rate_limit
+
+
+def _status_error(cls, status, headers=None, body=None):
+    response = httpx.Response(status, headers=headers or {}, request=httpx.Request("POST", "https://api.test/v1/responses"))
+    return cls("erro", response=response, body=body)
+
+
+@pytest.fixture
+def sleeps(monkeypatch: pytest.MonkeyPatch):
+    calls = []
+    monkeypatch.setattr(rate_limit, "_sleep", calls.append)
+
+    async def fake_asleep(seconds):
+        calls.append(seconds)
+
+    monkeypatch.setattr(rate_limit, "_asleep", fake_asleep)
+    return calls
+
+
+def test_token_bucket_queues_requests_beyond_capacity():
+    bucket = rate_limit.TokenBucket(per_minute=60)  # 1 por segundo
+
+    waits = [bucket.reserve(20) for _ in range(4)]
+
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert waits[3] == pytest.approx(20.0, abs=0.1)
+
+
+def test_limiter_throttles_per_model_from_settings(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("OPENAI_RPM", "2")
+    monkeypatch.setenv("OPENAI_MODEL_LIMITS", "gpt-4o=1/0")
+    clear_settings_cache()
+    rate_limit.reset_rate_limiter()
+    try:
+        limiter = rate_limit.get_rate_limiter()
+        assert limiter is rate_limit.get_rate_limiter()
+
+        assert limiter.reserve("gpt-4o") == 0.0
+        assert limiter.reserve("gpt-4o") > 0  # 1 rpm para gpt-4o
+        assert limiter.reserve("gpt-4o-mini") == 0.0
+        assert limiter.reserve("gpt-4o-mini") == 0.0
+        assert limiter.reserve("gpt-4o-mini") > 0
+    finally:
+        rate_limit.reset_rate_limiter()
+
+
+def test_retry_honours_retry_after_then_succeeds(sleeps):
+    limiter = rate_limit.RateLimiter(rpm=0, tpm=0, max_retries=3, base_delay=0.01, max_delay=10)
+    errors = [
+        _status_error(openai.RateLimitError, 429, {"retry-after": "2"}),
+        _status_error(openai.InternalServerError, 503),
+    ]
+
+    def create(**kwargs):
+        if errors:
+            raise errors.pop(0)
+        return SimpleNamespace(id="resp_1")
+
+    assert limiter.call(create, "responses", model="gpt-4o", input="oi").id == "resp_1"
+    assert sleeps[0] == pytest.approx(2.0)
+    assert len(sleeps) == 2 and sleeps[1] < 1
+
+
+def test_non_retryable_errors_and_exhausted_retries_raise(sleeps):
+    limiter = rate_limit.RateLimiter(rpm=0, tpm=0, max_retries=2, base_delay=0.01)
+
+    def bad_request(**kwargs):
+        raise _status_error(openai.BadRequestError, 400)
+
+    with pytest.raises(openai.BadRequestError):
+        limiter.call(bad_request, "responses", model="gpt-4o")
+    assert sleeps == []
+
+    def no_quota(**kwargs):
+        raise _status_error(openai.RateLimitError, 429, body={"code": "insufficient_quota"})
+
+    with pytest.raises(openai.RateLimitError):
+        limiter.call(no_quota, "responses", model="gpt-4o")
+    assert sleeps == []
+
+    calls = []
+
+    def always_busy(**kwargs):
+        calls.append(1)
+        raise _status_error(openai.RateLimitError, 429)
+
+    with pytest.raises(openai.RateLimitError):
+        limiter.call(always_busy, "responses", model="gpt-4o")
+    assert len(calls) == 3
+
+
+def test_install_wraps_async_client_and_settles_real_usage(sleeps, monkeypatch: pytest.MonkeyPatch):
+    limiter = rate_limit.RateLimiter(rpm=100, tpm=1000, max_retries=1, base_delay=0.01)
+    monkeypatch.setattr(rate_limit, "get_rate_limiter", lambda: limiter)
+    attempts = []
+
+    async def create(**kwargs):
+        attempts.append(kwargs)
+        if len(attempts) == 1:
+            raise openai.APIConnectionError(request=httpx.Request("POST", "https://api.test"))
+        return SimpleNamespace(id="resp_1", usage=SimpleNamespace(total_tokens=10))
+
+    async def upload(**kwargs):
+        return SimpleNamespace(id="file_1")
+
+    client = SimpleNamespace(responses=SimpleNamespace(create=create), files=SimpleNamespace(create=upload))
+    rate_limit.install_rate_limits(client, is_async=True)
+
+    response = asyncio.run(client.responses.create(model="gpt-4o", input="x" * 400, max_output_tokens=100))
+    assert response.id == "resp_1"
+    assert len(attempts) == 2 and len(sleeps) == 1
+    assert asyncio.run(client.files.create(file=("a.pdf", b"%PDF", "application/pdf"))).id == "file_1"
+
+    _, tokens = limiter._buckets_for("gpt-4o")
+    # A tentativa que falhou devolveu a reserva; a bem-sucedida foi trocada pelo uso real (10).
+    assert tokens.tokens == pytest.approx(1000 - 10, abs=1)
+    assert limiter._buckets_for(rate_limit.FILES_KEY)[1] is None
+
+
+def test_streaming_reservation_is_settled_from_completed_event(sleeps):
+    limiter = rate_limit.RateLimiter(rpm=0, tpm=1000)
+    events = [
+        SimpleNamespace(type="response.output_text.delta", delta="ola"),
+        SimpleNamespace(type="response.completed", response=SimpleNamespace(usage=SimpleNamespace(total_tokens=30))),
+    ]
+    _, tokens = limiter._buckets_for("gpt-4o")
+
+    stream = limiter.call(lambda **kwargs: iter(events), "responses", model="gpt-4o", input="x" * 400, stream=True)
+    assert tokens.tokens == pytest.approx(1000 - 100, abs=1)  # so a estimativa ate o fim do stream
+    assert [e.type for e in stream] == ["response.output_text.delta", "response.completed"]
+    assert tokens.tokens == pytest.approx(1000 - 30, abs=1)
+
+    async def acreate(**kwargs):
+        async def agen():
+            for event in events:
+                yield event
+
+        return agen()
+
+    async def consume():
+        return [e.type async for e in await limiter.acall(acreate, "responses", model="gpt-4o", input="x" * 400, stream=True)]
+
+    assert asyncio.run(consume())[-1] == "response.completed"
+    assert tokens.tokens == pytest.approx(1000 - 60, abs=1)
@@ -0,0 +1,124 @@
+import os
+import tempfile
+
+import pytest
+
+from src.agents import service as agents_service
+from src.core.config import clear_settings_cache
+from src.core.db import get_connection, init_db
+from src.repos import response_cache_repo
+from src.repos.agents_repo import create_agent, update_agent
+from src.repos.attachments_repo import save_cached_file
+from src.repos.chat_repo import record_test_turn
+from src.repos.usage_repo import get_usage_kpis
+from src.repos.users_repo import create_user
+
+
+def setup_temp_db():
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    os.environ["APP_DB_PATH"] = tmp.name
+    init_db()
+    return tmp.name
+
+
+AGENT = {"model": "gpt-4o-mini", "system_prompt": "Seja breve.", "temperature": 0.2, "max_tokens": 200}
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    setup_temp_db()
+    response_cache_repo._memory.clear()
+    yield
+    response_cache_repo._memory.clear()
+    clear_settings_cache()
+
+
+def _db_rows():
+    with get_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()[0]
+
+
+def test_key_covers_config_input_and_file():
+    key = agents_service.response_cache_key(AGENT, "Qual o prazo?")
+
+    assert key == agents_service.response_cache_key(dict(AGENT), "Qual o prazo?")
+    variants = [
+        agents_service.response_cache_key({**AGENT, "system_prompt": "Seja formal."}, "Qual o prazo?"),
+        agents_service.response_cache_key({**AGENT, "temperature": 0.9}, "Qual o prazo?"),
+        agents_service.response_cache_key({**AGENT, "max_tokens": 300}, "Qual o prazo?"),
+        agents_service.response_cache_key({**AGENT, "model": "gpt-4o"}, "Qual o prazo?"),
+        agents_service.response_cache_key(AGENT, "Qual o valor?"),
+        agents_service.response_cache_key(AGENT, "Qual o prazo?", document_text="[p. 1] trecho"),
+    ]
+    assert len({key, *variants}) == len(variants) + 1
+
+    # O arquivo entra pelo hash do conteudo, nao pelo id remoto
+    save_cached_file("hash-a", "file-a", 10, 1, 3600)
+    with_file = agents_service.response_cache_key(AGENT, "Qual o prazo?", file_id="file-a")
+    save_cached_file("hash-a", "file-reenviado", 10, 1, 3600)
+    assert agents_service.response_cache_key(AGENT, "Qual o prazo?", file_id="file-reenviado") == with_file
+
+
+def test_key_is_scoped_to_user_and_agent():
+    key = agents_service.response_cache_key(AGENT, "Qual o prazo?", user_id=1, agent_id=7)
+
+    assert key == agents_service.response_cache_key(AGENT, "Qual o prazo?", user_id=1, agent_id=7)
+    assert key != agents_service.response_cache_key(AGENT, "Qual o prazo?", user_id=2, agent_id=7)
+    assert key != agents_service.response_cache_key(AGENT, "Qual o prazo?", user_id=1, agent_id=None)
+
+    agents_service.save_cached_reply(key, "ok", "resp_1", "gpt-4o-mini", agent_id=7, user_id=1)
+    other = agents_service.response_cache_key(AGENT, "Qual o prazo?", user_id=2, agent_id=7)
+    assert agents_service.get_cached_reply(other) is None
+    with get_connection() as conn:
+        row = conn.execute("SELECT user_id, agent_id FROM response_cache WHERE key = ?", (key,)).fetchone()
+    assert tuple(row) == (1, 7)
+
+
+def test_memory_lru_in_front_of_sqlite_with_ttl(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("RESPONSE_CACHE_MAX_ENTRIES", "2")
+    clear_settings_cache()
+
+    for i in range(3):
+        agents_service.save_cached_reply(f"k{i}", f"resposta {i}", f"resp_{i}", "gpt-4o-mini")
+    assert len(response_cache_repo._memory) == 2 and _db_rows() == 3
+
+    # k0 saiu da memoria: vem do banco e volta para o LRU
+    assert agents_service.get_cached_reply("k0")["output_text"] == "resposta 0"
+    statements = []
+    with get_connection() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            hit = agents_service.get_cached_reply("k0")
+        finally:
+            conn.set_trace_callback(None)
+    assert hit == {"output_text": "resposta 0", "response_id": "resp_0", "model": "gpt-4o-mini"}
+    assert statements == []
+
+    response_cache_repo.save_response("velha", "x", "resp_x", "gpt-4o-mini", ttl_seconds=0)
+    assert agents_service.get_cached_reply("velha") is None
+    assert agents_service.get_cached_reply("nunca") is None
+
+
+def test_update_agent_invalidates_its_responses():
+    uid = create_user("cache@a.com", "pw123456", "USER", True)
+    agent_id = create_agent(uid, "Agente", "Desc", "gpt-4o-mini", 200, 0.2, "Seja breve.")
+    agents_service.save_cached_reply("do-agente", "ok", "resp_1", "gpt-4o-mini", agent_id=agent_id)
+    agents_service.save_cached_reply("rascunho", "ok", "resp_2", "gpt-4o-mini")
+
+    update_agent(agent_id, uid)  # nada mudou
+    assert agents_service.get_cached_reply("do-agente") is not None
+
+    update_agent(agent_id, uid, system_prompt="Seja formal.")
+    assert agents_service.get_cached_reply("do-agente") is None
+    response_cache_repo._memory.clear()
+    assert agents_service.get_cached_reply("do-agente") is None
+    assert agents_service.get_cached_reply("rascunho") is not None
+
+
+def test_cache_hit_is_audited_with_zero_tokens():
+    uid = create_user("hit@a.com", "pw123456", "USER", True)
+    record_test_turn(uid, "oi", "ola", input_tokens=30, output_tokens=10, model="gpt-4o-mini", agent_name="Rascunho")
+    record_test_turn(uid, "oi", "ola", input_tokens=0, output_tokens=0, model="gpt-4o-mini", agent_name="Rascunho")
+
+    kpis = get_usage_kpis(origin="Teste")
+    assert kpis["messages"] == 2 and kpis["tokens"] == 30
@@ -0,0 +1,122 @@
+import os
+import tempfile
+
+from src.core.db import get_connection, init_db
+from src.repos.agents_repo import create_agent, get_agent
+from src.repos.chat_repo import create_chat, get_chat, get_message_page, list_chats
+from src.repos.session_cache import RepoCache
+from src.repos.users_repo import create_user
+
+
+def setup_temp_db():
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    os.environ["APP_DB_PATH"] = tmp.name
+    init_db()
+    return tmp.name
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _render(cache, agent_id, chat_id):
+    # O que um rerun da pagina do usuario le.
+    cache.list_agents()
+    cache.list_chats(agent_id)
+    cache.get_chat(chat_id)
+    return cache.get_message_page(chat_id, limit=3)
+
+
+def _count_queries(fn, *args):
+    statements = []
+    with get_connection() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            result = fn(*args)
+        finally:
+            conn.set_trace_callback(None)
+    return len(statements), result
+
+
+def _seed():
+    setup_temp_db()
+    uid = create_user("cache@a.com", "pw123456", "USER", True)
+    agent_id = create_agent(uid, "Agent", "Desc", "gpt-4o-mini", 256, 0.7, "Prompt")
+    chat_id = create_chat(uid, agent_id, title="Chat")
+    return uid, agent_id, chat_id
+
+
+def test_repeated_renders_hit_cache_only():
+    uid, agent_id, chat_id = _seed()
+    cache = RepoCache(uid, clock=FakeClock())
+
+    first, _ = _count_queries(_render, cache, agent_id, chat_id)
+    again, _ = _count_queries(_render, cache, agent_id, chat_id)
+
+    assert first > 0
+    assert again == 0
+    assert cache.hits == 4 and cache.misses == 4
+
+
+def test_writes_go_through_to_db_and_cache():
+    uid, agent_id, chat_id = _seed()
+    other_chat = create_chat(uid, agent_id, title="Outro")
+    cache = RepoCache(uid, clock=FakeClock())
+    _render(cache, agent_id, chat_id)
+
+    for i in range(4):
+        cache.add_message(chat_id, "user", f"m{i}", tokens=i)
+    cache.rename_chat(chat_id, "Renomeado")
+    cache.update_previous_response_id(chat_id, "resp_1")
+    cache.update_agent(agent_id, name="Novo nome", temperature=0.2)
+
+    queries, page = _count_queries(_render, cache, agent_id, chat_id)
+    assert queries == 0
+    assert page == get_message_page(chat_id, limit=3)
+    assert page["has_older"]
+    assert cache.get_chat(chat_id)["title"] == get_chat(chat_id, uid)["title"] == "Renomeado"
+    assert cache.get_chat(chat_id)["previous_response_id"] == "resp_1"
+    # Chat mexido sobe para o topo (no banco o empate no mesmo segundo nao tem ordem garantida)
+    assert [c["id"] for c in cache.list_chats(agent_id)] == [chat_id, other_chat]
+    assert {c["id"] for c in list_chats(uid, agent_id)} == {chat_id, other_chat}
+    assert cache.list_agents()[0]["name"] == get_agent(agent_id, uid)["name"] == "Novo nome"
+
+    cache.delete_chat(other_chat)
+    assert [c["id"] for c in cache.list_chats(agent_id)] == [chat_id]
+    assert get_chat(other_chat, uid) is None
+
+
+def test_record_turn_writes_through():
+    uid, agent_id, chat_id = _seed()
+    cache = RepoCache(uid, clock=FakeClock())
+    _render(cache, agent_id, chat_id)
+
+    first = cache.record_turn(chat_id, "pergunta", "resposta", input_tokens=5, output_tokens=7, previous_response_id="resp_2")
+    second = cache.record_turn(chat_id, "outra", "mais uma")
+
+    queries, page = _count_queries(_render, cache, agent_id, chat_id)
+    assert queries == 0
+    assert page == get_message_page(chat_id, limit=3)
+    assert [m["id"] for m in page["messages"]] == [first[1], *second]
+    assert cache.get_chat(chat_id)["previous_response_id"] == get_chat(chat_id, uid)["previous_response_id"] == "resp_2"
+
+
+def test_ttl_and_lru_bound():
+    uid, agent_id, chat_id = _seed()
+    clock = FakeClock()
+    cache = RepoCache(uid, max_entries=2, ttl=10, clock=clock)
+
+    cache.list_agents()
+    create_agent(uid, "Externo", "Desc", "gpt-4o-mini", 256, 0.7, "Prompt")  # fora do cache
+    assert len(cache.list_agents()) == 1
+    clock.now = 11
+    assert len(cache.list_agents()) == 2
+
+    cache.list_chats(agent_id)
+    cache.get_chat(chat_id)
+    assert len(cache._entries) == 2
+    assert ("agents",) not in cache._entries
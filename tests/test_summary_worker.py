@@ -0,0 +1,227 @@
+import os
+import tempfile
+import threading
+
+import pytest
+
+from src.core.db import init_db
+from src.repos.users_repo import create_user
+from src.repos.agents_repo import create_agent
+from src.repos.chat_repo import add_message, create_chat, delete_chat, get_chat
+from src.repos.summary_jobs_repo import (
+    claim_summary_job,
+    count_open_summary_jobs,
+    enqueue_summary_job,
+    fail_summary_job,
+    get_summary_job,
+    get_summary_token_stats,
+)
+from src.agents import service as agents_service
+from src.agents.summary_worker import SummaryWorker
+
+
+def setup_temp_db():
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    os.environ["APP_DB_PATH"] = tmp.name
+    init_db()
+    return tmp.name
+
+
+def _new_chat(email):
+    uid = create_user(email, "pw123456", "USER", True)
+    agent_id = create_agent(uid, "Agent", None, "gpt-4o-mini", 256, 0.7, "Prompt")
+    chat_id = create_chat(uid, agent_id, title="Chat")
+    add_message(chat_id, "user", "Como configuro um agente?")
+    add_message(chat_id, "assistant", "Ajuste modelo e prompt.")
+    return uid, chat_id
+
+
+def test_repeated_requests_are_deduplicated_per_chat():
+    setup_temp_db()
+    uid, chat_id = _new_chat("s1@a.com")
+    calls = []
+
+    def fake_summary(messages):
+        calls.append(len(messages))
+        return "Configuração de agentes."
+
+    assert enqueue_summary_job(chat_id, uid) == 1
+    assert enqueue_summary_job(chat_id, uid) == 2
+    add_message(chat_id, "user", "E o histórico?")
+    enqueue_summary_job(chat_id, uid)
+
+    worker = SummaryWorker(summarize=fake_summary)
+    assert worker.drain() is True
+
+    assert calls == [3]  # um unico resumo, ja com a ultima mensagem
+    assert get_chat(chat_id, uid)["conversation_topic_summary"] == "Configuração de agentes."
+    assert get_summary_job(chat_id) is None
+
+
+def test_request_arriving_during_summary_is_recomputed():
+    setup_temp_db()
+    uid, chat_id = _new_chat("s2@a.com")
+    calls, during = [], []
+
+    def slow_summary(messages, previous_summary=None):
+        calls.append(len(messages))
+        if len(calls) == 1:
+            # novo turno chega enquanto o primeiro resumo esta sendo gerado
+            add_message(chat_id, "user", "Nova pergunta")
+            enqueue_summary_job(chat_id, uid)
+            # o pedido continua com este worker: outro nao pega o mesmo chat
+            during.append((get_summary_job(chat_id)["status"], claim_summary_job()))
+        return f"Resumo {len(calls)}"
+
+    enqueue_summary_job(chat_id, uid)
+    SummaryWorker(summarize=slow_summary, every_n_turns=1).drain()
+
+    assert during == [("running", None)]
+    # o resumo da versao velha e descartado; o novo cobre a conversa inteira
+    assert calls == [2, 3]
+    assert get_chat(chat_id, uid)["conversation_topic_summary"] == "Resumo 2"
+    assert get_summary_token_stats()["summaries"] == 1
+    assert count_open_summary_jobs() == 0
+
+
+def test_stale_failure_requeues_newer_version():
+    setup_temp_db()
+    uid, chat_id = _new_chat("s6@a.com")
+    enqueue_summary_job(chat_id, uid)
+    assert claim_summary_job()["version"] == 1
+    assert enqueue_summary_job(chat_id, uid) == 2
+
+    fail_summary_job(chat_id, 1, "timeout")
+
+    job = get_summary_job(chat_id)
+    assert (job["status"], job["version"]) == ("pending", 2)
+    assert claim_summary_job()["version"] == 2
+
+
+def test_failed_summary_is_retried_then_marked_failed():
+    setup_temp_db()
+    uid, chat_id = _new_chat("s3@a.com")
+    attempts = []
+
+    def broken(messages):
+        attempts.append(1)
+        raise RuntimeError("timeout")
+
+    enqueue_summary_job(chat_id, uid)
+    SummaryWorker(summarize=broken, max_attempts=2).drain()
+
+    job = get_summary_job(chat_id)
+    assert len(attempts) == 2
+    assert job["status"] == "failed"
+    assert job["last_error"] == "timeout"
+
+
+def test_api_error_is_retried_instead_of_saving_fallback(monkeypatch: pytest.MonkeyPatch):
+    setup_temp_db()
+    uid, chat_id = _new_chat("s7@a.com")
+
+    def _boom():
+        raise RuntimeError("rate limit")
+
+    monkeypatch.setattr(agents_service, "get_openai_client", _boom)
+    enqueue_summary_job(chat_id, uid)
+    SummaryWorker(max_attempts=2).drain()
+
+    job = get_summary_job(chat_id)
+    assert (job["status"], job["attempts"], job["last_error"]) == ("failed", 2, "rate limit")
+    assert get_chat(chat_id, uid)["conversation_topic_summary"] != "(resumo indisponível)"
+    assert get_summary_token_stats()["summaries"] == 0
+
+
+def test_concurrent_start_spawns_one_set_of_threads():
+    setup_temp_db()
+    worker = SummaryWorker(summarize=lambda messages: "x", threads=2)
+    callers = [threading.Thread(target=worker.start) for _ in range(8)]
+    try:
+        for t in callers:
+            t.start()
+        for t in callers:
+            t.join()
+        assert len(worker._threads) == 2
+    finally:
+        worker.stop(timeout=5)
+
+
+def test_background_threads_process_queue_and_drain_waits():
+    setup_temp_db()
+    uid, chat_id = _new_chat("s4@a.com")
+    worker = SummaryWorker(summarize=lambda messages: "Resumo em background", threads=2)
+    worker.start()
+    try:
+        enqueue_summary_job(chat_id, uid)
+        worker.notify()
+        assert worker.drain(timeout=5) is True
+    finally:
+        worker.stop(timeout=5)
+
+    assert get_chat(chat_id, uid)["conversation_topic_summary"] == "Resumo em background"
+
+
+def test_deleting_chat_drops_queued_job():
+    setup_temp_db()
+    uid, chat_id = _new_chat("s5@a.com")
+    enqueue_summary_job(chat_id, uid)
+    delete_chat(chat_id, uid)
+    assert claim_summary_job() is None
+
+
+def _turn(chat_id, uid, question, answer="Certo."):
+    add_message(chat_id, "user", question)
+    add_message(chat_id, "assistant", answer)
+    enqueue_summary_job(chat_id, uid)
+
+
+def test_incremental_summaries_are_debounced_every_n_turns():
+    setup_temp_db()
+    uid, chat_id = _new_chat("s6@a.com")
+    calls = []
+
+    def fake_summary(messages, previous_summary=None):
+        calls.append((previous_summary, [m["content"] for m in messages]))
+        return "Configuração de agentes e prompts."
+
+    worker = SummaryWorker(summarize=fake_summary, every_n_turns=2)
+    enqueue_summary_job(chat_id, uid)
+    worker.drain()
+    assert calls[0][0] is None  # primeiro resumo: transcricao completa
+
+    _turn(chat_id, uid, "Posso mudar o prompt do agente?")
+    worker.drain()
+    assert len(calls) == 1  # 1 turno novo < 2: adiado
+
+    _turn(chat_id, uid, "E a temperatura do agente?")
+    worker.drain()
+    assert len(calls) == 2
+    previous, sent = calls[1]
+    assert previous == "Configuração de agentes e prompts."
+    # so os dois turnos novos, nao a conversa inteira
+    assert sent == ["Posso mudar o prompt do agente?", "Certo.", "E a temperatura do agente?", "Certo."]
+
+    stats = get_summary_token_stats()
+    assert stats["summaries"] == 2
+    assert stats["skipped"] == 1
+    assert stats["tokens_saved"] > 0
+
+
+def test_topic_drift_forces_summary_before_n_turns():
+    setup_temp_db()
+    uid, chat_id = _new_chat("s7@a.com")
+    calls = []
+
+    def fake_summary(messages, previous_summary=None):
+        calls.append(previous_summary)
+        return "Configuração de agentes e prompts."
+
+    worker = SummaryWorker(summarize=fake_summary, every_n_turns=5)
+    enqueue_summary_job(chat_id, uid)
+    worker.drain()
+
+    _turn(chat_id, uid, "Qual receita tradicional de bolo chocolate cremoso?")
+    worker.drain()
+
+    assert calls == [None, "Configuração de agentes e prompts."]
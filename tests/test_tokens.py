@@ -0,0 +1,162 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+from src.agents import service as agents_service
+from src.core import tokens
+from src.core.config import clear_settings_cache
+from src.core.tokens import TokenLimitError, count_tokens, estimate_request, model_family, truncate_tokens
+
+
+class WordEncoder:
+    """Encoder de mentira: um token por palavra."""
+
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+    def decode(self, parts):
+        return " ".join(parts)
+
+
+@pytest.fixture
+def settings(monkeypatch: pytest.MonkeyPatch):
+    def apply(**values):
+        for key, value in values.items():
+            monkeypatch.setenv(key, str(value))
+        clear_settings_cache()
+
+    yield apply
+    clear_settings_cache()
+
+
+@pytest.fixture
+def offline_client(monkeypatch: pytest.MonkeyPatch):
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        return SimpleNamespace(output_text="ok", id="resp_1", usage=None)
+
+    monkeypatch.setattr(agents_service, "get_openai_client", lambda: SimpleNamespace(responses=SimpleNamespace(create=create)))
+    return calls
+
+
+def test_model_family_and_heuristic_fallback(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(tokens, "get_encoder", lambda encoding: None)
+
+    assert model_family("gpt-4o-mini") == ("o200k_base", 128000)
+    assert model_family("gpt-3.5-turbo") == ("cl100k_base", 16385)
+    assert model_family("modelo-novo") == ("o200k_base", 128000)
+    assert count_tokens("abcdefgh", "gpt-4o") == 2 and count_tokens("", "gpt-4o") == 0
+    assert truncate_tokens("abcdefghij", 2) == "abcdefgh"
+
+
+@pytest.fixture
+def no_encoders(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(tokens, "_encoders", {})
+    monkeypatch.setattr(tokens, "_warm_thread", None)
+    monkeypatch.setattr(tokens, "_next_warm", 0.0)
+    return tokens._encoders
+
+
+def test_real_tokenizer_when_available(settings, no_encoders):
+    tiktoken = pytest.importorskip("tiktoken")
+    if not os.environ.get("TIKTOKEN_CACHE_DIR"):
+        pytest.skip("TIKTOKEN_CACHE_DIR nao configurado")
+    settings(TIKTOKEN_CACHE_DIR=os.environ["TIKTOKEN_CACHE_DIR"])
+    if not tokens.load_encoder("o200k_base"):
+        pytest.skip("encoding o200k_base indisponivel no cache do tiktoken")
+    text = "Qual é o prazo de entrega do contrato? <|endoftext|>"
+
+    expected = len(tiktoken.get_encoding("o200k_base").encode(text, disallowed_special=()))
+    assert count_tokens(text, "gpt-4o-mini") == expected
+    assert count_tokens(truncate_tokens(text, 5, "gpt-4o-mini"), "gpt-4o-mini") <= 5
+
+
+def test_encoder_loads_off_request_path_and_failures_are_retried(monkeypatch: pytest.MonkeyPatch, settings, no_encoders):
+    attempts = []
+
+    def get_encoding(name):
+        attempts.append(name)
+        if len(attempts) == 1:
+            raise OSError("sem rede")
+        return WordEncoder()
+
+    monkeypatch.setitem(sys.modules, "tiktoken", SimpleNamespace(get_encoding=get_encoding))
+    started = []
+    monkeypatch.setattr(tokens, "warm_encoders", lambda: started.append(1))
+
+    # Nada carregado: a contagem nao espera o tokenizer e so agenda a carga em segundo plano
+    assert count_tokens("abcdefghijklmnop", "gpt-4o") == 4 and started and attempts == []
+
+    settings(TIKTOKEN_CACHE_DIR="")
+    assert tokens.load_encoder("o200k_base") is False and attempts == []  # sem cache local, sem rede
+
+    settings(TIKTOKEN_CACHE_DIR="/tmp/tiktoken-cache")
+    assert tokens.load_encoder("o200k_base") is False
+    assert tokens.load_encoder("o200k_base") is True  # a falha nao ficou memorizada
+    assert count_tokens("abcdefghijklmnop", "gpt-4o") == 1 and isinstance(tokens.get_encoder("o200k_base"), WordEncoder)
+
+
+def test_encoder_is_picked_per_family(monkeypatch: pytest.MonkeyPatch):
+    seen = []
+    monkeypatch.setattr(tokens, "get_encoder", lambda encoding: seen.append(encoding) or WordEncoder())
+
+    assert count_tokens("um dois tres", "gpt-3.5-turbo") == 3
+    assert truncate_tokens("um dois tres", 2, "gpt-4o") == "um dois"
+    assert seen == ["cl100k_base", "o200k_base"]
+
+
+def test_estimate_counts_payload_and_prices_max_output(monkeypatch: pytest.MonkeyPatch, settings):
+    monkeypatch.setattr(tokens, "get_encoder", lambda encoding: WordEncoder())
+    settings(COMPLIANCE_PRICING_VERSION="v2", MAX_INPUT_TOKENS=0)
+    payload = {
+        "model": "gpt-4o-mini",
+        "instructions": "seja breve",
+        "input": [{"role": "user", "content": [{"type": "input_text", "text": "qual o prazo"}]}],
+        "max_output_tokens": 1000,
+    }
+
+    estimate = estimate_request(payload)
+
+    assert estimate["input_tokens"] == 2 + 3 + tokens.MESSAGE_OVERHEAD_TOKENS
+    assert estimate["limit"] == 128000 - 1000
+    assert estimate["cost"] == pytest.approx(9 / 1000 * 0.00015 + 0.0006)
+
+
+def test_oversized_message_is_rejected_before_the_call(monkeypatch: pytest.MonkeyPatch, settings, offline_client):
+    monkeypatch.setattr(tokens, "get_encoder", lambda encoding: WordEncoder())
+    settings(MAX_INPUT_TOKENS=20)
+
+    with pytest.raises(TokenLimitError) as exc:
+        agents_service.run_agent_chat({"model": "gpt-4o-mini"}, "palavra " * 30)
+
+    assert exc.value.limit == 20 and isinstance(exc.value, ValueError)
+    assert offline_client == []
+
+
+def test_document_text_is_trimmed_to_fit(monkeypatch: pytest.MonkeyPatch, settings, offline_client):
+    monkeypatch.setattr(tokens, "get_encoder", lambda encoding: WordEncoder())
+    settings(MAX_INPUT_TOKENS=30)
+    document = " ".join(f"trecho{i}" for i in range(100))
+
+    agents_service.run_agent_chat({"model": "gpt-4o-mini"}, "resuma o anexo", document_text=document)
+
+    sent = offline_client[0]
+    text = sent["input"][0]["content"][0]["text"]
+    assert text.startswith("trecho0 trecho1") and "trecho99" not in text
+    assert tokens.payload_input_tokens(sent) <= 30
+    assert sent["input"][0]["content"][1]["text"] == "resuma o anexo"
+
+
+def test_summary_input_respects_cap(monkeypatch: pytest.MonkeyPatch, settings):
+    monkeypatch.setattr(tokens, "get_encoder", lambda encoding: WordEncoder())
+    settings(MAX_INPUT_TOKENS=80)
+    messages = [{"role": "user", "content": "assunto " * 300}]
+
+    payload = agents_service._compliance_summary_payload(messages)
+
+    assert tokens.payload_input_tokens(payload) <= 80
+    assert payload["input"].startswith("Resuma o assunto principal")
@@ -0,0 +1,244 @@
+import os
+import sqlite3
+import tempfile
+
+import pytest
+
+from src.core.config import clear_settings_cache
+from src.core.db import get_connection, init_db, transaction
+from src.core.migrations import MIGRATIONS, LATEST_VERSION
+from src.repos.agents_repo import create_agent, delete_agent
+from src.repos.chat_repo import (
+    add_chat_test_message,
+    add_message,
+    create_chat,
+    delete_chat,
+    get_chat,
+    get_messages,
+    record_test_turn,
+    record_turn,
+)
+from src.repos.compliance_repo import get_compliance_filter_options, query_compliance
+from src.repos.usage_repo import get_daily_usage, get_usage_kpis
+from src.repos.users_repo import create_user
+
+
+def setup_temp_db():
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    os.environ["APP_DB_PATH"] = tmp.name
+    init_db()
+    return tmp.name
+
+
+def test_writes_maintain_rollup_and_match_audit_totals():
+    setup_temp_db()
+    uid = create_user("r@a.com", "pw123456", "USER", True)
+    agent_id = create_agent(uid, "Agente R", "Desc", "gpt-4o-mini", 256, 0.7, "P")
+    chat_id = create_chat(uid, agent_id)
+    add_message(chat_id, "user", "oi", tokens=120)
+    add_message(chat_id, "assistant", "ola", tokens=80, attachment_filename="a.pdf")
+    add_chat_test_message(uid, "user", "teste", agent_id=agent_id, tokens=40)
+    add_chat_test_message(uid, "assistant", "resp", agent_id=agent_id, tokens=999)  # fora da auditoria
+    add_chat_test_message(uid, "user", "rascunho", tokens=10, model="gpt-3.5-turbo", agent_name="Rascunho")
+
+    kpis = get_usage_kpis()
+    audit = query_compliance()
+    assert kpis["tokens"] == audit["tokens"] == 250
+    assert kpis["cost"] == pytest.approx(audit["cost"])
+    assert kpis["messages"] == audit["messages"] == 4 and kpis["attachments"] == 1
+
+    assert get_usage_kpis(origin="Teste")["tokens"] == 50
+    assert get_usage_kpis(agents=["Rascunho"])["tokens"] == 10
+    assert get_usage_kpis(users=["outro@a.com"])["tokens"] == 0
+
+    daily = get_daily_usage()
+    assert len(daily) == 1 and int(daily["Tokens"].iloc[0]) == 250
+
+    with get_connection() as conn:
+        rows = conn.execute("SELECT model, origin, tokens FROM usage_daily ORDER BY origin, model").fetchall()
+    assert [tuple(r) for r in rows] == [
+        ("gpt-4o-mini", "Conversa", 200),
+        ("gpt-3.5-turbo", "Teste", 10),
+        ("gpt-4o-mini", "Teste", 40),
+    ]
+
+
+def test_record_turn_commits_once_with_same_rollup():
+    setup_temp_db()
+    uid = create_user("t@a.com", "pw123456", "USER", True)
+    other = create_user("o@a.com", "pw123456", "USER", True)
+    agent_id = create_agent(uid, "Agente T", "Desc", "gpt-4o-mini", 256, 0.7, "P")
+    chat_id = create_chat(uid, agent_id)
+
+    statements = []
+    with get_connection() as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            ids = record_turn(
+                chat_id, uid, "oi", "ola", input_tokens=120, output_tokens=80,
+                attachment_filename="C:\\tmp\\a.pdf", previous_response_id="resp_1",
+            )
+            record_test_turn(uid, "teste", "resp", agent_id=agent_id, input_tokens=40, output_tokens=999)
+        finally:
+            conn.set_trace_callback(None)
+    assert sum(s.strip().upper() == "COMMIT" for s in statements) == 2
+
+    messages = get_messages(chat_id)
+    assert ids == (messages[0]["id"], messages[1]["id"])
+    assert [(m["role"], m["content"], m["tokens"]) for m in messages] == [("user", "oi", 120), ("assistant", "ola", 80)]
+    assert get_chat(chat_id, uid)["previous_response_id"] == "resp_1"
+    with get_connection() as conn:
+        names = [r[0] for r in conn.execute("SELECT attachment_filename FROM chat_messages ORDER BY id")]
+        test_roles = [r[0] for r in conn.execute("SELECT role FROM chat_test_messages ORDER BY id")]
+    assert names == ["a.pdf", None] and test_roles == ["user", "assistant"]
+
+    # Mesmos totais que as escritas uma a uma (o assistente do Chat Testes fica fora)
+    kpis = get_usage_kpis()
+    assert kpis["tokens"] == query_compliance()["tokens"] == 240
+    assert kpis["messages"] == 3 and kpis["attachments"] == 1
+
+    # Chat de outro usuario: nada e gravado
+    assert record_turn(chat_id, other, "x", "y") is None
+    assert len(get_messages(chat_id)) == 2
+
+
+def test_migration_backfills_existing_history():
+    path = setup_temp_db()
+    uid = create_user("b@a.com", "pw123456", "USER", True)
+    agent_id = create_agent(uid, "Agente B", "Desc", "gpt-4o", 256, 0.7, "P")
+    chat_id = create_chat(uid, agent_id)
+    add_message(chat_id, "user", "oi", tokens=300)
+    with transaction() as conn:
+        conn.execute("UPDATE chat_messages SET created_at = '2024-03-01 10:00:00'")
+        conn.execute("DELETE FROM usage_daily")
+
+    # Reaplica so a migracao do rollup sobre o historico
+    step = next(fn for version, _desc, fn in MIGRATIONS if version == 5)
+    raw = sqlite3.connect(path)
+    step(raw.cursor())
+    raw.commit()
+    raw.close()
+
+    daily = get_daily_usage(date_from="2024-03-01", date_to="2024-03-31")
+    assert daily["Dia"].astype(str).tolist() == ["2024-03-01"]
+    assert get_usage_kpis()["cost"] == pytest.approx(300 / 1000 * 0.03)
+    assert LATEST_VERSION >= 5
+
+
+def test_cost_follows_current_pricing_version(monkeypatch: pytest.MonkeyPatch):
+    setup_temp_db()
+    uid = create_user("p@a.com", "pw123456", "USER", True)
+    agent_id = create_agent(uid, "Agente P", "Desc", "gpt-4o-mini", 256, 0.7, "P")
+    add_message(create_chat(uid, agent_id), "user", "oi", tokens=1000)
+    add_chat_test_message(uid, "user", "rascunho", tokens=1000, model="gpt-4o", agent_name="Rascunho")
+
+    # Tabela trocada depois da gravacao: rollup e auditoria precificam igual
+    monkeypatch.setenv("COMPLIANCE_PRICING_VERSION", "v2")
+    clear_settings_cache()
+    try:
+        expected = (0.00015 + 0.0006) / 2 + (0.0025 + 0.01) / 2
+        assert get_usage_kpis()["cost"] == pytest.approx(query_compliance()["cost"]) == pytest.approx(expected)
+        assert get_daily_usage()["Custo ($)"].sum() == pytest.approx(expected)
+        assert get_usage_kpis(pricing_version="v1")["cost"] == pytest.approx(query_compliance(pricing_version="v1")["cost"])
+    finally:
+        clear_settings_cache()
+
+
+def test_deletes_keep_rollup_in_sync_with_audit():
+    setup_temp_db()
+    uid = create_user("d@a.com", "pw123456", "USER", True)
+    other = create_user("x@a.com", "pw123456", "USER", True)
+    agent_a = create_agent(uid, "Agente A", "Desc", "gpt-4o-mini", 256, 0.7, "P")
+    agent_b = create_agent(uid, "Agente B", "Desc", "gpt-4o", 256, 0.7, "P")
+    kept = create_chat(uid, agent_a)
+    dropped = create_chat(uid, agent_a)
+    add_message(kept, "user", "oi", tokens=100)
+    add_message(dropped, "user", "oi", tokens=50, attachment_filename="a.pdf")
+    add_message(dropped, "assistant", "ola", tokens=30)
+    add_message(create_chat(uid, agent_b), "user", "oi", tokens=70)
+
+    def assert_in_sync(tokens, messages, attachments):
+        kpis, audit = get_usage_kpis(), query_compliance()
+        assert kpis["tokens"] == audit["tokens"] == tokens
+        assert kpis["cost"] == pytest.approx(audit["cost"])
+        assert kpis["messages"] == audit["messages"] == messages
+        assert kpis["attachments"] == attachments
+
+    assert_in_sync(250, 4, 1)
+
+    delete_chat(dropped, other)  # chat de outro usuario: nada muda
+    assert_in_sync(250, 4, 1)
+
+    delete_chat(dropped, uid)
+    assert_in_sync(170, 2, 0)
+
+    delete_agent(agent_b, uid)
+    assert_in_sync(100, 1, 0)
+    with get_connection() as conn:
+        rows = conn.execute("SELECT agent_id, tokens, messages FROM usage_daily").fetchall()
+    assert [tuple(r) for r in rows] == [(agent_a, 100, 1)]
+
+
+def test_comparison_turns_are_booked_under_the_model_that_answered():
+    setup_temp_db()
+    uid = create_user("cmp@a.com", "pw123456", "USER", True)
+    agent_id = create_agent(uid, "Agente C", "Desc", "gpt-4o", 256, 0.7, "P")
+    record_test_turn(uid, "oi", "ola", agent_id=agent_id, input_tokens=1000, output_tokens=500, model="gpt-4o")
+    record_test_turn(uid, "oi", "ola", agent_id=agent_id, input_tokens=1000, output_tokens=500, model="gpt-4o-mini")
+    record_test_turn(uid, "oi", "ola", agent_id=agent_id, input_tokens=300)  # sem modelo: o do agente
+
+    with get_connection() as conn:
+        rows = conn.execute(
+            "SELECT agent_id, model, origin, tokens, messages FROM usage_daily ORDER BY model"
+        ).fetchall()
+    assert [tuple(r) for r in rows] == [
+        (agent_id, "gpt-4o", "Teste", 1300, 2),
+        (agent_id, "gpt-4o-mini", "Teste", 1000, 1),
+    ]
+
+    kpis, audit = get_usage_kpis(), query_compliance()
+    assert kpis["tokens"] == audit["tokens"] == 2300
+    assert kpis["cost"] == pytest.approx(audit["cost"])
+    assert sorted(audit["rows"]["Modelo"]) == ["gpt-4o", "gpt-4o", "gpt-4o-mini"]
+
+
+def test_rollup_and_audit_share_dates_and_labels():
+    path = setup_temp_db()
+    uid = create_user("s@a.com", "pw123456", "USER", True)
+    agent_a = create_agent(uid, "Agente A", "Desc", "gpt-4o", 256, 0.7, "P")
+    agent_b = create_agent(uid, "Agente B", "Desc", "gpt-4o-mini", 256, 0.7, "P")
+    chat_id = create_chat(uid, agent_a)
+    first = add_message(chat_id, "user", "oi", tokens=100)
+    add_message(chat_id, "assistant", "ola", tokens=50, attachment_filename="a.pdf")
+    record_test_turn(uid, "oi", "ola", agent_id=agent_b, input_tokens=30, agent_name="Nome antigo")
+    record_test_turn(uid, "oi", "ola", input_tokens=20, model="gpt-4o", agent_name="Rascunho")
+    delete_agent(agent_b, uid)
+
+    # Conversa que atravessa dois dias; rollup refeito pelo backfill da migracao 5.
+    with transaction() as conn:
+        conn.execute("UPDATE chat_messages SET created_at = '2024-03-02 09:00:00'")
+        conn.execute("UPDATE chat_messages SET created_at = '2024-03-01 23:00:00' WHERE id = ?", (first,))
+        conn.execute("UPDATE chat_test_messages SET created_at = '2024-03-02 10:00:00'")
+        conn.execute("DELETE FROM usage_daily")
+    step = next(fn for version, _desc, fn in MIGRATIONS if version == 5)
+    raw = sqlite3.connect(path)
+    step(raw.cursor())
+    raw.commit()
+    raw.close()
+
+    periods = [(None, None), ("2024-03-01", "2024-03-01"), ("2024-03-02", "2024-03-02")]
+    labels = [None, ["Agente A"], ["(Em configuração)"], ["Rascunho"], ["Nome antigo"]]
+    for date_from, date_to in periods:
+        for agents in labels:
+            kpis = get_usage_kpis(agents=agents, date_from=date_from, date_to=date_to)
+            audit = query_compliance(agents=agents, date_from=date_from, date_to=date_to)
+            assert (kpis["tokens"], kpis["messages"]) == (audit["tokens"], audit["messages"]), (date_from, agents)
+            assert kpis["cost"] == pytest.approx(audit["cost"])
+            assert get_daily_usage(agents=agents, date_from=date_from, date_to=date_to)["Tokens"].tolist() == (
+                audit["daily"]["Tokens"].tolist()
+            )
+
+    assert query_compliance(date_from="2024-03-01", date_to="2024-03-01")["tokens"] == 100
+    assert get_usage_kpis(agents=["(Em configuração)"])["tokens"] == 30
+    assert query_compliance(has_attachment=True)["daily"]["Tokens"].tolist() == [100, 50]
+    assert "Nome antigo" not in get_compliance_filter_options()["agents"]